@@ -0,0 +1,278 @@
+"""
+Contrôle d'admission des endpoints coûteux (/chat, /analyze...) : la surcharge est refusée vite.
+
+Deux niveaux, vérifiés avant tout travail :
+- limites de débit par IP et par session (fenêtre glissante, compteurs dans le backend
+  d'état partagé : communes à tous les workers) -> 429 + Retry-After ;
+- limite de concurrence par type d'endpoint (par worker), avec une file d'attente bornée
+  en taille et en temps : file pleine ou attente trop longue -> 503 + Retry-After.
+
+Une requête admise garde toute sa place : le nombre de requêtes en cours ne dépasse jamais
+la limite, sa latence ne dépend donc pas du nombre de requêtes refusées. Son délai de bout
+en bout (core.deadlines) démarre après l'admission.
+
+Une requête admise s'exécute dans la voie de son type d'endpoint (core.lanes) : "chat"
+en voie interactive, "analysis" en voie batch.
+"""
+import os
+import time
+import math
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional
+
+from core.lanes import BATCH, INTERACTIVE, use_lane
+from core.profiling import span
+from core.state import get_state_backend
+
+CHAT_MAX_CONCURRENCY = int(os.getenv("CHAT_MAX_CONCURRENCY", "16"))  # par worker
+CHAT_QUEUE_SIZE = int(os.getenv("CHAT_QUEUE_SIZE", "32"))
+CHAT_MAX_WAIT = float(os.getenv("CHAT_MAX_WAIT", "10"))  # attente max dans la file (secondes)
+ANALYSIS_MAX_CONCURRENCY = int(os.getenv("ANALYSIS_MAX_CONCURRENCY", "2"))
+ANALYSIS_QUEUE_SIZE = int(os.getenv("ANALYSIS_QUEUE_SIZE", "4"))
+ANALYSIS_MAX_WAIT = float(os.getenv("ANALYSIS_MAX_WAIT", "30"))
+
+# Requêtes par fenêtre (0 = pas de limite)
+RATE_LIMIT_WINDOW_SECONDS = float(os.getenv("RATE_LIMIT_WINDOW_SECONDS", "60"))
+CHAT_RATE_LIMIT_PER_IP = int(os.getenv("CHAT_RATE_LIMIT_PER_IP", "60"))
+CHAT_RATE_LIMIT_PER_SESSION = int(os.getenv("CHAT_RATE_LIMIT_PER_SESSION", "20"))
+ANALYSIS_RATE_LIMIT_PER_IP = int(os.getenv("ANALYSIS_RATE_LIMIT_PER_IP", "10"))
+ANALYSIS_RATE_LIMIT_PER_SESSION = int(os.getenv("ANALYSIS_RATE_LIMIT_PER_SESSION", "5"))
+# Derrière un proxy (Railway, Vercel...) : IP du client lue dans X-Forwarded-For
+TRUST_PROXY_HEADERS = os.getenv("TRUST_PROXY_HEADERS", "false").lower() == "true"
+
+# Durée de service initiale (secondes) pour estimer Retry-After avant les premières mesures
+_INITIAL_SERVICE_TIME = {"chat": 5.0, "analysis": 60.0}
+_SERVICE_TIME_SMOOTHING = 0.2
+
+
+class AdmissionRejected(Exception):
+    """Requête refusée avant exécution ; le client peut réessayer après retry_after secondes"""
+
+    status_code = 503
+
+    def __init__(self, message: str, retry_after: float):
+        self.retry_after = max(1.0, retry_after)
+        super().__init__(message)
+
+
+class RateLimited(AdmissionRejected):
+    """Limite de débit par IP ou par session atteinte (429)"""
+
+    status_code = 429
+
+
+class Overloaded(AdmissionRejected):
+    """File d'attente pleine ou attente trop longue (503)"""
+
+
+class ConcurrencyLimiter:
+    """
+    Limite de requêtes simultanées avec file d'attente FIFO bornée
+
+    Une place libérée passe directement au premier de la file : une requête arrivée
+    entre-temps ne la lui prend pas. Un seul event loop par worker : pas de verrou.
+
+    Args:
+        name: Nom du type d'endpoint ("chat", "analysis")
+        limit: Requêtes exécutées simultanément
+        queue_size: Requêtes en attente au plus (au-delà : refus immédiat)
+        max_wait: Attente maximale dans la file en secondes
+    """
+
+    def __init__(self, name: str, limit: int, queue_size: int, max_wait: float):
+        self.name = name
+        self.limit = max(1, limit)
+        self.queue_size = max(0, queue_size)
+        self.max_wait = max_wait
+        self.active = 0
+        self._waiters: deque = deque()
+        self._service_time = _INITIAL_SERVICE_TIME.get(name, 10.0)
+        self.admitted = 0
+        self.queued = 0
+        self.rejected_full = 0
+        self.rejected_timeout = 0
+        self.total_wait = 0.0
+        self.max_wait_seen = 0.0
+
+    def retry_after(self) -> float:
+        """Temps estimé avant qu'une place se libère pour une nouvelle requête"""
+        ahead = len(self._waiters) + 1
+        return math.ceil(self._service_time * ahead / self.limit)
+
+    async def acquire(self) -> None:
+        """
+        Attend une place
+
+        Raises:
+            Overloaded: File pleine, ou pas de place après max_wait secondes
+        """
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            self.admitted += 1
+            return
+        if len(self._waiters) >= self.queue_size:
+            self.rejected_full += 1
+            raise Overloaded(f"Serveur saturé ({self.name}) : réessayez plus tard", self.retry_after())
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        self.queued += 1
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=self.max_wait)
+        except asyncio.TimeoutError:
+            if future in self._waiters:
+                self._waiters.remove(future)
+            # Sinon la place a été transmise au moment de l'expiration : on la garde
+            if not future.done():
+                future.cancel()
+                self.rejected_timeout += 1
+                raise Overloaded(
+                    f"Serveur saturé ({self.name}) : pas de place après {self.max_wait:.0f}s", self.retry_after()
+                )
+        except asyncio.CancelledError:
+            if future in self._waiters:
+                self._waiters.remove(future)
+            elif future.done() and not future.cancelled():
+                # La place venait de nous être transmise : on la rend
+                self.release()
+            raise
+        waited = time.monotonic() - started
+        self.admitted += 1
+        self.total_wait += waited
+        self.max_wait_seen = max(self.max_wait_seen, waited)
+
+    def release(self, service_time: Optional[float] = None) -> None:
+        """Libère une place (transmise au premier de la file s'il y en a un)"""
+        if service_time is not None:
+            self._service_time += _SERVICE_TIME_SMOOTHING * (service_time - self._service_time)
+        while self._waiters:
+            future = self._waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "waiting": len(self._waiters),
+            "queue_size": self.queue_size,
+            "max_wait": self.max_wait,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected_queue_full": self.rejected_full,
+            "rejected_wait_timeout": self.rejected_timeout,
+            "avg_wait_ms": round(self.total_wait / self.queued * 1000, 2) if self.queued else 0.0,
+            "max_wait_ms": round(self.max_wait_seen * 1000, 2),
+            "avg_service_seconds": round(self._service_time, 2),
+        }
+
+
+limiters: Dict[str, ConcurrencyLimiter] = {
+    "chat": ConcurrencyLimiter("chat", CHAT_MAX_CONCURRENCY, CHAT_QUEUE_SIZE, CHAT_MAX_WAIT),
+    "analysis": ConcurrencyLimiter("analysis", ANALYSIS_MAX_CONCURRENCY, ANALYSIS_QUEUE_SIZE, ANALYSIS_MAX_WAIT),
+}
+
+_LANES = {"chat": INTERACTIVE, "analysis": BATCH}
+
+_RATE_LIMITS = {
+    "chat": {"ip": CHAT_RATE_LIMIT_PER_IP, "session": CHAT_RATE_LIMIT_PER_SESSION},
+    "analysis": {"ip": ANALYSIS_RATE_LIMIT_PER_IP, "session": ANALYSIS_RATE_LIMIT_PER_SESSION},
+}
+
+
+def client_ip(request: Any) -> str:
+    """IP du client (premier saut de X-Forwarded-For si TRUST_PROXY_HEADERS)"""
+    if TRUST_PROXY_HEADERS:
+        forwarded = request.headers.get("x-forwarded-for", "")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+def check_rate_limit(kind: str, scope: str, identifier: str) -> None:
+    """
+    Compte une requête et refuse si la limite de la fenêtre glissante est dépassée
+
+    Deux fenêtres fixes consécutives, la précédente pondérée par sa part encore
+    couverte par la fenêtre glissante (approximation à deux compteurs). Les requêtes
+    refusées comptent aussi : un client qui insiste reste limité. En cas d'erreur
+    du backend d'état, la requête est acceptée.
+
+    Args:
+        kind: Type d'endpoint ("chat", "analysis")
+        scope: "ip" ou "session"
+        identifier: IP ou ID de session
+
+    Raises:
+        RateLimited: Limite atteinte
+    """
+    limit = _RATE_LIMITS[kind][scope]
+    if limit <= 0:
+        return
+    window = RATE_LIMIT_WINDOW_SECONDS
+    now = time.time()
+    current = int(now // window)
+    elapsed = now - current * window
+    key = f"ratelimit:{kind}:{scope}:{identifier}"
+    try:
+        backend = get_state_backend()
+        count = backend.incr_fields(f"{key}:{current}", {"count": 1}, ttl=2 * window)["count"]
+        previous = backend.get_fields(f"{key}:{current - 1}").get("count", 0)
+    except Exception as e:
+        print(f"⚠️ Limite de débit non vérifiée ({kind}/{scope}): {e}")
+        return
+    estimated = previous * (1 - elapsed / window) + count
+    if estimated > limit:
+        # Temps avant que la part de la fenêtre précédente ne repasse sous la limite
+        retry_after = window - elapsed
+        if previous and count <= limit:
+            retry_after = (estimated - limit) / previous * window
+        raise RateLimited(
+            f"Trop de requêtes ({limit} par {window:.0f}s par {'IP' if scope == 'ip' else 'session'})",
+            retry_after,
+        )
+
+
+@asynccontextmanager
+async def admit(kind: str, ip: Optional[str], session_id: Optional[str] = None) -> AsyncIterator[None]:
+    """
+    Admet une requête (limites de débit puis de concurrence) pour la durée du bloc,
+    exécuté dans la voie du type d'endpoint
+
+    Args:
+        kind: Type d'endpoint ("chat", "analysis")
+        ip: IP du client (cf. client_ip), None pour ne pas limiter par IP
+        session_id: Session du client, None pour ne pas limiter par session
+
+    Raises:
+        RateLimited: 429
+        Overloaded: 503
+
+    Usage:
+        async with admit("chat", client_ip(http_request), session_id):
+            result = await run_chat(message, session_id)
+    """
+    # Compteurs dans le backend d'état (Redis : appels bloquants) : hors de l'event loop
+    if ip:
+        await asyncio.to_thread(check_rate_limit, kind, "ip", ip)
+    if session_id:
+        await asyncio.to_thread(check_rate_limit, kind, "session", session_id)
+    limiter = limiters[kind]
+    with span(f"admission:{kind}"):
+        await limiter.acquire()
+    started = time.monotonic()
+    try:
+        with use_lane(_LANES[kind]):
+            yield
+    finally:
+        limiter.release(time.monotonic() - started)
+
+
+def admission_status() -> Dict[str, Any]:
+    """Occupation des files d'admission du worker (pour /health)"""
+    return {name: limiter.to_dict() for name, limiter in limiters.items()}
@@ -1,8 +1,14 @@
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Header, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse, FileResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import Optional
+from typing import Optional, Dict, Any, List
+from pydantic import Field
 import os
+import math
+import asyncio
+from urllib.parse import urlencode
 from dotenv import load_dotenv
 
 # Charger les variables d'environnement
@@ -10,12 +16,106 @@ load_dotenv()
 
 # Importer les agents (import absolu pour Railway)
 from core.reddit_agents import run_chat, clear_conversation_history
+from core.usage import get_session_usage
+from core.state import get_state_backend
+from core.workers import after_request, runs_background_tasks, worker_status
+from core.db import close_db, db_metrics, open_db
+from core.resilience import DependencyUnavailable, breaker_status
+from core.admission import AdmissionRejected, admission_status, admit, client_ip
+from core.prefetch import prefetch_status
+from core.lanes import close_openai_client, configure_openai_client, lane_status, shutdown_batch_executor
+from core.profiling import (
+    PROFILE_FORMATS,
+    PROFILE_SESSION_TTL,
+    PROFILING_ENABLED,
+    enable_session_profiling,
+    list_profiles,
+    profile_path,
+    request_profiling,
+    requested_profile_id,
+)
+from core.deadlines import (
+    CHAT_DEADLINE_SECONDS,
+    ANALYSIS_DEADLINE_SECONDS,
+    COMPARE_DEADLINE_SECONDS,
+    ClientDisconnected,
+    DeadlineExceeded,
+    run_with_deadline,
+)
+from core.functions import (
+    get_subreddit_info,
+    lookup_subreddits,
+    subreddit_cache,
+    save_analysis_report,
+    get_analysis_report
+)
+from core.exports import EXPORT_FORMATS, stream_export, export_filename
+from core.comparative import run_comparative_analysis
+from core.rendering import RENDER_FORMATS, artifact_key, get_or_render, shutdown_executor
+from core import scheduler
+from core.search import SEARCH_KINDS, SEARCH_MAX_RESULTS, search, sync_solutions_index
+from core.archive import get_archive, list_archives
+from core.pipeline import analyze_corpus, reanalyze_archived_scrape
+from core.corpus import CORPUS_MAX_POSTS, corpus_stats, parse_date
+from core import subreddit_profiles
+from core.intents import format_check_response
+
+SEARCH_SYNC_ON_STARTUP = os.getenv("SEARCH_SYNC_ON_STARTUP", "true").lower() == "true"
+# Jeton des endpoints /admin (en-tête X-Admin-Token) ; vide = endpoints d'administration désactivés
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+# Attente max des tâches de fond (run de watchlist, rafraîchissement de profil) à l'arrêt, avant annulation
+BACKGROUND_SHUTDOWN_SECONDS = float(os.getenv("BACKGROUND_SHUTDOWN_SECONDS", "10"))
+
+async def _sync_search_index():
+    try:
+        indexed = await asyncio.to_thread(sync_solutions_index)
+        print(f"🔎 Index de recherche synchronisé: {indexed} solutions")
+    except Exception as e:
+        print(f"❌ Erreur synchronisation index de recherche: {e}")
+
+async def _stop_background_task(task: asyncio.Task, name: str):
+    try:
+        # wait_for annule la tâche (et attend sa fin) au-delà du délai
+        await asyncio.wait_for(task, timeout=BACKGROUND_SHUTDOWN_SECONDS)
+    except asyncio.TimeoutError:
+        print(f"⏹️ {name} interrompu à l'arrêt (au-delà de {BACKGROUND_SHUTDOWN_SECONDS:.0f}s)")
+    except Exception as e:
+        print(f"❌ Erreur à l'arrêt de {name}: {e}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Démarrage / arrêt des ressources partagées de l'application"""
+    await open_db()
+    configure_openai_client()
+    scheduler_stop = asyncio.Event()
+    # Tâches de fond dans un seul worker (sinon runs de watchlist et rafraîchissements dupliqués)
+    background = runs_background_tasks()
+    scheduler_task = None
+    if background and scheduler.WATCHLIST_SCHEDULER_ENABLED:
+        scheduler_task = asyncio.create_task(scheduler.run_scheduler(scheduler_stop))
+    profiles_task = None
+    if background and subreddit_profiles.PROFILE_REFRESH_ENABLED:
+        profiles_task = asyncio.create_task(subreddit_profiles.run_profile_refresher(scheduler_stop))
+    sync_task = asyncio.create_task(_sync_search_index()) if background and SEARCH_SYNC_ON_STARTUP else None
+    yield
+    if sync_task:
+        await sync_task
+    scheduler_stop.set()
+    if scheduler_task:
+        await _stop_background_task(scheduler_task, "Planificateur de watchlist")
+    if profiles_task:
+        await _stop_background_task(profiles_task, "Rafraîchissement des profils")
+    shutdown_executor()
+    shutdown_batch_executor()
+    await close_openai_client()
+    await close_db()
 
 # Configuration FastAPI
 app = FastAPI(
     title="Reddit Analysis SaaS",
     description="API pour l'analyse de subreddits avec des agents IA - Version_00",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Configuration CORS
@@ -32,21 +132,69 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def worker_recycling_middleware(request: Request, call_next):
+    """Compte les requêtes du worker et le recycle au-delà du seuil mémoire"""
+    try:
+        return await call_next(request)
+    finally:
+        after_request()
+
+@app.middleware("http")
+async def profiling_middleware(request: Request, call_next):
+    """Profilage à la demande (en-tête X-Profile: 1) ; l'ID du profil revient dans X-Profile-Id"""
+    if not PROFILING_ENABLED or request.headers.get("x-profile", "").lower() not in ("1", "true"):
+        return await call_next(request)
+    request_profiling()
+    response = await call_next(request)
+    profile_id = requested_profile_id()
+    if profile_id:
+        response.headers["X-Profile-Id"] = profile_id
+    return response
+
+def _unavailable(error: DependencyUnavailable) -> HTTPException:
+    """503 avec Retry-After quand le disjoncteur d'une dépendance est ouvert"""
+    return HTTPException(
+        status_code=503,
+        detail=str(error),
+        headers={"Retry-After": str(int(error.retry_after + 0.5))}
+    )
+
+@app.exception_handler(DependencyUnavailable)
+async def dependency_unavailable_handler(request: Request, exc: DependencyUnavailable):
+    error = _unavailable(exc)
+    return JSONResponse(status_code=error.status_code, content={"detail": error.detail}, headers=error.headers)
+
+def _rejected(error: AdmissionRejected) -> HTTPException:
+    """429 (limite de débit) ou 503 (saturation) avec Retry-After, avant tout travail"""
+    return HTTPException(
+        status_code=error.status_code,
+        detail=str(error),
+        headers={"Retry-After": str(int(math.ceil(error.retry_after)))}
+    )
+
 
 # ===== MODÈLES PYDANTIC =====
 
 class ChatRequest(BaseModel):
     message: str
-    session_id: Optional[str] = "default"
+    session_id: Optional[str] = None
 
 class ChatResponse(BaseModel):
     success: bool
     response: str
     session_id: str
+    usage: Optional[Dict[str, Any]] = None
+    fast_path: Optional[str] = None
+    partial: Optional[bool] = None
+    profile_id: Optional[str] = None
 
 class SubredditCheckRequest(BaseModel):
     subreddit_name: str
 
+class SubredditLookupRequest(BaseModel):
+    names: List[str] = Field(..., min_length=1, max_length=50)
+
 class AnalysisRequest(BaseModel):
     subreddit_name: str
     num_posts: int = 5
@@ -54,13 +202,42 @@ class AnalysisRequest(BaseModel):
     sort_criteria: str = "top"
     time_filter: str = "month"
 
+class CorpusAnalysisRequest(BaseModel):
+    subreddit: str
+    num_posts: int = Field(100, ge=1, le=CORPUS_MAX_POSTS)
+    comments_limit: int = Field(10, ge=0, le=50)
+    sort_criteria: str = "top"
+    since: Optional[str] = None
+    until: Optional[str] = None
+    session_id: Optional[str] = None
+
+class CompareRequest(BaseModel):
+    subreddits: List[str] = Field(..., min_length=2, max_length=10)
+    num_posts: int = 5
+    comments_limit: int = 5
+    sort_criteria: str = "top"
+    time_filter: str = "month"
+    session_id: Optional[str] = None
+
 class ExportRequest(BaseModel):
-    format_type: str = "pdf"
+    format_type: str = "csv"
     subreddit: Optional[str] = None
 
 class ClearHistoryRequest(BaseModel):
     session_id: str
 
+class ProfilingSessionRequest(BaseModel):
+    enabled: bool = True
+    ttl: int = Field(PROFILE_SESSION_TTL, ge=1, le=86400)
+
+class WatchRequest(BaseModel):
+    subreddit: str
+    schedule: str = scheduler.DEFAULT_WATCH_SCHEDULE
+    num_posts: int = 25
+    comments_limit: int = 5
+    sort_criteria: str = "new"
+    time_filter: str = "week"
+
 
 # ===== ENDPOINTS PRINCIPAUX =====
 
@@ -74,9 +251,27 @@ async def root():
             "chat": "/chat",
             "health": "/health",
             "check_subreddit": "/check_subreddit",
+            "subreddits_lookup": "/subreddits/lookup",
+            "subreddit_profile": "/subreddits/{subreddit}/profile",
             "analyze": "/analyze",
+            "analyze_compare": "/analyze/compare",
             "export": "/export",
-            "clear_history": "/clear_history"
+            "export_solutions": "/export/solutions",
+            "export_reports": "/export/reports",
+            "render_report": "/reports/{report_id}/render",
+            "clear_history": "/clear_history",
+            "usage": "/usage/{session_id}",
+            "search": "/search",
+            "watchlist": "/watchlist",
+            "watchlist_trends": "/watchlist/{subreddit}/trends",
+            "archive_scrapes": "/archive/scrapes",
+            "archive_reanalyze": "/archive/scrapes/{archive_id}/reanalyze",
+            "corpus": "/corpus",
+            "analyze_corpus": "/analyze/corpus",
+            "db_metrics": "/metrics/db",
+            "admin_profiles": "/admin/profiles",
+            "admin_profile": "/admin/profiles/{profile_id}",
+            "admin_profiling_session": "/admin/profiling/sessions/{session_id}"
         }
     }
 
@@ -86,25 +281,55 @@ async def health():
     return {
         "status": "healthy",
         "agents": "loaded",
-        "database": "supabase_connected"
+        "database": "supabase_connected",
+        "database_pool": db_metrics(),
+        "dependencies": breaker_status(),
+        "admission": admission_status(),
+        "lanes": lane_status(),
+        "prefetch": prefetch_status(),
+        "state_backend": get_state_backend().name,
+        "worker": worker_status()
     }
 
+@app.get("/metrics/db")
+async def db_metrics_endpoint():
+    """Occupation du pool de connexions Supabase du worker"""
+    return {"success": True, "worker": os.getpid(), "pool": db_metrics()}
+
 @app.post("/chat", response_model=ChatResponse)
-async def chat_endpoint(request: ChatRequest):
+async def chat_endpoint(request: ChatRequest, http_request: Request):
     """
     Endpoint principal pour le chat avec RouterAgent
     """
     try:
         # Utiliser la fonction run_chat du système d'agents
         session_id = request.session_id or "default"
-        result = await run_chat(request.message, session_id)
+        # Sans session_id (ou "default" envoyé par le frontend), seule la limite par IP
+        # s'applique : pas de compteur de session partagé par tous ces clients
+        rate_limit_session = session_id if session_id != "default" else None
+        async with admit("chat", client_ip(http_request), rate_limit_session):
+            result = await run_with_deadline(
+                lambda: run_chat(request.message, session_id), CHAT_DEADLINE_SECONDS, http_request
+            )
         
         return ChatResponse(
             success=result["success"],
             response=result.get("response", result.get("error", "Erreur inconnue")),
-            session_id=result["session_id"]
+            session_id=result["session_id"],
+            usage=result.get("usage"),
+            fast_path=result.get("fast_path"),
+            partial=result.get("partial"),
+            profile_id=result.get("profile_id")
         )
         
+    except AdmissionRejected as e:
+        raise _rejected(e)
+    except ClientDisconnected:
+        return Response(status_code=499)
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except DependencyUnavailable as e:
+        raise _unavailable(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -114,20 +339,70 @@ async def chat_endpoint(request: ChatRequest):
 
 @app.post("/check_subreddit")
 async def check_subreddit_endpoint(request: SubredditCheckRequest):
+    """
+    Vérifie l'existence d'un subreddit directement (sans passer par le LLM)
+    """
     try:
-        message = f"Vérifie si le subreddit {request.subreddit_name} existe"
-        result = await run_chat(message, "check_subreddit")
+        name = request.subreddit_name.strip().removeprefix("/").removeprefix("r/")
+        info = await asyncio.to_thread(get_subreddit_info, name)
         
         return {
-            "success": result.get("success", False),
-            "response": result.get("response", result.get("error", "Erreur inconnue")),
-            "subreddit": request.subreddit_name
+            "success": True,
+            "response": format_check_response(info),
+            "subreddit": request.subreddit_name,
+            "info": info
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/subreddits/lookup")
+async def subreddits_lookup_endpoint(request: SubredditLookupRequest):
+    """
+    Résout plusieurs subreddits en parallèle (abonnés, titre, description),
+    avec cache positif et négatif partagé avec le RouterAgent
+    """
+    try:
+        results = await lookup_subreddits(request.names)
+        
+        return {
+            "success": True,
+            "results": results,
+            "cache_hits": sum(1 for info in results if info.get("cached")),
+            "cache": subreddit_cache.stats()
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/subreddits/{subreddit}/profile")
+async def subreddit_profile_endpoint(subreddit: str, http_request: Request, build: bool = False):
+    """
+    Profil matérialisé d'un subreddit (douleurs, solutions, dernier rapport), servi
+    immédiatement même périmé pendant un rafraîchissement en arrière-plan
+    """
+    try:
+        profile = await subreddit_profiles.get_profile(subreddit)
+        if profile is None and build:
+            async with admit("analysis", client_ip(http_request)):
+                profile = await run_with_deadline(
+                    lambda: subreddit_profiles.build_missing_profile(subreddit), ANALYSIS_DEADLINE_SECONDS, http_request
+                )
+    except AdmissionRejected as e:
+        raise _rejected(e)
+    except ClientDisconnected:
+        return Response(status_code=499)
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except DependencyUnavailable as e:
+        raise _unavailable(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    if profile is None:
+        raise HTTPException(status_code=404, detail=f"Aucun profil pour r/{subreddit} (build=true pour le calculer)")
+    return profile
+
 @app.post("/analyze")
-async def analyze_endpoint(request: AnalysisRequest):
+async def analyze_endpoint(request: AnalysisRequest, http_request: Request):
     """
     Lance une analyse complète d'un subreddit
     """
@@ -138,44 +413,432 @@ async def analyze_endpoint(request: AnalysisRequest):
         Je confirme bien que je suis sûr et je valide les paramètres.
         """
         
-        result = await run_chat(message, f"analysis_{request.subreddit_name}")
+        session_id = f"analysis_{request.subreddit_name}"
+        async with admit("analysis", client_ip(http_request)):
+            result = await run_with_deadline(
+                lambda: run_chat(message, session_id), ANALYSIS_DEADLINE_SECONDS, http_request
+            )
+        
+        # Un rapport partiel (délai dépassé) n'est pas archivé
+        report_id = None
+        if result.get("success") and not result.get("partial"):
+            report_id = await save_analysis_report(
+                request.subreddit_name,
+                request.model_dump(exclude={"subreddit_name"}),
+                result["response"],
+                session_id
+            )
         
         return {
             "success": result.get("success", False),
             "response": result.get("response", result.get("error", "Erreur inconnue")),
             "subreddit": request.subreddit_name,
+            "report_id": report_id,
             "parameters": {
                 "num_posts": request.num_posts,
                 "comments_limit": request.comments_limit,
                 "sort_criteria": request.sort_criteria,
                 "time_filter": request.time_filter
-            }
+            },
+            "partial": result.get("partial", False),
+            "usage": result.get("usage")
         }
         
+    except AdmissionRejected as e:
+        raise _rejected(e)
+    except ClientDisconnected:
+        return Response(status_code=499)
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except DependencyUnavailable as e:
+        raise _unavailable(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/export")
-async def export_endpoint(request: ExportRequest):
+def _export_response(table: str, format_type: str, subreddit: Optional[str], pain_type: Optional[str]) -> StreamingResponse:
+    if format_type not in EXPORT_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Format non supporté: {format_type} (formats: {', '.join(EXPORT_FORMATS)})"
+        )
+    filename = export_filename(table, format_type, subreddit)
+    return StreamingResponse(
+        stream_export(table, format_type, subreddit=subreddit, pain_type=pain_type),
+        media_type=EXPORT_FORMATS[format_type],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@app.post("/analyze/compare")
+async def analyze_compare_endpoint(request: CompareRequest, http_request: Request):
     """
-    Exporte les résultats d'analyse
+    Analyse comparative de plusieurs subreddits (scraping et analyse en parallèle, rapport unique)
     """
     try:
-        # Construire le message pour l'agent
-        message = f"Exporte les résultats au format {request.format_type}"
-        if request.subreddit:
-            message += f" pour le subreddit {request.subreddit}"
+        parameters = request.model_dump(exclude={"subreddits", "session_id"})
+        async with admit("analysis", client_ip(http_request), request.session_id):
+            result = await run_with_deadline(
+                lambda: run_comparative_analysis(request.subreddits, parameters, request.session_id),
+                COMPARE_DEADLINE_SECONDS,
+                http_request
+            )
         
-        result = await run_chat(message, "export_request")
-        
-        return {
-            "success": result["success"],
-            "response": result["response"],
-            "format": request.format_type
-        }
+        if result.get("success") and not result.get("partial"):
+            result["report_id"] = await save_analysis_report(
+                "+".join(s["subreddit"] for s in result["subreddits"] if s["success"]),
+                parameters,
+                result["report"],
+                result["session_id"]
+            )
+        result["parameters"] = parameters
+        return result
         
+    except AdmissionRejected as e:
+        raise _rejected(e)
+    except ClientDisconnected:
+        return Response(status_code=499)
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except DependencyUnavailable as e:
+        raise _unavailable(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/export/solutions")
+async def export_solutions_endpoint(
+    format: str = Query("csv"),
+    subreddit: Optional[str] = None,
+    pain_type: Optional[str] = None
+):
+    """
+    Exporte les solutions stockées en streaming (CSV, NDJSON ou Parquet)
+    """
+    return _export_response("solutions", format, subreddit, pain_type)
+
+@app.get("/export/reports")
+async def export_reports_endpoint(
+    format: str = Query("csv"),
+    subreddit: Optional[str] = None
+):
+    """
+    Exporte les rapports d'analyse en streaming (CSV, NDJSON ou Parquet)
+    """
+    return _export_response("analysis_reports", format, subreddit, None)
+
+@app.get("/reports/{report_id}/render")
+async def render_report_endpoint(report_id: int, request: Request, format: str = Query("pdf")):
+    """
+    Rend un rapport sauvegardé en PDF ou HTML (cache par hash de contenu, ETag / GET conditionnel)
+    """
+    if format not in RENDER_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Format non supporté: {format} (formats: {', '.join(RENDER_FORMATS)})"
+        )
+    
+    report = await get_analysis_report(report_id)
+    if report is None:
+        raise HTTPException(status_code=404, detail=f"Rapport {report_id} introuvable")
+    
+    title = f"Rapport d'analyse - r/{report['subreddit']}"
+    etag = f'"{artifact_key(report["report"], format, title)}"'
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=0, must-revalidate"}
+    
+    # GET conditionnel : le contenu n'a pas changé, rien à rendre ni à renvoyer
+    if_none_match = request.headers.get("if-none-match", "")
+    if if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    
+    try:
+        path = await get_or_render(report["report"], format, title)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erreur de rendu: {e}")
+    
+    return FileResponse(
+        path,
+        media_type=RENDER_FORMATS[format],
+        filename=f"rapport_{report['subreddit']}_{report_id}.{format}",
+        headers=headers
+    )
+
+@app.post("/export")
+async def export_endpoint(request: ExportRequest):
+    """
+    Prépare l'export des solutions et retourne le lien de téléchargement en streaming
+    """
+    if request.format_type not in EXPORT_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Format non supporté: {request.format_type} (formats: {', '.join(EXPORT_FORMATS)})"
+        )
+    
+    query = {"format": request.format_type}
+    if request.subreddit:
+        query["subreddit"] = request.subreddit
+    download_url = f"/export/solutions?{urlencode(query)}"
+    
+    return {
+        "success": True,
+        "response": f"✅ Export {request.format_type} prêt : {download_url}",
+        "format": request.format_type,
+        "download_url": download_url
+    }
+
+@app.get("/usage/{session_id}")
+async def usage_endpoint(session_id: str):
+    """
+    Retourne l'usage cumulé (tokens, requêtes, coût) d'une session
+    """
+    return {
+        "success": True,
+        "session_id": session_id,
+        "usage": await asyncio.to_thread(get_session_usage, session_id)
+    }
+
+@app.get("/search")
+async def search_endpoint(
+    q: str = Query(..., min_length=1),
+    kind: Optional[str] = None,
+    subreddit: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=SEARCH_MAX_RESULTS)
+):
+    """
+    Recherche plein texte classée dans les solutions, posts et commentaires indexés
+    """
+    if kind and kind not in SEARCH_KINDS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Type non supporté: {kind} (types: {', '.join(SEARCH_KINDS)})"
+        )
+    result = await asyncio.to_thread(search, q, kind, subreddit, limit)
+    if not result["success"]:
+        raise HTTPException(status_code=400, detail=result["error"])
+    return result
+
+@app.get("/watchlist")
+async def list_watchlist_endpoint():
+    """
+    Liste les subreddits surveillés et leurs prochaines échéances
+    """
+    return {"success": True, "watchlist": await asyncio.to_thread(scheduler.list_watchlist)}
+
+@app.post("/watchlist")
+async def add_watch_endpoint(request: WatchRequest):
+    """
+    Ajoute (ou met à jour) un subreddit dans la watchlist
+    """
+    name = request.subreddit.strip().removeprefix("/").removeprefix("r/")
+    info = await asyncio.to_thread(get_subreddit_info, name)
+    if not info["exists"]:
+        raise HTTPException(status_code=404, detail=info.get("error", f"r/{name} introuvable"))
+    
+    try:
+        watch = await asyncio.to_thread(
+            scheduler.add_to_watchlist,
+            info["subreddit"],
+            request.schedule,
+            request.num_posts,
+            request.comments_limit,
+            request.sort_criteria,
+            request.time_filter
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"success": True, "watch": watch}
+
+@app.delete("/watchlist/{subreddit}")
+async def remove_watch_endpoint(subreddit: str):
+    """
+    Retire un subreddit de la watchlist (l'historique des scores est conservé)
+    """
+    if not await asyncio.to_thread(scheduler.remove_from_watchlist, subreddit):
+        raise HTTPException(status_code=404, detail=f"r/{subreddit} n'est pas surveillé")
+    return {"success": True, "message": f"r/{subreddit} retiré de la watchlist"}
+
+@app.post("/watchlist/{subreddit}/run")
+async def run_watch_endpoint(subreddit: str, http_request: Request):
+    """
+    Lance immédiatement un run de surveillance (hors planning)
+    """
+    watch = await asyncio.to_thread(scheduler.get_watch, subreddit)
+    if watch is None:
+        raise HTTPException(status_code=404, detail=f"r/{subreddit} n'est pas surveillé")
+    try:
+        async with admit("analysis", client_ip(http_request)):
+            return await scheduler.run_watch(watch)
+    except AdmissionRejected as e:
+        raise _rejected(e)
+    except DependencyUnavailable as e:
+        raise _unavailable(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/watchlist/{subreddit}/trends")
+async def watch_trends_endpoint(subreddit: str, runs: int = Query(5, ge=2, le=100)):
+    """
+    Douleurs en hausse / en baisse sur les N derniers runs (séries pré-calculées, sans LLM)
+    """
+    trends = await asyncio.to_thread(scheduler.get_pain_trends, subreddit, runs)
+    return {"success": True, **trends}
+
+@app.get("/watchlist/{subreddit}/series")
+async def watch_series_endpoint(subreddit: str, runs: int = Query(10, ge=1, le=500)):
+    """
+    Séries temporelles brutes des scores de douleur
+    """
+    series = await asyncio.to_thread(scheduler.get_pain_series, subreddit, runs)
+    return {"success": True, **series}
+
+@app.get("/archive/scrapes")
+async def list_archives_endpoint(
+    subreddit: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=500)
+):
+    """
+    Liste les scrapings archivés (ré-analysables sans appel Reddit)
+    """
+    return {"success": True, "archives": await asyncio.to_thread(list_archives, subreddit, limit)}
+
+@app.post("/archive/scrapes/{archive_id}/reanalyze")
+async def reanalyze_archive_endpoint(archive_id: int, http_request: Request, session_id: Optional[str] = None):
+    """
+    Relance analyse, recommandations et rapport sur un scraping archivé (sans re-scraper)
+    """
+    if await asyncio.to_thread(get_archive, archive_id) is None:
+        raise HTTPException(status_code=404, detail=f"Archive {archive_id} introuvable")
+    try:
+        async with admit("analysis", client_ip(http_request), session_id):
+            result = await run_with_deadline(
+                lambda: reanalyze_archived_scrape(archive_id, session_id), ANALYSIS_DEADLINE_SECONDS, http_request
+            )
+    except AdmissionRejected as e:
+        raise _rejected(e)
+    except ClientDisconnected:
+        return Response(status_code=499)
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except DependencyUnavailable as e:
+        raise _unavailable(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    if result["success"]:
+        result["report_id"] = await save_analysis_report(
+            result["subreddit"],
+            result["parameters"],
+            result["report"],
+            result["session_id"]
+        )
+    return result
+
+@app.get("/corpus")
+async def corpus_endpoint(subreddit: Optional[str] = None):
+    """
+    Contenu du corpus local (dumps ingérés) par subreddit
+    """
+    return {"success": True, "subreddits": await asyncio.to_thread(corpus_stats, subreddit)}
+
+@app.post("/analyze/corpus")
+async def analyze_corpus_endpoint(request: CorpusAnalysisRequest, http_request: Request):
+    """
+    Analyse complète à partir du corpus local au lieu du scraping Reddit
+    """
+    try:
+        parse_date(request.since), parse_date(request.until)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    try:
+        async with admit("analysis", client_ip(http_request), request.session_id):
+            result = await run_with_deadline(
+                lambda: analyze_corpus(
+                    request.subreddit,
+                    request.num_posts,
+                    request.comments_limit,
+                    request.sort_criteria,
+                    request.since,
+                    request.until,
+                    request.session_id
+                ),
+                ANALYSIS_DEADLINE_SECONDS,
+                http_request
+            )
+    except AdmissionRejected as e:
+        raise _rejected(e)
+    except ClientDisconnected:
+        return Response(status_code=499)
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except DependencyUnavailable as e:
+        raise _unavailable(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    
+    if result["success"] and not result["partial"]:
+        result["report_id"] = await save_analysis_report(
+            result["subreddit"],
+            result["parameters"],
+            result["report"],
+            result["session_id"]
+        )
+    return result
+
+# ===== ADMINISTRATION =====
+
+def _require_admin(token: Optional[str]) -> None:
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Endpoints d'administration désactivés (ADMIN_TOKEN non configuré)")
+    if token != ADMIN_TOKEN:
+        raise HTTPException(status_code=401, detail="Jeton d'administration invalide")
+
+@app.get("/admin/profiles")
+async def list_profiles_endpoint(
+    limit: int = Query(50, ge=1, le=500),
+    x_admin_token: Optional[str] = Header(None)
+):
+    """
+    Profils de requêtes enregistrés, du plus récent au plus ancien
+    """
+    _require_admin(x_admin_token)
+    return {
+        "success": True,
+        "profiling_enabled": PROFILING_ENABLED,
+        "profiles": await asyncio.to_thread(list_profiles, limit)
+    }
+
+@app.get("/admin/profiles/{profile_id}")
+async def get_profile_endpoint(
+    profile_id: str,
+    format: str = Query("json", description="json (arbre de spans), speedscope ou sampled (pyinstrument)"),
+    x_admin_token: Optional[str] = Header(None)
+):
+    """
+    Fichier d'un profil (à ouvrir dans https://www.speedscope.app pour les formats speedscope)
+    """
+    _require_admin(x_admin_token)
+    if format not in PROFILE_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Format non supporté: {format} (formats: {', '.join(PROFILE_FORMATS)})"
+        )
+    path = profile_path(profile_id, format)
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"Profil {profile_id} introuvable (format {format})")
+    return FileResponse(path, media_type="application/json", filename=path.name)
+
+@app.post("/admin/profiling/sessions/{session_id}")
+async def profiling_session_endpoint(
+    session_id: str,
+    request: ProfilingSessionRequest,
+    x_admin_token: Optional[str] = Header(None)
+):
+    """
+    Active (ou désactive) le profilage de toutes les requêtes d'une session
+    """
+    _require_admin(x_admin_token)
+    if not PROFILING_ENABLED:
+        raise HTTPException(status_code=409, detail="Profilage désactivé (PROFILING_ENABLED=false)")
+    await asyncio.to_thread(enable_session_profiling, session_id, request.enabled, request.ttl)
+    return {"success": True, "session_id": session_id, "profiling": request.enabled, "ttl": request.ttl}
 
 @app.delete("/clear_history")
 async def clear_history_endpoint(request: ClearHistoryRequest):
@@ -183,7 +846,7 @@ async def clear_history_endpoint(request: ClearHistoryRequest):
     Efface l'historique de conversation
     """
     try:
-        clear_conversation_history(request.session_id)
+        await clear_conversation_history(request.session_id)
         return {
             "success": True,
             "message": f"Historique effacé pour la session {request.session_id}"
@@ -205,15 +868,36 @@ if __name__ == "__main__":
     print("  - POST /chat (principal)")
     print("  - GET /health")
     print("  - POST /check_subreddit")
+    print("  - POST /subreddits/lookup")
+    print("  - GET /subreddits/{subreddit}/profile")
     print("  - POST /analyze")
+    print("  - POST /analyze/compare")
     print("  - POST /export")
+    print("  - GET /export/solutions")
+    print("  - GET /export/reports")
+    print("  - GET /reports/{report_id}/render")
     print("  - DELETE /clear_history")
+    print("  - GET /usage/{session_id}")
+    print("  - GET /search")
+    print("  - GET/POST /watchlist")
+    print("  - DELETE /watchlist/{subreddit}")
+    print("  - POST /watchlist/{subreddit}/run")
+    print("  - GET /watchlist/{subreddit}/trends")
+    print("  - GET /watchlist/{subreddit}/series")
+    print("  - GET /archive/scrapes")
+    print("  - POST /archive/scrapes/{archive_id}/reanalyze")
+    print("  - GET /corpus")
+    print("  - POST /analyze/corpus")
+    print("  - GET /metrics/db")
+    print("  - GET /admin/profiles")
+    print("  - GET /admin/profiles/{profile_id}")
+    print("  - POST /admin/profiling/sessions/{session_id}")
     print("=" * 50)
     
     uvicorn.run(
-        app,
+        "core.api:app",  # chaîne d'import : requise par reload
         host="0.0.0.0",
         port=8000,
-        reload=True,
+        reload=os.getenv("RELOAD", "false").lower() == "true",
         log_level="info"
     )
\ No newline at end of file
@@ -0,0 +1,239 @@
+"""
+Archive colonnaire des scrapings Reddit (Arrow IPC), pour ré-analyser sans re-scraper.
+
+Chaque scraping réussi est écrit dans un fichier Arrow (une ligne par post, commentaires
+en liste de structs) sous SCRAPE_ARCHIVE_DIR, et référencé dans le store local
+(table scrape_archive). La relecture passe par un memory-map du fichier : avec
+SCRAPE_ARCHIVE_COMPRESSION=none les colonnes pointent directement dans la page mappée
+(zero-copy) ; avec zstd (défaut) le fichier est plus compact et seuls les buffers lus
+sont décompressés.
+
+Rétention : les archives plus anciennes que SCRAPE_ARCHIVE_MAX_AGE_DAYS, puis les plus
+anciennes au-delà de SCRAPE_ARCHIVE_MAX_MB au total, sont supprimées (vérifié au plus
+toutes les ARCHIVE_PRUNE_INTERVAL secondes, après un archivage).
+
+pyarrow est optionnel : sans lui, l'archivage est simplement désactivé.
+"""
+import os
+import json
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from core.local_store import get_connection
+
+SCRAPE_ARCHIVE_ENABLED = os.getenv("SCRAPE_ARCHIVE_ENABLED", "true").lower() == "true"
+# Chemin relatif : résolu depuis le dossier Backend, pas depuis le répertoire courant
+SCRAPE_ARCHIVE_DIR = Path(os.getenv("SCRAPE_ARCHIVE_DIR", "data/scrapes"))
+if not SCRAPE_ARCHIVE_DIR.is_absolute():
+    SCRAPE_ARCHIVE_DIR = Path(__file__).resolve().parent.parent / SCRAPE_ARCHIVE_DIR
+SCRAPE_ARCHIVE_COMPRESSION = os.getenv("SCRAPE_ARCHIVE_COMPRESSION", "zstd")  # zstd, lz4 ou none
+SCRAPE_ARCHIVE_MAX_AGE_DAYS = float(os.getenv("SCRAPE_ARCHIVE_MAX_AGE_DAYS", "30"))  # 0 = pas de limite
+SCRAPE_ARCHIVE_MAX_MB = float(os.getenv("SCRAPE_ARCHIVE_MAX_MB", "1024"))  # 0 = pas de limite
+ARCHIVE_PRUNE_INTERVAL = 600
+
+_last_pruned_at = 0.0
+
+
+def _schema() -> Any:
+    import pyarrow as pa
+
+    comment = pa.struct([
+        ("id", pa.string()),
+        ("author", pa.string()),
+        ("body", pa.string()),
+        ("score", pa.int64()),
+        ("created_utc", pa.string()),
+    ])
+    return pa.schema([
+        ("id", pa.string()),
+        ("title", pa.string()),
+        ("author", pa.string()),
+        ("score", pa.int64()),
+        ("num_comments", pa.int64()),
+        ("url", pa.string()),
+        ("selftext", pa.string()),
+        ("comments", pa.list_(comment)),
+    ])
+
+
+def archive_scrape(scrape: Dict[str, Any], parameters: Dict[str, Any]) -> Optional[int]:
+    """
+    Archive un résultat de scrape_posts (ne lève jamais d'exception)
+
+    Args:
+        scrape: Résultat de scrape_posts
+        parameters: Paramètres du scraping (num_posts, comments_limit, sort_criteria, time_filter)
+
+    Returns:
+        ID de l'archive, ou None si rien n'a été archivé
+    """
+    if not SCRAPE_ARCHIVE_ENABLED or not scrape.get("success") or not scrape.get("posts"):
+        return None
+    try:
+        import pyarrow as pa
+    except ImportError:
+        return None
+
+    try:
+        subreddit = scrape["subreddit"]
+        table = pa.Table.from_pylist(scrape["posts"], schema=_schema())
+        table = table.replace_schema_metadata({
+            "subreddit": subreddit,
+            "scraped_at": scrape.get("scraped_at", ""),
+            "parameters": json.dumps(parameters),
+        })
+
+        directory = SCRAPE_ARCHIVE_DIR / subreddit.lower()
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}.arrow"
+        temporary = path.with_suffix(".tmp")
+        compression = None if SCRAPE_ARCHIVE_COMPRESSION == "none" else SCRAPE_ARCHIVE_COMPRESSION
+        with pa.OSFile(str(temporary), "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema, options=pa.ipc.IpcWriteOptions(compression=compression)) as writer:
+                writer.write_table(table)
+        # Écriture atomique : un lecteur ne voit jamais de fichier à moitié écrit
+        os.replace(temporary, path)
+
+        connection = get_connection()
+        cursor = connection.execute(
+            """
+            INSERT INTO scrape_archive
+                (subreddit, sort_criteria, parameters, scraped_at, posts_count, comments_count, partial, bytes, path)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                subreddit,
+                scrape.get("sort_criteria"),
+                json.dumps(parameters),
+                scrape.get("scraped_at"),
+                len(scrape["posts"]),
+                sum(len(post.get("comments", [])) for post in scrape["posts"]),
+                int(bool(scrape.get("partial"))),
+                path.stat().st_size,
+                str(path),
+            ),
+        )
+        connection.commit()
+    except Exception as e:
+        print(f"Erreur archivage du scraping: {e}")
+        return None
+
+    global _last_pruned_at
+    if time.monotonic() - _last_pruned_at >= ARCHIVE_PRUNE_INTERVAL:
+        _last_pruned_at = time.monotonic()
+        try:
+            prune_archives()
+        except Exception as e:
+            print(f"Erreur nettoyage des archives: {e}")
+    return cursor.lastrowid
+
+
+def prune_archives() -> int:
+    """
+    Supprime les archives au-delà de la rétention (âge, puis taille totale)
+
+    Returns:
+        Nombre d'archives supprimées
+    """
+    cutoff = ""
+    if SCRAPE_ARCHIVE_MAX_AGE_DAYS:
+        cutoff = (datetime.now() - timedelta(days=SCRAPE_ARCHIVE_MAX_AGE_DAYS)).strftime('%Y-%m-%d %H:%M:%S')
+    max_bytes = SCRAPE_ARCHIVE_MAX_MB * 1024 * 1024
+    connection = get_connection()
+    expired: List[Any] = []
+    kept_bytes = 0
+    full = False
+    # Des plus récentes aux plus anciennes : on garde tant que le budget de taille le permet.
+    # La plus récente est toujours gardée : son ID reste le plus grand et n'est jamais réattribué.
+    rows = connection.execute("SELECT id, path, bytes, scraped_at FROM scrape_archive ORDER BY id DESC").fetchall()
+    for index, row in enumerate(rows):
+        full = full or bool(index and max_bytes and kept_bytes + row["bytes"] > max_bytes)
+        if index and (full or (cutoff and (row["scraped_at"] or "") < cutoff)):
+            expired.append(row)
+        else:
+            kept_bytes += row["bytes"]
+    if not expired:
+        return 0
+
+    for row in expired:
+        try:
+            os.remove(row["path"])
+        except FileNotFoundError:
+            pass
+    connection.executemany("DELETE FROM scrape_archive WHERE id = ?", [(row["id"],) for row in expired])
+    connection.commit()
+    print(f"🗑️ {len(expired)} archive(s) de scraping supprimée(s) (rétention)")
+    return len(expired)
+
+
+def _row_to_dict(row: Any) -> Dict[str, Any]:
+    entry = dict(row)
+    entry["parameters"] = json.loads(entry["parameters"] or "{}")
+    entry["partial"] = bool(entry["partial"])
+    return entry
+
+
+def list_archives(subreddit: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
+    """Scrapings archivés, du plus récent au plus ancien"""
+    query = "SELECT * FROM scrape_archive"
+    params: List[Any] = []
+    if subreddit:
+        query += " WHERE subreddit = ? COLLATE NOCASE"
+        params.append(subreddit.removeprefix("r/"))
+    query += " ORDER BY id DESC LIMIT ?"
+    params.append(limit)
+    return [_row_to_dict(row) for row in get_connection().execute(query, params).fetchall()]
+
+
+def get_archive(archive_id: int) -> Optional[Dict[str, Any]]:
+    row = get_connection().execute("SELECT * FROM scrape_archive WHERE id = ?", (archive_id,)).fetchone()
+    return _row_to_dict(row) if row else None
+
+
+def read_archive_table(archive_id: int, columns: Optional[List[str]] = None) -> Optional[Any]:
+    """
+    Table Arrow d'un scraping archivé, lue par memory-map
+
+    Args:
+        archive_id: ID de l'archive
+        columns: Colonnes à lire (toutes par défaut)
+
+    Returns:
+        pyarrow.Table, ou None si l'archive n'existe pas
+    """
+    import pyarrow as pa
+
+    entry = get_archive(archive_id)
+    if entry is None or not os.path.exists(entry["path"]):
+        return None
+    with pa.memory_map(entry["path"], "r") as source:
+        table = pa.ipc.open_file(source).read_all()
+    return table.select(columns) if columns else table
+
+
+def load_scrape(archive_id: int) -> Optional[Dict[str, Any]]:
+    """
+    Reconstruit un résultat de scrape_posts depuis l'archive
+
+    Returns:
+        Le résultat (avec "archive_id" et "parameters"), ou None si l'archive n'existe pas
+    """
+    entry = get_archive(archive_id)
+    table = read_archive_table(archive_id)
+    if entry is None or table is None:
+        return None
+    posts = table.to_pylist()
+    return {
+        "success": True,
+        "subreddit": entry["subreddit"],
+        "sort_criteria": entry["sort_criteria"],
+        "posts_count": len(posts),
+        "partial": entry["partial"],
+        "posts": posts,
+        "scraped_at": entry["scraped_at"],
+        "archive_id": archive_id,
+        "parameters": entry["parameters"],
+    }
@@ -0,0 +1,55 @@
+"""
+Filtre de Bloom : appartenance approximative à un ensemble, en mémoire constante.
+
+Pas de faux négatif : une clé absente du filtre n'a jamais été ajoutée.
+Les faux positifs (taux `error_rate`) doivent être confirmés par l'appelant si nécessaire.
+"""
+import math
+import hashlib
+import threading
+from typing import Iterable
+
+
+class BloomFilter:
+    """
+    Filtre de Bloom dimensionné pour `capacity` clés au taux de faux positifs `error_rate`
+
+    Args:
+        capacity: Nombre de clés attendues
+        error_rate: Taux de faux positifs visé à pleine capacité
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        self.capacity = max(1, capacity)
+        self.error_rate = error_rate
+        self.num_bits = max(8, int(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / self.capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.num_bits + 7) // 8)
+        self._lock = threading.Lock()
+
+    def _positions(self, key: str):
+        # Double hachage (Kirsch-Mitzenmacher) : k positions à partir d'un seul digest
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, key: str) -> None:
+        positions = self._positions(key)
+        with self._lock:
+            for position in positions:
+                self._bits[position >> 3] |= 1 << (position & 7)
+            self.count += 1
+
+    def update(self, keys: Iterable[str]) -> None:
+        for key in keys:
+            self.add(key)
+
+    def __contains__(self, key: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    @property
+    def saturated(self) -> bool:
+        """Plus de clés que prévu : le taux de faux positifs dépasse error_rate"""
+        return self.count > self.capacity
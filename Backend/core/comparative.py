@@ -0,0 +1,174 @@
+"""
+Analyse comparative de plusieurs subreddits.
+
+Les subreddits sont scrapés et analysés en parallèle (sous la limite de débit Reddit
+partagée et un plafond de concurrence commun à toutes les requêtes), puis leurs
+douleurs sont fusionnées en douleurs partagées / spécifiques dans un seul rapport.
+
+Sous un délai de requête, une étape qui dépasse son budget n'annule pas la comparaison :
+un subreddit trop lent est écarté, les recommandations ou le rapport LLM sont omis, et
+le résultat est marqué partiel. De même, un subreddit dont le scraping ou l'analyse
+échoue est écarté sans faire échouer la comparaison.
+"""
+import os
+import asyncio
+from typing import Any, Dict, List, Optional
+
+from agents.exceptions import MaxTurnsExceeded
+
+from core.deadlines import DeadlineExceeded
+from core.functions import lookup_subreddits
+from core.pipeline import generate_recommendations, generate_report, merge_pain_lists, scrape_and_analyze
+from core.usage import BudgetExceededError, MAX_TOKENS_PER_ANALYSIS, MAX_TURNS_PER_ANALYSIS, tracked_analysis
+
+# Nombre de subreddits scrapés / analysés simultanément, tous appels confondus
+COMPARE_MAX_CONCURRENCY = int(os.getenv("COMPARE_MAX_CONCURRENCY", "3"))
+
+_compare_semaphore = asyncio.Semaphore(COMPARE_MAX_CONCURRENCY)
+
+
+def format_comparison_section(comparison: Dict[str, Any]) -> str:
+    """Section markdown déterministe ajoutée au rapport : douleurs partagées / spécifiques"""
+    lines = ["🌐 **COMPARAISON ENTRE COMMUNAUTÉS**", ""]
+    if comparison["shared_pains"]:
+        lines.append("**Douleurs partagées**")
+        for pain in comparison["shared_pains"]:
+            communities = ", ".join(f"r/{name}" for name in pain["subreddits"])
+            lines.append(f"• **{pain['pain_type']}** (Score moyen: {pain['score']}) — {communities}")
+    else:
+        lines.append("Aucune douleur commune détectée entre ces communautés.")
+    for subreddit, pains in comparison["unique_pains"].items():
+        if pains:
+            lines.append("")
+            lines.append(f"**Spécifique à r/{subreddit}**")
+            for pain in pains:
+                lines.append(f"• **{pain['pain_type']}** (Score: {pain['score']})")
+    return "\n".join(lines)
+
+
+async def _analyze_subreddit(name: str, parameters: Dict[str, Any]) -> Dict[str, Any]:
+    # Le sémaphore est partagé par toutes les comparaisons en cours
+    async with _compare_semaphore:
+        try:
+            scrape, analysis = await scrape_and_analyze(name, **parameters)
+            if not scrape["success"]:
+                return {"subreddit": name, "success": False, "error": scrape["error"]}
+        except DeadlineExceeded as e:
+            print(f"⏱️ r/{name} écarté de la comparaison: {e}")
+            return {"subreddit": name, "success": False, "error": "Délai dépassé", "timed_out_stage": e.stage}
+        except (BudgetExceededError, MaxTurnsExceeded):
+            # Budget commun à toute la comparaison : elle s'arrête
+            raise
+        except Exception as e:
+            # Erreur Reddit / LLM propre à ce subreddit : les autres résultats sont gardés
+            print(f"❌ r/{name} écarté de la comparaison: {e}")
+            return {"subreddit": name, "success": False, "error": f"Erreur d'analyse: {e}", "failed": True}
+        return {
+            "subreddit": name,
+            "success": True,
+            "posts_count": scrape["posts_count"],
+            "comments_count": sum(len(post["comments"]) for post in scrape["posts"]),
+            "partial": scrape.get("partial", False) or analysis.get("partial", False),
+            "analysis": analysis,
+        }
+
+
+async def run_comparative_analysis(
+    subreddits: List[str],
+    parameters: Dict[str, Any],
+    session_id: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Compare plusieurs subreddits en un seul rapport
+
+    Args:
+        subreddits: Noms des subreddits (avec ou sans 'r/')
+        parameters: num_posts, comments_limit, sort_criteria, time_filter (communs à tous)
+        session_id: Session à laquelle imputer l'usage
+
+    Returns:
+        Dict avec le rapport, la comparaison, le détail par subreddit et l'usage
+    """
+    infos = await lookup_subreddits(subreddits)
+    names = list({info["subreddit"].lower(): info["subreddit"] for info in infos if info["exists"]}.values())
+    missing = [info["subreddit"] for info in infos if not info["exists"]]
+    session_id = session_id or "compare_" + "_".join(names)
+
+    if len(names) < 2:
+        return {
+            "success": False,
+            "error": "Au moins deux subreddits accessibles sont nécessaires pour une comparaison",
+            "missing": missing,
+            "session_id": session_id,
+        }
+
+    # Budget proportionnel au nombre de communautés comparées
+    tracker = None
+    try:
+        async with tracked_analysis(
+            session_id,
+            max_tokens=MAX_TOKENS_PER_ANALYSIS * len(names),
+            max_turns=MAX_TURNS_PER_ANALYSIS * len(names),
+        ) as tracker:
+            results = await asyncio.gather(*(_analyze_subreddit(name, parameters) for name in names))
+            analyses = {result["subreddit"]: result["analysis"] for result in results if result["success"]}
+            if len(analyses) < 2:
+                return {
+                    "success": False,
+                    "error": "Le scraping a échoué pour trop de subreddits",
+                    "subreddits": results,
+                    "missing": missing,
+                    "session_id": session_id,
+                    "usage": tracker.to_dict(),
+                }
+
+            comparison = merge_pain_lists(analyses)
+            merged_analysis = {
+                "analysis_success": True,
+                "subreddit": ", ".join(f"r/{name}" for name in analyses),
+                "top_pains": [
+                    {key: pain[key] for key in ("pain_type", "score", "description", "frequency")}
+                    for pain in comparison["merged"]
+                ],
+            }
+            timed_out_stages = sorted({r["timed_out_stage"] for r in results if r.get("timed_out_stage")})
+            try:
+                recommendations = await generate_recommendations(merged_analysis)
+            except DeadlineExceeded:
+                timed_out_stages.append("recommendations")
+                recommendations = {}
+            report_parameters = {
+                **parameters,
+                "subreddits": list(analyses),
+                "num_posts": sum(r["posts_count"] for r in results if r["success"]),
+                "num_comments": sum(r["comments_count"] for r in results if r["success"]),
+            }
+            try:
+                report = await generate_report(merged_analysis, recommendations, report_parameters)
+                report = f"{report.rstrip()}\n\n{format_comparison_section(comparison)}"
+            except DeadlineExceeded:
+                # La section de comparaison est déterministe : elle reste disponible sans LLM
+                timed_out_stages.append("report")
+                report = format_comparison_section(comparison)
+
+    except (BudgetExceededError, MaxTurnsExceeded) as e:
+        return {
+            "success": False,
+            "error": f"Analyse interrompue : {e.message}",
+            "session_id": session_id,
+            "usage": tracker.to_dict() if tracker else None,
+        }
+
+    return {
+        "success": True,
+        "report": report,
+        "comparison": comparison,
+        "subreddits": [
+            {key: value for key, value in result.items() if key != "analysis"} for result in results
+        ],
+        "missing": missing,
+        "partial": bool(timed_out_stages) or any(r.get("partial") or r.get("failed") for r in results),
+        "timed_out_stages": timed_out_stages,
+        "session_id": session_id,
+        "usage": tracker.to_dict(),
+    }
@@ -0,0 +1,348 @@
+"""
+Corpus local alimenté par des dumps Reddit hors ligne (format Pushshift : NDJSON compressé .zst).
+
+Ingestion en flux, en mémoire bornée :
+- décompression zstd en streaming, lecture ligne à ligne ;
+- découpage en blocs de lignes, parsés et filtrés (subreddits, période) par des
+  processus séparés si DUMP_INGEST_WORKERS > 1, avec un nombre borné de blocs en vol ;
+- textes nettoyés (core.preprocessing), bots et contenus supprimés écartés ;
+- insertion par lots dans le store local (tables corpus_posts / corpus_comments),
+  les commentaires étant rattachés à leur post par link_id.
+
+Le corpus sert ensuite de source d'analyse à la place du scraping Reddit
+(load_corpus_scrape, même format que scrape_posts).
+
+Usage en ligne de commande :
+    python -m core.corpus submissions.zst comments.zst --subreddit python --since 2023-01-01
+"""
+import io
+import os
+import json
+import time
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from core.local_store import get_connection
+from core.preprocessing import clean_text, is_bot_author, truncate_to_tokens, POST_MAX_TOKENS, COMMENT_MAX_TOKENS
+
+DUMP_INGEST_WORKERS = int(os.getenv("DUMP_INGEST_WORKERS", "1"))
+DUMP_CHUNK_LINES = int(os.getenv("DUMP_CHUNK_LINES", "20000"))
+# Fenêtre des dumps Pushshift récents : 2 Go
+ZSTD_MAX_WINDOW_SIZE = 2 ** 31
+CORPUS_MAX_POSTS = 1000
+
+_POST_COLUMNS = ("id", "subreddit", "created_utc", "author", "title", "selftext", "score", "num_comments", "url")
+_COMMENT_COLUMNS = ("id", "post_id", "subreddit", "created_utc", "author", "body", "score", "top_level")
+_SORT_ORDERS = {
+    "top": "score DESC",
+    "new": "created_utc DESC",
+    "comments": "num_comments DESC",
+}
+
+
+def parse_date(value: Optional[str]) -> Optional[int]:
+    """
+    Date ISO (2023-01-31) ou timestamp en secondes -> timestamp UTC
+
+    Raises:
+        ValueError: Date invalide
+    """
+    if value in (None, ""):
+        return None
+    if str(value).isdigit():
+        return int(value)
+    try:
+        return int(datetime.fromisoformat(str(value)).replace(tzinfo=timezone.utc).timestamp())
+    except ValueError:
+        raise ValueError(f"Date invalide: {value} (date ISO ou timestamp attendu)") from None
+
+
+def _parse_chunk(
+    lines: List[bytes],
+    subreddits: Optional[frozenset],
+    since: Optional[int],
+    until: Optional[int],
+) -> Tuple[List[tuple], List[tuple], Dict[str, int]]:
+    """
+    Parse et filtre un bloc de lignes NDJSON (exécuté dans un processus du pool)
+
+    Returns:
+        (lignes corpus_posts, lignes corpus_comments, compteurs)
+    """
+    posts: List[tuple] = []
+    comments: List[tuple] = []
+    counts = {"lines": len(lines), "invalid": 0, "filtered": 0, "dropped": 0}
+    for line in lines:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            counts["invalid"] += 1
+            continue
+        subreddit = record.get("subreddit") or ""
+        if subreddits is not None and subreddit.lower() not in subreddits:
+            counts["filtered"] += 1
+            continue
+        try:
+            created = int(float(record.get("created_utc") or 0))
+        except (TypeError, ValueError):
+            created = 0
+        if (since is not None and created < since) or (until is not None and created >= until):
+            counts["filtered"] += 1
+            continue
+
+        author = record.get("author") or "[deleted]"
+        if "title" in record:
+            posts.append((
+                record.get("id"),
+                subreddit,
+                created,
+                author,
+                clean_text(record.get("title") or ""),
+                clean_text(record.get("selftext") or ""),
+                int(record.get("score") or 0),
+                int(record.get("num_comments") or 0),
+                "https://reddit.com" + (record.get("permalink") or ""),
+            ))
+        elif "body" in record:
+            body = "" if is_bot_author(author) else clean_text(record.get("body") or "")
+            if not body:
+                counts["dropped"] += 1
+                continue
+            link_id = record.get("link_id") or ""
+            comments.append((
+                record.get("id"),
+                link_id.removeprefix("t3_"),
+                subreddit,
+                created,
+                author,
+                body,
+                int(record.get("score") or 0),
+                int((record.get("parent_id") or "") == link_id),
+            ))
+        else:
+            counts["invalid"] += 1
+    return posts, comments, counts
+
+
+def _iter_chunks(path: str, chunk_lines: int) -> Iterator[List[bytes]]:
+    """Lignes du dump, décompressées en flux, par blocs de chunk_lines"""
+    try:
+        import zstandard
+    except ImportError as e:
+        raise ImportError("L'ingestion de dumps .zst nécessite le paquet 'zstandard' (pip install zstandard)") from e
+
+    with open(path, "rb") as raw:
+        if path.endswith(".zst"):
+            reader = zstandard.ZstdDecompressor(max_window_size=ZSTD_MAX_WINDOW_SIZE).stream_reader(raw)
+            stream = io.BufferedReader(reader, buffer_size=1 << 20)
+        else:
+            stream = raw
+        chunk: List[bytes] = []
+        for line in stream:
+            if line.strip():
+                chunk.append(line)
+            if len(chunk) >= chunk_lines:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def _store_rows(posts: List[tuple], comments: List[tuple]) -> None:
+    connection = get_connection()
+    with connection:
+        if posts:
+            connection.executemany(
+                f"INSERT OR REPLACE INTO corpus_posts ({', '.join(_POST_COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(_POST_COLUMNS))})",
+                posts,
+            )
+        if comments:
+            connection.executemany(
+                f"INSERT OR REPLACE INTO corpus_comments ({', '.join(_COMMENT_COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(_COMMENT_COLUMNS))})",
+                comments,
+            )
+
+
+def ingest_dump(
+    path: str,
+    subreddits: Optional[List[str]] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    workers: int = DUMP_INGEST_WORKERS,
+    chunk_lines: int = DUMP_CHUNK_LINES,
+    progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> Dict[str, Any]:
+    """
+    Ingère un dump de submissions ou de commentaires dans le corpus local
+
+    Args:
+        path: Fichier .zst (ou NDJSON non compressé)
+        subreddits: Subreddits à conserver (tous si None)
+        since: Début de période inclus (date ISO ou timestamp)
+        until: Fin de période exclue (date ISO ou timestamp)
+        workers: Processus de parsing (1 = dans le processus courant)
+        chunk_lines: Lignes par bloc envoyé à un processus
+        progress: Appelé avec les compteurs après chaque bloc
+
+    Returns:
+        Compteurs de l'ingestion (lignes, posts, commentaires, filtrés, invalides, durée)
+    """
+    wanted = frozenset(name.lower().removeprefix("r/") for name in subreddits) if subreddits else None
+    since_ts, until_ts = parse_date(since), parse_date(until)
+    stats = {"path": path, "lines": 0, "posts": 0, "comments": 0, "filtered": 0, "dropped": 0, "invalid": 0}
+    started = time.monotonic()
+
+    def collect(result: Tuple[List[tuple], List[tuple], Dict[str, int]]) -> None:
+        posts, comments, counts = result
+        _store_rows(posts, comments)
+        stats["posts"] += len(posts)
+        stats["comments"] += len(comments)
+        for key, value in counts.items():
+            stats[key] += value
+        if progress is not None:
+            progress(stats)
+
+    chunks = _iter_chunks(path, chunk_lines)
+    if workers <= 1:
+        for chunk in chunks:
+            collect(_parse_chunk(chunk, wanted, since_ts, until_ts))
+    else:
+        # Nombre borné de blocs en vol : la mémoire ne dépend pas de la taille du dump
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            in_flight: deque = deque()
+            for chunk in chunks:
+                in_flight.append(executor.submit(_parse_chunk, chunk, wanted, since_ts, until_ts))
+                if len(in_flight) >= workers * 2:
+                    collect(in_flight.popleft().result())
+            while in_flight:
+                collect(in_flight.popleft().result())
+
+    stats["seconds"] = round(time.monotonic() - started, 1)
+    print(f"📥 Dump ingéré: {path} — {stats['posts']} posts, {stats['comments']} commentaires "
+          f"({stats['lines']} lignes, {stats['seconds']}s)")
+    return stats
+
+
+def corpus_stats(subreddit: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Volume du corpus par subreddit (posts, commentaires, période couverte)"""
+    query = """
+        SELECT p.subreddit, COUNT(*) AS posts, MIN(p.created_utc) AS first_utc, MAX(p.created_utc) AS last_utc,
+               (SELECT COUNT(*) FROM corpus_comments c WHERE c.subreddit = p.subreddit) AS comments
+        FROM corpus_posts p
+    """
+    params: List[Any] = []
+    if subreddit:
+        query += " WHERE p.subreddit = ? COLLATE NOCASE"
+        params.append(subreddit.removeprefix("r/"))
+    query += " GROUP BY p.subreddit ORDER BY posts DESC"
+    return [dict(row) for row in get_connection().execute(query, params).fetchall()]
+
+
+def load_corpus_scrape(
+    subreddit: str,
+    num_posts: int = 100,
+    comments_limit: int = 10,
+    sort_criteria: str = "top",
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    on_post: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> Dict[str, Any]:
+    """
+    Lit des posts du corpus local au format de scrape_posts (source d'analyse hors ligne)
+
+    Args:
+        subreddit: Subreddit du corpus
+        num_posts: Nombre de posts (au plus CORPUS_MAX_POSTS)
+        comments_limit: Commentaires de premier niveau par post (les mieux notés)
+        sort_criteria: top, new ou comments
+        since, until: Période (date ISO ou timestamp)
+        on_post: Appelé avec chaque post dès qu'il est lu (analyse pipelinée)
+
+    Returns:
+        Dict au format scrape_posts, avec "source": "corpus"
+    """
+    if sort_criteria not in _SORT_ORDERS:
+        return {"success": False, "error": f"Tri non supporté: {sort_criteria}", "subreddit": subreddit}
+    subreddit = subreddit.removeprefix("r/")
+    since_ts, until_ts = parse_date(since), parse_date(until)
+    query = "SELECT * FROM corpus_posts WHERE subreddit = ? COLLATE NOCASE"
+    params: List[Any] = [subreddit]
+    if since_ts is not None:
+        query += " AND created_utc >= ?"
+        params.append(since_ts)
+    if until_ts is not None:
+        query += " AND created_utc < ?"
+        params.append(until_ts)
+    query += f" ORDER BY {_SORT_ORDERS[sort_criteria]} LIMIT ?"
+    params.append(min(num_posts, CORPUS_MAX_POSTS))
+
+    connection = get_connection()
+    posts = []
+    for row in connection.execute(query, params).fetchall():
+        comments = connection.execute(
+            """
+            SELECT id, author, body, score, created_utc FROM corpus_comments
+            WHERE post_id = ? AND top_level = 1
+            ORDER BY score DESC LIMIT ?
+            """,
+            (row["id"], comments_limit),
+        ).fetchall()
+        post = {
+            "title": row["title"],
+            "author": row["author"],
+            "score": row["score"],
+            "num_comments": row["num_comments"],
+            "url": row["url"],
+            "selftext": truncate_to_tokens(row["selftext"], POST_MAX_TOKENS),
+            "comments": [
+                {
+                    "author": comment["author"],
+                    "body": truncate_to_tokens(comment["body"], COMMENT_MAX_TOKENS),
+                    "score": comment["score"],
+                    "created_utc": datetime.fromtimestamp(comment["created_utc"]).strftime('%Y-%m-%d %H:%M:%S'),
+                    "id": comment["id"],
+                }
+                for comment in comments
+            ],
+            "id": row["id"],
+        }
+        posts.append(post)
+        if on_post is not None:
+            on_post(post)
+
+    if not posts:
+        return {"success": False, "error": f"Aucun post de r/{subreddit} dans le corpus pour cette période", "subreddit": subreddit}
+    return {
+        "success": True,
+        "subreddit": subreddit,
+        "sort_criteria": sort_criteria,
+        "posts_count": len(posts),
+        "posts": posts,
+        "source": "corpus",
+        "period": {"since": since, "until": until},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingestion de dumps Reddit (.zst NDJSON) dans le corpus local")
+    parser.add_argument("paths", nargs="+", help="Dumps de submissions et/ou de commentaires")
+    parser.add_argument("--subreddit", action="append", dest="subreddits", help="Subreddit à conserver (répétable)")
+    parser.add_argument("--since", help="Début de période (YYYY-MM-DD)")
+    parser.add_argument("--until", help="Fin de période exclue (YYYY-MM-DD)")
+    parser.add_argument("--workers", type=int, default=DUMP_INGEST_WORKERS, help="Processus de parsing")
+    args = parser.parse_args()
+
+    last_report = [0.0]
+
+    def report(stats: Dict[str, Any]) -> None:
+        if time.monotonic() - last_report[0] >= 5:
+            last_report[0] = time.monotonic()
+            print(f"  … {stats['lines']} lignes, {stats['posts']} posts, {stats['comments']} commentaires")
+
+    for dump_path in args.paths:
+        ingest_dump(dump_path, args.subreddits, args.since, args.until, args.workers, progress=report)
@@ -0,0 +1,235 @@
+"""
+Client Supabase asynchrone partagé, sur un pool de connexions HTTP keep-alive.
+
+Un seul client par worker, ouvert au démarrage de l'application (lifespan FastAPI) et
+fermé à l'arrêt : les outils des agents, l'historique de conversation, le suivi d'usage
+et les endpoints réutilisent les mêmes connexions au lieu d'en ouvrir une par requête.
+HTTP/2 est utilisé quand le paquet h2 est installé (plusieurs requêtes multiplexées sur
+une connexion), sinon HTTP/1.1 keep-alive.
+
+Le transport mesure l'occupation du pool : requêtes en cours, en attente d'une place,
+et temps d'attente (exposés par /health et /metrics/db).
+
+Les lectures en masse exécutées dans des threads (exports, filtre des commentaires
+connus, index de recherche) gardent le client synchrone de core/functions.py.
+"""
+import os
+import time
+import asyncio
+from typing import Any, Dict, Optional
+
+import httpx
+from supabase import AsyncClient, AsyncClientOptions, acreate_client
+
+from core.resilience import acall_with_retry, supabase_breaker
+
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_KEY = os.getenv("SUPABASE_ANON_KEY")
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))  # requêtes simultanées max par worker
+DB_POOL_KEEPALIVE = int(os.getenv("DB_POOL_KEEPALIVE", str(DB_POOL_SIZE)))  # connexions gardées ouvertes
+DB_POOL_KEEPALIVE_EXPIRY = float(os.getenv("DB_POOL_KEEPALIVE_EXPIRY", "30"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))  # attente max d'une place dans le pool
+DB_REQUEST_TIMEOUT = float(os.getenv("DB_REQUEST_TIMEOUT", "30"))
+DB_HTTP2 = os.getenv("DB_HTTP2", "true").lower() == "true"
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class _PoolStats:
+    """Compteurs du pool (un seul event loop par worker : pas de verrou)"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.waiting = 0
+        self.requests = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "pool_size": self.size,
+            "in_use": self.in_use,
+            "peak_in_use": self.peak_in_use,
+            "waiting": self.waiting,
+            "requests": self.requests,
+            "errors": self.errors,
+            "pool_timeouts": self.timeouts,
+            "avg_wait_ms": round(self.total_wait / self.requests * 1000, 2) if self.requests else 0.0,
+            "max_wait_ms": round(self.max_wait * 1000, 2),
+        }
+
+
+class ReleasingStream(httpx.AsyncByteStream):
+    """Corps de réponse qui rend sa place au pool une fois lu ou fermé"""
+
+    def __init__(self, stream: httpx.AsyncByteStream, release):
+        self._stream = stream
+        self._release = release
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            self._release()
+
+
+class MeteredTransport(httpx.AsyncBaseTransport):
+    """
+    Transport httpx limité à pool_size requêtes simultanées, avec mesure de l'attente
+
+    La limite est la même que celle du pool de connexions : une requête qui obtient
+    sa place trouve toujours une connexion (ou un flux HTTP/2) disponible, le temps
+    d'attente mesuré est donc bien celui du pool.
+    """
+
+    def __init__(self, pool_size: int, http2: bool):
+        self._transport = httpx.AsyncHTTPTransport(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=pool_size,
+                max_keepalive_connections=min(DB_POOL_KEEPALIVE, pool_size),
+                keepalive_expiry=DB_POOL_KEEPALIVE_EXPIRY,
+            ),
+        )
+        self._slots = asyncio.Semaphore(pool_size)
+        self.http2 = http2
+        self.stats = _PoolStats(pool_size)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        stats = self.stats
+        stats.waiting += 1
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=DB_POOL_TIMEOUT)
+        except asyncio.TimeoutError:
+            stats.timeouts += 1
+            raise httpx.PoolTimeout(f"Pool Supabase saturé ({stats.size} requêtes en cours)", request=request)
+        finally:
+            stats.waiting -= 1
+        waited = time.perf_counter() - started
+        stats.requests += 1
+        stats.total_wait += waited
+        stats.max_wait = max(stats.max_wait, waited)
+        stats.in_use += 1
+        stats.peak_in_use = max(stats.peak_in_use, stats.in_use)
+
+        released = False
+
+        def release() -> None:
+            nonlocal released
+            if not released:
+                released = True
+                stats.in_use -= 1
+                self._slots.release()
+
+        try:
+            response = await self._transport.handle_async_request(request)
+        except BaseException:
+            stats.errors += 1
+            release()
+            raise
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=ReleasingStream(response.stream, release),
+            extensions=response.extensions,
+        )
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+_client: Optional[AsyncClient] = None
+_http: Optional[httpx.AsyncClient] = None
+_transport: Optional[MeteredTransport] = None
+_open_lock: Optional[asyncio.Lock] = None
+
+
+async def open_db() -> AsyncClient:
+    """
+    Ouvre le client partagé du worker (idempotent)
+
+    Appelé par le lifespan de l'API ; les scripts hors API l'ouvrent au premier get_db().
+    """
+    global _client, _http, _transport, _open_lock
+    if _client is not None:
+        return _client
+    if _open_lock is None:
+        _open_lock = asyncio.Lock()
+    async with _open_lock:
+        if _client is None:
+            http2 = DB_HTTP2 and _http2_available()
+            _transport = MeteredTransport(DB_POOL_SIZE, http2)
+            _http = httpx.AsyncClient(
+                transport=_transport,
+                timeout=DB_REQUEST_TIMEOUT,
+                follow_redirects=True,
+            )
+            _client = await acreate_client(
+                SUPABASE_URL,
+                SUPABASE_KEY,
+                options=AsyncClientOptions(httpx_client=_http, postgrest_client_timeout=DB_REQUEST_TIMEOUT),
+            )
+            print(f"🔌 Client Supabase async initialisé (worker {os.getpid()}, "
+                  f"pool {DB_POOL_SIZE}, {'HTTP/2' if http2 else 'HTTP/1.1'})")
+    return _client
+
+
+async def close_db() -> None:
+    """Ferme le client partagé et ses connexions (arrêt de l'application)"""
+    global _client, _http, _transport
+    if _http is not None:
+        await _http.aclose()
+    _client = _http = _transport = None
+
+
+async def get_db() -> AsyncClient:
+    """Client Supabase asynchrone partagé du worker"""
+    return _client if _client is not None else await open_db()
+
+
+def _not_sent(error: BaseException) -> bool:
+    """La requête n'a pas atteint le serveur : la rejouer ne peut pas dupliquer une écriture"""
+    return isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout))
+
+
+async def execute(query: Any, write: bool = False) -> Any:
+    """
+    Exécute une requête PostgREST via le disjoncteur Supabase (core.resilience)
+
+    Les lectures sont retentées sur erreur transitoire et couvertes (hedging) ; une
+    écriture n'est retentée que si elle n'a pas pu partir.
+
+    Args:
+        query: Requête construite sur le client (db.table(...)...), sans .execute()
+        write: True pour une insertion / suppression
+
+    Returns:
+        La réponse PostgREST
+    """
+    label = f"{query.http_method} {query.path}"
+    if write:
+        return await acall_with_retry(supabase_breaker, query.execute, retry=_not_sent, label=label)
+    return await acall_with_retry(supabase_breaker, query.execute, hedge=True, label=label)
+
+
+def db_metrics() -> Dict[str, Any]:
+    """Occupation du pool de connexions Supabase du worker courant"""
+    if _transport is None:
+        return {"open": False, "pool_size": DB_POOL_SIZE}
+    return {"open": True, "http2": _transport.http2, **_transport.stats.to_dict()}
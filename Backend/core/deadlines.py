@@ -0,0 +1,207 @@
+"""
+Délais de bout en bout, annulation et déconnexion du client.
+
+Chaque requête reçoit un Deadline, propagé par contextvar aux tâches et aux threads
+(asyncio.to_thread copie le contexte). Le budget est réparti entre les étapes du
+pipeline ; à l'expiration ou à la déconnexion du client :
+- les appels LLM en cours sont annulés (annulation asyncio de la tâche) ;
+- le scraping PRAW, synchrone, s'arrête au prochain point de contrôle (entre deux posts)
+  et rend les posts déjà récupérés ;
+- les étapes déjà terminées sont renvoyées comme résultats partiels.
+"""
+import os
+import time
+import asyncio
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator, Optional
+
+CHAT_DEADLINE_SECONDS = float(os.getenv("CHAT_DEADLINE_SECONDS", "300"))
+ANALYSIS_DEADLINE_SECONDS = float(os.getenv("ANALYSIS_DEADLINE_SECONDS", "600"))
+COMPARE_DEADLINE_SECONDS = float(os.getenv("COMPARE_DEADLINE_SECONDS", "900"))
+DISCONNECT_POLL_SECONDS = 1.0
+# Marge laissée au code coopératif (scraping) pour rendre un résultat partiel
+# avant l'annulation forcée
+DEADLINE_GRACE_SECONDS = 3.0
+
+# Part du budget de chaque étape ; le temps non consommé par une étape profite aux suivantes
+STAGE_ORDER = ("scrape", "pain_analysis", "recommendations", "report")
+STAGE_BUDGET_SHARES = {"scrape": 0.3, "pain_analysis": 0.35, "recommendations": 0.15, "report": 0.2}
+
+
+class DeadlineExceeded(Exception):
+    """Le délai de la requête (ou d'une étape) est dépassé"""
+
+    def __init__(self, stage: Optional[str] = None):
+        self.stage = stage
+        super().__init__(f"Délai dépassé ({stage})" if stage else "Délai dépassé")
+
+
+class ClientDisconnected(Exception):
+    """Le client HTTP s'est déconnecté avant la fin de la requête"""
+
+
+class Deadline:
+    """
+    Échéance d'une requête ou d'une étape
+
+    Args:
+        seconds: Budget en secondes à partir de maintenant
+        parent: Échéance englobante (l'échéance effective est la plus proche des deux)
+    """
+
+    def __init__(self, seconds: float, parent: Optional["Deadline"] = None):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+        self.parent = parent
+        if parent is not None:
+            self.expires_at = min(self.expires_at, parent.expires_at)
+        self._cancelled = False
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def cancel(self) -> None:
+        """Marque l'échéance comme annulée (vu par les threads au prochain point de contrôle)"""
+        self._cancelled = True
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled or (self.parent is not None and self.parent.cancelled)
+
+    @property
+    def expired(self) -> bool:
+        return self.cancelled or self.remaining() <= 0
+
+    def stage_timeout(self, stage: str) -> float:
+        """Budget de l'étape : sa part du temps restant, rapportée aux étapes restantes"""
+        upcoming = STAGE_ORDER[STAGE_ORDER.index(stage):]
+        share = STAGE_BUDGET_SHARES[stage] / sum(STAGE_BUDGET_SHARES[name] for name in upcoming)
+        return self.remaining() * share
+
+
+_current_deadline: contextvars.ContextVar[Optional[Deadline]] = contextvars.ContextVar(
+    "current_deadline", default=None
+)
+
+
+def get_current_deadline() -> Optional[Deadline]:
+    return _current_deadline.get()
+
+
+@contextmanager
+def deadline_scope(deadline: Deadline) -> Iterator[Deadline]:
+    """Installe une échéance pour le bloc (et les tâches / threads qu'il lance)"""
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
+
+
+def deadline_expired() -> bool:
+    """Point de contrôle (utilisable depuis les threads) : faut-il arrêter le travail en cours ?"""
+    deadline = _current_deadline.get()
+    return deadline is not None and deadline.expired
+
+
+async def run_stage(stage: str, func: Callable[..., Awaitable[Any]], *args: Any) -> Any:
+    """
+    Exécute une étape du pipeline dans son budget
+
+    Raises:
+        DeadlineExceeded: si l'étape dépasse son budget (la tâche est annulée)
+    """
+    parent = _current_deadline.get()
+    if parent is None:
+        return await func(*args)
+
+    stage_deadline = Deadline(parent.stage_timeout(stage), parent=parent)
+    token = _current_deadline.set(stage_deadline)
+    try:
+        # Marge pour le code coopératif, sans dépasser le délai englobant : la requête
+        # doit pouvoir rendre ses résultats partiels avant l'arrêt forcé
+        timeout = min(stage_deadline.remaining() + DEADLINE_GRACE_SECONDS, parent.remaining())
+        # wait_for crée une tâche qui hérite du contexte : l'étape voit son propre délai
+        return await asyncio.wait_for(func(*args), timeout=timeout)
+    except asyncio.TimeoutError:
+        stage_deadline.cancel()
+        raise DeadlineExceeded(stage)
+    finally:
+        _current_deadline.reset(token)
+
+
+async def run_with_deadline(coro_factory: Callable[[], Awaitable[Any]], seconds: float, request: Any = None) -> Any:
+    """
+    Exécute le traitement d'une requête sous un délai global, en surveillant la connexion
+
+    Le traitement gère lui-même son délai (résultats partiels) ; cette fonction ne fait
+    qu'arrêter net ce qui déborde encore (délai + marge) ou dont le client est parti.
+
+    Args:
+        coro_factory: Fonction sans argument qui crée la coroutine à exécuter
+        seconds: Délai global
+        request: Requête Starlette (détection de la déconnexion), optionnelle
+
+    Raises:
+        DeadlineExceeded: délai global dépassé
+        ClientDisconnected: client déconnecté
+    """
+    deadline = Deadline(seconds)
+    token = _current_deadline.set(deadline)
+    try:
+        # La tâche est créée après le set : elle hérite du Deadline
+        task = asyncio.ensure_future(coro_factory())
+    finally:
+        _current_deadline.reset(token)
+
+    try:
+        while not task.done():
+            hard_limit = deadline.remaining() + DEADLINE_GRACE_SECONDS
+            await asyncio.wait({task}, timeout=min(DISCONNECT_POLL_SECONDS, hard_limit))
+            if task.done():
+                break
+            if request is not None and await request.is_disconnected():
+                print("🔌 Client déconnecté : traitement annulé")
+                raise ClientDisconnected()
+            if time.monotonic() >= deadline.expires_at + DEADLINE_GRACE_SECONDS:
+                raise DeadlineExceeded()
+        return task.result()
+    except BaseException:
+        # Déconnexion, délai ou annulation de la requête elle-même : on arrête tout
+        deadline.cancel()
+        if not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        raise
+
+
+def format_partial_response(tool_outputs: Dict[str, str]) -> str:
+    """
+    Réponse de repli quand une analyse du chat est interrompue par le délai
+
+    Args:
+        tool_outputs: Sorties des agents-tools terminés (UsageTracker.tool_outputs)
+    """
+    # Import local : core.pipeline dépend des agents, qui dépendent de ce module
+    from core.pipeline import parse_agent_json
+
+    lines = ["⏱️ L'analyse a dépassé le délai imparti."]
+    if "report_generator_tool" in tool_outputs:
+        lines.append("")
+        lines.append(tool_outputs["report_generator_tool"])
+        return "\n".join(lines)
+
+    analysis = parse_agent_json(tool_outputs.get("pain_analysis_tool", ""))
+    if analysis.get("top_pains"):
+        lines.append("Voici les résultats partiels (douleurs identifiées, sans recommandations) :")
+        lines.append("")
+        for pain in analysis["top_pains"]:
+            lines.append(f"• **{pain.get('pain_type', '?')}** (Score: {pain.get('score', '?')})")
+            if pain.get("description"):
+                lines.append(f"  {pain['description']}")
+    elif "scraper_tool" in tool_outputs:
+        lines.append("Les posts ont été récupérés mais l'analyse n'a pas pu être terminée.")
+    lines.append("")
+    lines.append("Vous pouvez relancer l'analyse avec moins de posts ou de commentaires.")
+    return "\n".join(lines)
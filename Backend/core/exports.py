@@ -0,0 +1,185 @@
+"""
+Exports en streaming des solutions et des rapports d'analyse (CSV / NDJSON / Parquet).
+
+Les lignes sont lues dans Supabase page par page et sérialisées au fil de l'eau :
+la table n'est jamais chargée entièrement en mémoire et aucun LLM n'intervient.
+"""
+import io
+import os
+import csv
+import json
+from typing import Any, Dict, Iterator, List, Optional
+
+from core.functions import supabase
+from core.resilience import call_with_retry, supabase_breaker
+
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "500"))
+
+EXPORT_FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+# Colonnes exportées par table
+EXPORT_COLUMNS = {
+    "solutions": [
+        "id", "comment_id", "post_id", "author", "solution_text", "score",
+        "pain_type", "intensity", "subreddit", "created_at",
+    ],
+    "analysis_reports": [
+        "id", "session_id", "subreddit", "num_posts", "comments_limit",
+        "sort_criteria", "time_filter", "report", "created_at",
+    ],
+}
+
+
+# Colonnes entières (les autres sont exportées en texte dans Parquet)
+INTEGER_COLUMNS = {"id", "score", "intensity", "num_posts", "comments_limit"}
+
+
+def iter_rows(
+    table: str,
+    subreddit: Optional[str] = None,
+    pain_type: Optional[str] = None,
+    page_size: int = EXPORT_PAGE_SIZE,
+    after_id: int = 0,
+    columns: Optional[List[str]] = None,
+) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Parcourt une table Supabase par pages, filtrée côté serveur
+
+    Args:
+        table: Table à exporter ("solutions" ou "analysis_reports")
+        subreddit: Filtre exact sur le subreddit (optionnel)
+        pain_type: Filtre partiel, insensible à la casse, sur le type de douleur (solutions)
+        page_size: Nombre de lignes par page
+        after_id: Ne lire que les lignes d'id supérieur (reprise incrémentale)
+        columns: Colonnes lues (par défaut EXPORT_COLUMNS[table], "id" doit en faire partie)
+
+    Yields:
+        Pages de lignes (listes de dicts)
+    """
+    columns = ",".join(columns or EXPORT_COLUMNS[table])
+    last_id = after_id
+    while True:
+        # Pagination par clé (id > dernier id) : stable et sans OFFSET coûteux
+        query = supabase.table(table).select(columns).gt("id", last_id).order("id").limit(page_size)
+        if subreddit:
+            query = query.eq("subreddit", subreddit)
+        if pain_type and table == "solutions":
+            query = query.ilike("pain_type", f"%{pain_type}%")
+
+        rows = call_with_retry(supabase_breaker, query.execute).data
+        if not rows:
+            return
+        yield rows
+        if len(rows) < page_size:
+            return
+        last_id = rows[-1]["id"]
+
+
+def stream_csv(pages: Iterator[List[Dict[str, Any]]], columns: List[str]) -> Iterator[bytes]:
+    """Sérialise les pages en CSV, un chunk par page"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns, extrasaction="ignore")
+    writer.writeheader()
+    yield buffer.getvalue().encode("utf-8")
+    for rows in pages:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(rows)
+        yield buffer.getvalue().encode("utf-8")
+
+
+def stream_ndjson(pages: Iterator[List[Dict[str, Any]]], columns: List[str]) -> Iterator[bytes]:
+    """Sérialise les pages en NDJSON (une ligne JSON par enregistrement)"""
+    for rows in pages:
+        lines = [json.dumps({col: row.get(col) for col in columns}, ensure_ascii=False) for row in rows]
+        yield ("\n".join(lines) + "\n").encode("utf-8")
+
+
+class _ChunkSink(io.RawIOBase):
+    """Fichier en écriture seule dont on récupère les octets au fur et à mesure"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        chunk = bytes(data)
+        self._chunks.append(chunk)
+        self._position += len(chunk)
+        return len(chunk)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_parquet(pages: Iterator[List[Dict[str, Any]]], columns: List[str]) -> Iterator[bytes]:
+    """Sérialise les pages en Parquet, un row group par page"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    # Schéma explicite : une page où une colonne est vide ne doit pas changer les types
+    schema = pa.schema([
+        (col, pa.int64() if col in INTEGER_COLUMNS else pa.string()) for col in columns
+    ])
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    yield sink.drain()
+    for rows in pages:
+        table = pa.Table.from_pylist(
+            [
+                {col: row.get(col) if col in INTEGER_COLUMNS or row.get(col) is None else str(row.get(col))
+                 for col in columns}
+                for row in rows
+            ],
+            schema=schema,
+        )
+        writer.write_table(table)
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+_SERIALIZERS = {
+    "csv": stream_csv,
+    "ndjson": stream_ndjson,
+    "parquet": stream_parquet,
+}
+
+
+def stream_export(
+    table: str,
+    format_type: str,
+    subreddit: Optional[str] = None,
+    pain_type: Optional[str] = None,
+) -> Iterator[bytes]:
+    """
+    Génère l'export d'une table dans le format demandé, chunk par chunk
+
+    Args:
+        table: "solutions" ou "analysis_reports"
+        format_type: "csv", "ndjson" ou "parquet"
+        subreddit: Filtre sur le subreddit (optionnel)
+        pain_type: Filtre sur le type de douleur (optionnel, solutions uniquement)
+
+    Returns:
+        Itérateur d'octets à passer à un StreamingResponse
+    """
+    pages = iter_rows(table, subreddit=subreddit, pain_type=pain_type)
+    return _SERIALIZERS[format_type](pages, EXPORT_COLUMNS[table])
+
+
+def export_filename(table: str, format_type: str, subreddit: Optional[str] = None) -> str:
+    scope = f"_{subreddit}" if subreddit else ""
+    return f"{table}{scope}.{format_type}"
@@ -1,17 +1,36 @@
 import os
 import json
+import time
+import asyncio
+import threading
 import sqlite3
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, Any, List, Optional
+from typing import Callable, Dict, Any, List, Optional
 from dotenv import load_dotenv
 from pydantic import BaseModel
 
 import praw
+from praw.models import MoreComments
+from prawcore.exceptions import NotFound, Forbidden, Redirect, UnavailableForLegalReasons
 from openai import OpenAI
 from supabase import create_client, Client
 from agents import Agent, Runner, function_tool, trace, WebSearchTool
 
+from core.state import SharedCache, get_state_backend
+from core.bloom import BloomFilter
+from core.workers import LazyClient
+from core.deadlines import deadline_expired
+from core.preprocessing import clean_text, fit_corpus, is_bot_author, prepare_comment_body, prepare_post_text
+from core.intensity import annotate_intensity, average_post_intensity
+from core.ratelimit import reddit_limiter
+from core.search import index_scrape, index_solutions, search
+from core.archive import archive_scrape
+from core.db import execute, get_db
+from core.resilience import call_with_retry, reddit_breaker, supabase_breaker
+from core.profiling import span
+from core.lanes import BATCH, is_batch, to_thread, use_lane
+
 # Charger les variables d'environnement
 load_dotenv()
 
@@ -27,143 +46,409 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_ANON_KEY")
 
-# Initialiser les clients
-reddit = praw.Reddit(
+# Initialiser les clients : construits au premier appel, un par worker (cf. core/workers.py)
+reddit = LazyClient("reddit", lambda: praw.Reddit(
     client_id=REDDIT_CLIENT_ID,
     client_secret=REDDIT_CLIENT_SECRET,
     user_agent=REDDIT_USER_AGENT
-)
+))
 
-openai_client = OpenAI(api_key=OPENAI_API_KEY)
+openai_client = LazyClient("openai", lambda: OpenAI(api_key=OPENAI_API_KEY))
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# Client synchrone réservé aux lectures en masse exécutées dans des threads (exports,
+# filtre des commentaires connus, index de recherche) ; le reste passe par core/db.py
+supabase: Client = LazyClient("supabase", lambda: create_client(SUPABASE_URL, SUPABASE_KEY))
 
+# Cache des métadonnées de subreddits : positif (existe) et négatif (inexistant / banni / privé)
+SUBREDDIT_CACHE_TTL = int(os.getenv("SUBREDDIT_CACHE_TTL", "3600"))
+SUBREDDIT_NEGATIVE_CACHE_TTL = int(os.getenv("SUBREDDIT_NEGATIVE_CACHE_TTL", "300"))
+SUBREDDIT_LOOKUP_CONCURRENCY = int(os.getenv("SUBREDDIT_LOOKUP_CONCURRENCY", "8"))
+subreddit_cache = SharedCache("subreddit", default_ttl=SUBREDDIT_CACHE_TTL)
 
+# Cache des résultats de scraping (mêmes paramètres = mêmes posts pendant SCRAPE_CACHE_TTL, 0 = désactivé)
+SCRAPE_CACHE_TTL = int(os.getenv("SCRAPE_CACHE_TTL", "600"))
+scrape_cache = SharedCache("scrape", default_ttl=SCRAPE_CACHE_TTL)
 
-@function_tool
-def check_subreddit_exists(subreddit_name: str) -> str:
+# Récupération des commentaires : tri Reddit ("top" = par score), profondeur de l'arbre
+# (1 = commentaires de premier niveau) et nombre max de MoreComments développés par post
+COMMENT_SORT = os.getenv("COMMENT_SORT", "top")
+COMMENT_DEPTH = int(os.getenv("COMMENT_DEPTH", "1"))
+COMMENT_MORE_EXPANSIONS = int(os.getenv("COMMENT_MORE_EXPANSIONS", "1"))
+
+# Filtre des commentaires déjà stockés comme solutions (reconstruit périodiquement depuis Supabase)
+KNOWN_COMMENTS_REFRESH_SECONDS = int(os.getenv("KNOWN_COMMENTS_REFRESH_SECONDS", "3600"))
+KNOWN_COMMENTS_ERROR_RATE = 0.01
+KNOWN_COMMENTS_RETRY_SECONDS = 60
+_known_comments: Optional[BloomFilter] = None
+_known_comments_next_build = 0.0
+_known_comments_lock = threading.Lock()
+
+
+
+def _negative_status(error: Exception) -> Optional[str]:
     """
-    Vérifie si un subreddit existe via l'API Reddit
+    Classe une erreur Reddit en statut négatif définitif (à mettre en cache),
+    ou None si l'erreur est transitoire
+    """
+    reason = None
+    response = getattr(error, "response", None)
+    if response is not None:
+        try:
+            reason = response.json().get("reason")
+        except Exception:
+            reason = None
+
+    if isinstance(error, (NotFound, Redirect)):
+        return "banned" if reason == "banned" else "not_found"
+    if isinstance(error, Forbidden):
+        return reason if reason in ("private", "quarantined", "banned") else "private"
+    if isinstance(error, UnavailableForLegalReasons):
+        return "banned"
+    return None
+
+
+def _fetch_subreddit_info(subreddit_name: str) -> Dict[str, Any]:
+    # Appel Reddit réel ; PRAW charge l'objet au premier accès d'attribut
+    reddit_limiter.acquire(background=is_batch())
+    subreddit = reddit.subreddit(subreddit_name)
+    return {
+        "exists": True,
+        "status": "ok",
+        "subreddit": subreddit_name,
+        "subscribers": subreddit.subscribers,
+        "description": subreddit.public_description,
+        "title": subreddit.title,
+        "url": f"https://reddit.com/r/{subreddit_name}"
+    }
+
+
+def get_subreddit_info(subreddit_name: str) -> Dict[str, Any]:
+    """
+    Récupère les informations d'un subreddit, via le cache ou l'API Reddit
+    
+    Les subreddits existants sont gardés SUBREDDIT_CACHE_TTL secondes, les résultats
+    négatifs (inexistant, banni, privé) SUBREDDIT_NEGATIVE_CACHE_TTL secondes.
+    Les erreurs transitoires ne sont pas mises en cache.
     
     Args:
         subreddit_name: Nom du subreddit (sans le 'r/')
     
     Returns:
-        JSON string avec les informations du subreddit
+        Dict avec les informations du subreddit ("exists" à False si inaccessible)
     """
+    key = subreddit_name.lower()
+    cached = subreddit_cache.get(key)
+    if cached is not None:
+        return {**cached, "subreddit": subreddit_name, "cached": True}
+
     try:
-        # Utiliser PRAW pour accéder au subreddit
-        subreddit = reddit.subreddit(subreddit_name)
-        
-        # Récupérer les informations du subreddit
-        subreddit_info = {
-            "exists": True,
-            "subreddit": subreddit_name,
-            "subscribers": subreddit.subscribers,
-            "description": subreddit.public_description,
-            "title": subreddit.title,
-            "url": f"https://reddit.com/r/{subreddit_name}"
-        }
-        
-        return json.dumps(subreddit_info)
+        info = call_with_retry(reddit_breaker, _fetch_subreddit_info, subreddit_name)
+        subreddit_cache.set(key, info)
+        return {**info, "cached": False}
         
     except Exception as e:
-        error_info = {
+        status = _negative_status(e)
+        info = {
             "exists": False,
+            "status": status or "error",
             "subreddit": subreddit_name,
             "error": str(e)
         }
-        return json.dumps(error_info)
+        if status is not None:
+            subreddit_cache.set(key, info, ttl=SUBREDDIT_NEGATIVE_CACHE_TTL)
+        return {**info, "cached": False}
+
+
+async def lookup_subreddits(names: List[str]) -> List[Dict[str, Any]]:
+    """
+    Résout plusieurs subreddits en parallèle (cache partagé avec check_subreddit_exists)
+    
+    Args:
+        names: Noms des subreddits (avec ou sans 'r/')
+    
+    Returns:
+        Liste des informations, dans l'ordre des noms reçus
+    """
+    semaphore = asyncio.Semaphore(SUBREDDIT_LOOKUP_CONCURRENCY)
+    cleaned = [name.strip().removeprefix("/").removeprefix("r/") for name in names]
+
+    # Une seule requête Reddit par nom distinct (insensible à la casse)
+    unique: Dict[str, str] = {}
+    for name in cleaned:
+        unique.setdefault(name.lower(), name)
+
+    async def resolve(name: str) -> Dict[str, Any]:
+        async with semaphore:
+            return await asyncio.to_thread(get_subreddit_info, name)
+
+    resolved = await asyncio.gather(*(resolve(name) for name in unique.values()))
+    by_key = {info["subreddit"].lower(): info for info in resolved}
+    return [{**by_key[name.lower()], "subreddit": name} for name in cleaned]
 
 
 @function_tool
-def scrape_subreddit_posts(subreddit_name: str, num_posts: int = 10, sort_criteria: str = "top", comments_limit: int = 10, time_filter: str = "month") -> str:
+async def check_subreddit_exists(subreddit_name: str) -> str:
+    """
+    Vérifie si un subreddit existe via l'API Reddit
+    
+    Args:
+        subreddit_name: Nom du subreddit (sans le 'r/')
+    
+    Returns:
+        JSON string avec les informations du subreddit
+    """
+    return json.dumps(await to_thread(get_subreddit_info, subreddit_name))
+
+
+def _is_useful_comment(comment: Any) -> bool:
+    """Commentaire exploitable : ni MoreComments, ni supprimé, ni épinglé (modération), ni bot"""
+    body = getattr(comment, "body", None)
+    return (
+        bool(body)
+        and body not in ("[deleted]", "[removed]")
+        and not getattr(comment, "stickied", False)
+        and not is_bot_author(comment.author)
+    )
+
+
+def _load_comments(post: Any) -> List[Any]:
+    reddit_limiter.acquire(background=is_batch())
+    return post.comments.list()
+
+
+def _expand_more_comments(post: Any) -> None:
+    reddit_limiter.acquire(background=is_batch())
+    post.comments.replace_more(limit=1)
+
+
+def _fetch_comments(post: Any, comments_limit: int) -> List[Any]:
+    """
+    Récupère les meilleurs commentaires d'un post, triés par score côté Reddit
+    
+    Le tri, la limite et la profondeur sont passés à l'API : un seul appel suffit en général.
+    Les MoreComments ne sont développés que si le quota n'est pas atteint.
+    """
+    post.comment_sort = COMMENT_SORT
+    # Petite marge pour compenser les commentaires supprimés / épinglés écartés
+    post.comment_limit = comments_limit + 5
+    post.add_fetch_param("depth", COMMENT_DEPTH)
+    
+    comments = [comment for comment in call_with_retry(reddit_breaker, _load_comments, post) if _is_useful_comment(comment)]
+    
+    expansions = 0
+    while len(comments) < comments_limit and expansions < COMMENT_MORE_EXPANSIONS and not deadline_expired():
+        if not any(isinstance(item, MoreComments) for item in post.comments.list()):
+            break
+        call_with_retry(reddit_breaker, _expand_more_comments, post)
+        expansions += 1
+        comments = [comment for comment in post.comments.list() if _is_useful_comment(comment)]
+    
+    return comments[:comments_limit]
+
+
+def _post_to_dict(post: Any, comments_limit: int) -> Dict[str, Any]:
+    """
+    Convertit un post PRAW (et ses commentaires) en dict sérialisable
+    
+    Les textes sont nettoyés et tronqués au budget de tokens par élément (core.preprocessing) ;
+    un commentaire vide après nettoyage (citation seule, signature de bot...) est écarté.
+    """
+    comments_data = []
+    for comment in _fetch_comments(post, comments_limit):
+        body = prepare_comment_body(comment.author, comment.body)
+        if not body:
+            continue
+        comments_data.append({
+            "author": str(comment.author) if comment.author else "[deleted]",
+            "body": body,
+            "score": comment.score,
+            "created_utc": datetime.fromtimestamp(comment.created_utc).strftime('%Y-%m-%d %H:%M:%S'),
+            "id": comment.id
+        })
+    
+    # Données du post
+    return {
+        "title": clean_text(post.title),
+        "author": str(post.author) if post.author else "[deleted]",
+        "score": post.score,
+        "num_comments": post.num_comments,
+        "url": f"https://reddit.com{post.permalink}",
+        "selftext": prepare_post_text(post.selftext),
+        "comments": comments_data,
+        "id": post.id
+    }
+
+
+def _listing(subreddit_name: str, num_posts: int, sort_criteria: str, time_filter: str) -> Any:
+    """Retourne le listing PRAW (paresseux) correspondant au critère de tri"""
+    # Accéder au subreddit
+    subreddit = reddit.subreddit(subreddit_name)
+    reddit_limiter.acquire(background=is_batch())
+    
+    # Mapper les critères de tri
+    if sort_criteria == "top":
+        return subreddit.top(limit=num_posts, time_filter=time_filter)
+    elif sort_criteria == "new":
+        return subreddit.new(limit=num_posts)
+    elif sort_criteria == "hot":
+        return subreddit.hot(limit=num_posts)
+    elif sort_criteria == "best":
+        return subreddit.best(limit=num_posts)
+    elif sort_criteria == "rising":
+        return subreddit.rising(limit=num_posts, time_filter=time_filter)
+    else:
+        return subreddit.new(limit=num_posts)
+
+
+def _next_post(iterator: Any) -> Any:
+    return next(iterator)
+
+
+def _iter_listing(listing: Any) -> Any:
+    """Parcourt un listing PRAW ; chaque page est chargée via le disjoncteur Reddit"""
+    iterator = iter(listing)
+    while True:
+        try:
+            post = call_with_retry(reddit_breaker, _next_post, iterator)
+        except StopIteration:
+            return
+        yield post
+
+
+def _index_safely(index_function: Any, payload: Any) -> None:
+    """L'indexation plein texte ne doit jamais faire échouer le scraping ou le stockage"""
+    try:
+        index_function(payload)
+    except Exception as e:
+        print(f"Erreur indexation recherche: {e}")
+
+
+def scrape_posts(subreddit_name: str, num_posts: int = 10, sort_criteria: str = "top", comments_limit: int = 10, time_filter: str = "month", skip_post_ids: Optional[set] = None, on_post: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
     """
     Scrape les posts d'un subreddit selon les paramètres donnés
     
+    Les résultats sont mis en cache dans l'état partagé ; deux workers qui demandent
+    le même scraping en même temps n'appellent Reddit qu'une fois (verrou partagé).
+    
     Args:
         subreddit_name: Nom du subreddit (sans le 'r/')
         num_posts: Nombre de posts à récupérer
         sort_criteria: Critère de tri (top, new, hot, best, rising)
         comments_limit: Nombre de commentaires par post
         time_filter: Filtre temporel pour top/rising
+        skip_post_ids: Posts déjà traités à ignorer, sans charger leurs commentaires (scraping incrémental, non mis en cache)
+        on_post: Appelé avec chaque post dès qu'il est récupéré (y compris depuis le cache),
+            pour traiter les posts pendant que le scraping continue
     
     Returns:
         Dict avec les posts scrapés
     """
+    if skip_post_ids or not SCRAPE_CACHE_TTL:
+        return _scrape_posts(subreddit_name, num_posts, sort_criteria, comments_limit, time_filter, skip_post_ids, on_post)
+    
+    key = f"{subreddit_name.lower()}:{num_posts}:{sort_criteria}:{comments_limit}:{time_filter}"
+    cached = scrape_cache.get(key)
+    if cached is not None:
+        return _replay_cached(cached, on_post)
+    
+    with get_state_backend().lock(f"scrape:{key}", ttl=300, wait=300):
+        # Le détenteur précédent du verrou vient peut-être de remplir le cache
+        cached = scrape_cache.get(key)
+        if cached is not None:
+            return _replay_cached(cached, on_post)
+        result = _scrape_posts(subreddit_name, num_posts, sort_criteria, comments_limit, time_filter, on_post=on_post)
+        if result["success"] and not result["partial"]:
+            scrape_cache.set(key, result)
+        return {**result, "cached": False}
+
+
+def _replay_cached(cached: Dict[str, Any], on_post: Optional[Callable[[Dict[str, Any]], None]]) -> Dict[str, Any]:
+    if on_post is not None:
+        for post in cached["posts"]:
+            on_post(post)
+    return {**cached, "cached": True}
+
+
+def _scrape_posts(subreddit_name: str, num_posts: int, sort_criteria: str, comments_limit: int, time_filter: str, skip_post_ids: Optional[set] = None, on_post: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    """Scraping Reddit effectif (sans cache)"""
     try:
         # Limiter les valeurs pour éviter les abus
         num_posts = min(num_posts, 50)
         comments_limit = min(comments_limit, 50)
         
-        # Accéder au subreddit
-        subreddit = reddit.subreddit(subreddit_name)
-        
-        # Mapper les critères de tri
-        if sort_criteria == "top":
-            posts = subreddit.top(limit=num_posts, time_filter=time_filter)
-        elif sort_criteria == "new":
-            posts = subreddit.new(limit=num_posts)
-        elif sort_criteria == "hot":
-            posts = subreddit.hot(limit=num_posts)
-        elif sort_criteria == "best":
-            posts = subreddit.best(limit=num_posts)
-        elif sort_criteria == "rising":
-            posts = subreddit.rising(limit=num_posts, time_filter=time_filter)
-        else:
-            posts = subreddit.new(limit=num_posts)
-        
+        posts = _iter_listing(_listing(subreddit_name, num_posts, sort_criteria, time_filter))
+        skip_post_ids = skip_post_ids or set()
         posts_data = []
-        
+        skipped = 0
+        partial = False
         for post in posts:
-            # Récupérer les commentaires
-            post.comments.replace_more(limit=5)
-            
-            comments_data = []
-            for comment in post.comments.list()[:comments_limit]:
-                if hasattr(comment, 'body') and comment.body:
-                    comments_data.append({
-                        "author": str(comment.author) if comment.author else "[deleted]",
-                        "body": comment.body,
-                        "score": comment.score,
-                        "created_utc": datetime.fromtimestamp(comment.created_utc).strftime('%Y-%m-%d %H:%M:%S'),
-                        "id": comment.id
-                    })
-            
-            # Données du post
-            post_data = {
-                "title": post.title,
-                "author": str(post.author) if post.author else "[deleted]",
-                "score": post.score,
-                "num_comments": post.num_comments,
-                "url": f"https://reddit.com{post.permalink}",
-                "selftext": post.selftext[:1000] + "..." if len(post.selftext) > 1000 else post.selftext,
-                "comments": comments_data,
-                "id": post.id
-            }
-            
+            # Délai dépassé ou client parti : on rend les posts déjà récupérés
+            if deadline_expired():
+                partial = True
+                break
+            if post.id in skip_post_ids:
+                skipped += 1
+                continue
+            post_data = _post_to_dict(post, comments_limit)
             posts_data.append(post_data)
+            if on_post is not None:
+                on_post(post_data)
         
         result = {
             "success": True,
             "subreddit": subreddit_name,
             "sort_criteria": sort_criteria,
             "posts_count": len(posts_data),
+            "skipped_posts": skipped,
+            "partial": partial,
             "posts": posts_data,
             "scraped_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         }
-        return json.dumps(result)
+        # Un scraping interrompu (délai dépassé, préchargement abandonné) n'est ni indexé ni archivé
+        if partial:
+            result["archive_id"] = None
+            return result
+        _index_safely(index_scrape, result)
+        result["archive_id"] = archive_scrape(result, {
+            "num_posts": num_posts,
+            "comments_limit": comments_limit,
+            "sort_criteria": sort_criteria,
+            "time_filter": time_filter,
+        })
+        return result
         
     except Exception as e:
-        error_result = {
+        return {
             "success": False,
             "error": str(e),
             "subreddit": subreddit_name
         }
-        return json.dumps(error_result)
+
 
 @function_tool
-def store_solution_in_supabase(comment_id: str, post_id: str, author: str, solution_text: str, score: int, pain_type: str, intensity: int, subreddit: str, user_id: str = None) -> str:
+async def scrape_subreddit_posts(subreddit_name: str, num_posts: int = 10, sort_criteria: str = "top", comments_limit: int = 10, time_filter: str = "month") -> str:
+    """
+    Scrape les posts d'un subreddit selon les paramètres donnés
+    
+    Args:
+        subreddit_name: Nom du subreddit (sans le 'r/')
+        num_posts: Nombre de posts à récupérer
+        sort_criteria: Critère de tri (top, new, hot, best, rising)
+        comments_limit: Nombre de commentaires par post
+        time_filter: Filtre temporel pour top/rising
+    
+    Returns:
+        Dict avec les posts scrapés
+    """
+    # Voie batch : threads dédiés et priorité basse sur le limiteur Reddit
+    with use_lane(BATCH):
+        scrape = await to_thread(scrape_posts, subreddit_name, num_posts, sort_criteria, comments_limit, time_filter)
+        prepared = await asyncio.to_thread(prepare_for_llm, scrape)
+    with span("json"):
+        return json.dumps(prepared, ensure_ascii=False)
+
+@function_tool
+async def store_solution_in_supabase(comment_id: str, post_id: str, author: str, solution_text: str, score: int, pain_type: str, intensity: int, subreddit: str, user_id: str = None) -> str:
     """
     Stocke une solution exceptionnelle dans Supabase
     
@@ -183,7 +468,8 @@ def store_solution_in_supabase(comment_id: str, post_id: str, author: str, solut
     """
     try:
         # Insérer dans Supabase
-        result = supabase.table("solutions").insert({
+        db = await get_db()
+        result = await execute(db.table("solutions").insert({
             "comment_id": comment_id,
             "post_id": post_id,
             "author": author,
@@ -193,7 +479,9 @@ def store_solution_in_supabase(comment_id: str, post_id: str, author: str, solut
             "intensity": intensity,
             "subreddit": subreddit,
             "user_id": user_id
-        }).execute()
+        }), write=True)
+        await asyncio.to_thread(_index_safely, index_solutions, result.data)
+        remember_comment(comment_id)
         
         success_result = {
             "success": True,
@@ -203,6 +491,9 @@ def store_solution_in_supabase(comment_id: str, post_id: str, author: str, solut
         return json.dumps(success_result)
         
     except Exception as e:
+        # Violation de l'unicité de comment_id : la solution est déjà connue
+        if "duplicate key" in str(e):
+            remember_comment(comment_id)
         error_result = {
             "success": False,
             "error": str(e)
@@ -211,7 +502,7 @@ def store_solution_in_supabase(comment_id: str, post_id: str, author: str, solut
 
 
 @function_tool
-def calculate_pain_score(frequency: int, avg_upvotes: float, avg_comments: float, avg_intensity: float) -> str:
+def calculate_pain_score(frequency: int, avg_upvotes: float, avg_comments: float, avg_intensity: float, post_ids: Optional[List[str]] = None) -> str:
     """
     Calcule le score de priorité d'une douleur utilisateur
     
@@ -219,12 +510,18 @@ def calculate_pain_score(frequency: int, avg_upvotes: float, avg_comments: float
         frequency: Nombre de posts mentionnant cette douleur
         avg_upvotes: Moyenne des upvotes des posts concernés
         avg_comments: Moyenne des commentaires des posts concernés
-        avg_intensity: Intensité émotionnelle moyenne (1-10)
+        avg_intensity: Intensité émotionnelle moyenne (1-10), utilisée si post_ids n'est pas fourni
+        post_ids: IDs des posts concernés ; l'intensité moyenne est alors calculée à partir
+            des thread_intensity pré-calculées
     
     Returns:
         Dict avec le score calculé et les détails
     """
     try:
+        precomputed = average_post_intensity(post_ids) if post_ids else None
+        if precomputed is not None:
+            avg_intensity = precomputed
+        
         # Formule de scoring exacte de Version_00
         score = (frequency * 0.4) + (avg_upvotes * 0.2) + (avg_comments * 0.1) + (avg_intensity * 0.3)
         
@@ -236,7 +533,9 @@ def calculate_pain_score(frequency: int, avg_upvotes: float, avg_comments: float
                 "upvotes_component": round(avg_upvotes * 0.2, 2),
                 "comments_component": round(avg_comments * 0.1, 2),
                 "intensity_component": round(avg_intensity * 0.3, 2)
-            }
+            },
+            "avg_intensity": avg_intensity,
+            "intensity_source": "precomputed" if precomputed is not None else "agent"
         }
         return json.dumps(success_result)
         
@@ -248,7 +547,7 @@ def calculate_pain_score(frequency: int, avg_upvotes: float, avg_comments: float
         return json.dumps(error_result)
 
 @function_tool
-def store_exceptional_solution(comment_id: str, post_id: str, author: str, solution_text: str, score: int, pain_type: str, intensity: int, subreddit: str) -> str:
+async def store_exceptional_solution(comment_id: str, post_id: str, author: str, solution_text: str, score: int, pain_type: str, intensity: int, subreddit: str) -> str:
     """
     Stocke une solution exceptionnelle dans Supabase
     (Adapté de Version_00 pour Supabase)
@@ -267,7 +566,8 @@ def store_exceptional_solution(comment_id: str, post_id: str, author: str, solut
         Dict avec le statut du stockage
     """
     try:
-        result = supabase.table("solutions").insert({
+        db = await get_db()
+        result = await execute(db.table("solutions").insert({
             "comment_id": comment_id,
             "post_id": post_id,
             "author": author,
@@ -276,7 +576,9 @@ def store_exceptional_solution(comment_id: str, post_id: str, author: str, solut
             "pain_type": pain_type,
             "intensity": intensity,
             "subreddit": subreddit
-        }).execute()
+        }), write=True)
+        await asyncio.to_thread(_index_safely, index_solutions, result.data)
+        remember_comment(comment_id)
         
         success_result = {
             "success": True,
@@ -285,17 +587,117 @@ def store_exceptional_solution(comment_id: str, post_id: str, author: str, solut
         return json.dumps(success_result)
         
     except Exception as e:
+        # Violation de l'unicité de comment_id : la solution est déjà connue
+        if "duplicate key" in str(e):
+            remember_comment(comment_id)
         error_result = {
             "success": False,
             "error": str(e)
         }
         return json.dumps(error_result)
 
-@function_tool
-def get_stored_solutions(subreddit: str = None) -> str:
+def _build_known_comments() -> BloomFilter:
+    """Construit le filtre à partir de tous les comment_id de la table solutions"""
+    # Import local : core.exports dépend de ce module
+    from core.exports import iter_rows
+    
+    comment_ids = [row["comment_id"] for page in iter_rows("solutions", columns=["id", "comment_id"]) for row in page]
+    # Marge x2 : les insertions suivantes ne saturent pas le filtre avant la prochaine reconstruction
+    bloom = BloomFilter(max(10000, len(comment_ids) * 2), KNOWN_COMMENTS_ERROR_RATE)
+    bloom.update(comment_ids)
+    return bloom
+
+
+def get_known_comments() -> Optional[BloomFilter]:
+    """
+    Filtre de Bloom des commentaires déjà stockés, (re)construit si nécessaire
+    
+    Returns:
+        Le filtre, ou None s'il n'a jamais pu être construit
+    """
+    global _known_comments, _known_comments_next_build
+    with _known_comments_lock:
+        saturated = _known_comments is not None and _known_comments.saturated
+        if saturated or time.monotonic() >= _known_comments_next_build:
+            try:
+                _known_comments = _build_known_comments()
+                _known_comments_next_build = time.monotonic() + KNOWN_COMMENTS_REFRESH_SECONDS
+                print(f"🧮 Filtre des commentaires connus: {_known_comments.count} commentaires")
+            except Exception as e:
+                # On garde l'ancien filtre (ou aucun) et on réessaie plus tard
+                _known_comments_next_build = time.monotonic() + KNOWN_COMMENTS_RETRY_SECONDS
+                print(f"Erreur construction du filtre des commentaires connus: {e}")
+        return _known_comments
+
+
+def remember_comment(comment_id: str) -> None:
+    """Ajoute un commentaire stocké au filtre (sans attendre la prochaine reconstruction)"""
+    if _known_comments is not None:
+        _known_comments.add(comment_id)
+
+
+def _confirm_known_comments(comment_ids: List[str]) -> set:
+    """Vérifie dans Supabase les positifs du filtre (qui peuvent être des faux positifs)"""
+    confirmed = set()
+    for start in range(0, len(comment_ids), 200):
+        chunk = comment_ids[start:start + 200]
+        result = call_with_retry(supabase_breaker, supabase.table("solutions").select("comment_id").in_("comment_id", chunk).execute)
+        confirmed.update(row["comment_id"] for row in result.data)
+    return confirmed
+
+
+def prepare_for_llm(scrape: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Prépare un résultat de scraping pour PainAnalysisAgent
+    
+    Retire les commentaires déjà stockés comme solutions, ramène le corpus au budget
+    de tokens et joint les intensités émotionnelles pré-calculées.
+    """
+    with span("preprocess"):
+        return annotate_intensity(fit_corpus(drop_known_comments(scrape)))
+
+
+def drop_known_comments(scrape: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Retire d'un résultat de scraping les commentaires déjà stockés comme solutions
+    
+    Les négatifs du filtre de Bloom sont certains ; seuls les positifs sont confirmés
+    par une requête groupée. En cas de doute (filtre ou Supabase indisponible), rien n'est retiré.
+    
+    Args:
+        scrape: Résultat de scrape_posts
+    
+    Returns:
+        Le résultat avec les seuls commentaires nouveaux et "known_comments_skipped"
+    """
+    if not scrape.get("success"):
+        return scrape
+    bloom = get_known_comments()
+    if bloom is None:
+        return {**scrape, "known_comments_skipped": 0}
+    
+    candidates = [
+        comment["id"] for post in scrape["posts"] for comment in post["comments"] if comment["id"] in bloom
+    ]
+    known = set()
+    if candidates:
+        try:
+            known = _confirm_known_comments(candidates)
+        except Exception as e:
+            print(f"Erreur vérification des commentaires connus: {e}")
+    if not known:
+        return {**scrape, "known_comments_skipped": 0}
+    
+    posts = [
+        {**post, "comments": [comment for comment in post["comments"] if comment["id"] not in known]}
+        for post in scrape["posts"]
+    ]
+    return {**scrape, "posts": posts, "known_comments_skipped": len(known)}
+
+
+async def fetch_stored_solutions(subreddit: str = None) -> Dict[str, Any]:
     """
     Récupère les solutions stockées, optionnellement filtrées par subreddit
-    (Adapté de Version_00 pour Supabase)
     
     Args:
         subreddit: Nom du subreddit (optionnel)
@@ -305,13 +707,14 @@ def get_stored_solutions(subreddit: str = None) -> str:
     """
     try:
         # Construire la requête Supabase
-        query = supabase.table("solutions").select("*").order("score", desc=True)
+        db = await get_db()
+        query = db.table("solutions").select("*").order("score", desc=True)
         
         if subreddit:
             query = query.eq("subreddit", subreddit)
         
         # Exécuter la requête
-        result = query.execute()
+        result = await execute(query)
         solutions = result.data
         
         # Convertir en format compatible Version_00
@@ -330,197 +733,125 @@ def get_stored_solutions(subreddit: str = None) -> str:
                 "created_at": sol["created_at"]
             })
         
-        success_result = {
+        return {
             "success": True,
             "solutions": solutions_list,
             "count": len(solutions_list)
         }
-        return json.dumps(success_result)
         
     except Exception as e:
-        error_result = {
+        return {
             "success": False,
             "error": str(e)
         }
-        return json.dumps(error_result)
 
 
+@function_tool
+async def get_stored_solutions(subreddit: str = None) -> str:
+    """
+    Récupère les solutions stockées, optionnellement filtrées par subreddit
+    (Adapté de Version_00 pour Supabase)
+    
+    Args:
+        subreddit: Nom du subreddit (optionnel)
+    
+    Returns:
+        Dict avec les solutions trouvées
+    """
+    return json.dumps(await fetch_stored_solutions(subreddit))
+
+
+@function_tool
+async def search_stored_content(query: str, kind: str = None, subreddit: str = None, limit: int = 10) -> str:
+    """
+    Recherche plein texte dans les solutions stockées, les titres de posts et les commentaires scrapés
+    
+    Args:
+        query: Mots recherchés (ex: "facturation automatique")
+        kind: "solution", "post" ou "comment" (optionnel, tous par défaut)
+        subreddit: Nom du subreddit (optionnel)
+        limit: Nombre maximum de résultats
+    
+    Returns:
+        Dict avec les résultats classés par pertinence et un extrait surligné
+    """
+    try:
+        # Requête FTS5 (SQLite) hors de la boucle d'événements
+        results = await asyncio.to_thread(search, query, kind=kind, subreddit=subreddit, limit=limit)
+        return json.dumps(results, ensure_ascii=False)
+    except Exception as e:
+        return json.dumps({"success": False, "error": str(e)})
+
+
+@function_tool
+async def get_subreddit_profile(subreddit_name: str) -> str:
+    """
+    Profil déjà calculé d'un subreddit : douleurs principales, meilleures solutions, dernier rapport
+    
+    Args:
+        subreddit_name: Nom du subreddit (sans le 'r/')
+    
+    Returns:
+        Dict avec le profil et sa date de calcul, ou "exists": False s'il n'y en a pas encore
+    """
+    # Import local : subreddit_profiles dépend du pipeline, qui dépend des agents
+    from core.subreddit_profiles import get_profile
+
+    try:
+        profile = await get_profile(subreddit_name)
+    except Exception as e:
+        return json.dumps({"success": False, "error": str(e)})
+    if profile is None:
+        return json.dumps({"success": True, "exists": False, "subreddit": subreddit_name})
+    report = profile.get("last_report")
+    if report:
+        # Le texte complet reste disponible via /reports/{id}/render
+        profile["last_report"] = {key: value for key, value in report.items() if key != "report"}
+    return json.dumps({"exists": True, **profile}, ensure_ascii=False)
+
 
-# class FlexibleDict(BaseModel):
-#     class Config:
-#         extra = "allow"
-#         
-#     def dict(self, **kwargs):
-#         return super().dict(**kwargs)
-
-# @function_tool
-# def export_final_report(
-#     analysis_data: FlexibleDict, 
-#     recommendations_data: FlexibleDict, 
-#     format_type: str = "pdf"
-# ) -> str:
-#     """
-#     Exporte le rapport final d'analyse
-#     
-#     Args:
-#         analysis_data: Données d'analyse
-#         recommendations_data: Données de recommandations
-#         format_type: Format d'export (pdf, json, csv)
-#     
-#     Returns:
-#         Chaîne JSON avec le chemin du fichier exporté
-#     """
-#     try:
-#         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-#         
-#         # Convertir en dict pour compatibilité avec votre code existant
-#         analysis_dict = analysis_data.dict() if hasattr(analysis_data, 'dict') else analysis_data
-#         recommendations_dict = recommendations_data.dict() if hasattr(recommendations_data, 'dict') else recommendations_data
-#         
-#         subreddit = analysis_dict.get("subreddit", "unknown")
-#         
-#         # Créer le dossier exports s'il n'existe pas
-#         Path("exports").mkdir(exist_ok=True)
-#         
-#         if format_type == "json":
-#             filepath = f"exports/rapport_{subreddit}_{timestamp}.json"
-#             with open(filepath, 'w', encoding='utf-8') as f:
-#                 json.dump({
-#                     "analysis": analysis_dict,
-#                     "recommendations": recommendations_dict,
-#                     "exported_at": timestamp
-#                 }, f, ensure_ascii=False, indent=2)
-#         
-#         elif format_type == "txt":
-#             filepath = f"exports/rapport_{subreddit}_{timestamp}.txt"
-#             with open(filepath, 'w', encoding='utf-8') as f:
-#                 f.write(f"RAPPORT D'ANALYSE - r/{subreddit}\n")
-#                 f.write(f"Généré le: {timestamp}\n\n")
-#                 f.write("ANALYSE DES DOULEURS:\n")
-#                 f.write(json.dumps(analysis_dict, ensure_ascii=False, indent=2))
-#                 f.write("\n\nRECOMANDATIONS:\n")
-#                 f.write(json.dumps(recommendations_dict, ensure_ascii=False, indent=2))
-#         
-#         else:  # PDF par défaut
-#             filepath = f"exports/rapport_{subreddit}_{timestamp}.pdf"
-#             # Simuler l'export PDF (comme dans Version_00)
-#             with open(filepath, 'w', encoding='utf-8') as f:
-#                 f.write(f"RAPPORT PDF - r/{subreddit} - {timestamp}")
-#         
-#         return json.dumps({
-#             "success": True,
-#             "filepath": filepath,
-#             "format": format_type,
-#             "message": f"✅ Rapport exporté: {filepath}"
-#         })
-#         
-#     except Exception as e:
-#         return json.dumps({
-#             "success": False,
-#             "error": str(e)
-#         })
 
+async def save_analysis_report(subreddit: str, parameters: Dict[str, Any], report: str, session_id: str = None) -> Optional[int]:
+    """
+    Sauvegarde le rapport final d'une analyse dans la table analysis_reports
+    
+    Args:
+        subreddit: Nom du subreddit analysé
+        parameters: Paramètres de l'analyse (num_posts, comments_limit, sort_criteria, time_filter)
+        report: Rapport final produit par le ReportGenerator
+        session_id: Session à l'origine de l'analyse (optionnel)
+    
+    Returns:
+        ID du rapport sauvegardé, ou None en cas d'erreur
+    """
+    try:
+        db = await get_db()
+        result = await execute(db.table("analysis_reports").insert({
+            "session_id": session_id,
+            "subreddit": subreddit,
+            "num_posts": parameters.get("num_posts"),
+            "comments_limit": parameters.get("comments_limit"),
+            "sort_criteria": parameters.get("sort_criteria"),
+            "time_filter": parameters.get("time_filter"),
+            "report": report
+        }), write=True)
+        return result.data[0]["id"] if result.data else None
         
-# @function_tool
-# def export_exceptional_solutions(subreddit: str, format_type: str = "csv") -> str:
-#     """
-#     Exporte les solutions exceptionnelles d'un subreddit
-#     (Exact de Version_00)
-#     
-#     Args:
-#         subreddit: Nom du subreddit
-#         format_type: Format d'export (csv, json, txt)
-#     
-#     Returns:
-#         Chaîne JSON avec le chemin du fichier exporté
-#     """
-#     try:
-#         # Récupérer les solutions
-#         solutions_data_json = get_stored_solutions(subreddit)
-#         solutions_data = json.loads(solutions_data_json)
-#         
-#         if not solutions_data["success"]:
-#             return solutions_data_json
-#         
-#         solutions = solutions_data["solutions"]
-#         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-#         
-#         # Créer le dossier exports s'il n'existe pas
-#         Path("exports").mkdir(exist_ok=True)
-#         
-#         if format_type == "json":
-#             filepath = f"exports/solutions_{subreddit}_{timestamp}.json"
-#             with open(filepath, 'w', encoding='utf-8') as f:
-#                 json.dump(solutions, f, ensure_ascii=False, indent=2)
-#         
-#         elif format_type == "txt":
-#             filepath = f"exports/solutions_{subreddit}_{timestamp}.txt"
-#             with open(filepath, 'w', encoding='utf-8') as f:
-#                 f.write(f"SOLUTIONS EXCEPTIONNELLES - r/{subreddit}\n")
-#                 f.write(f"Générées le: {timestamp}\n\n")
-#                 for sol in solutions:
-#                     f.write(f"--- SOLUTION #{sol['id']} ---\n")
-#                     f.write(f"Type de douleur: {sol['pain_type']}\n")
-#                     f.write(f"Auteur: {sol['author']}\n")
-#                     f.write(f"Score: {sol['score']}\n")
-#                     f.write(f"Solution: {sol['solution_text']}\n\n")
-#         
-#         else:  # CSV par défaut
-#             filepath = f"exports/solutions_{subreddit}_{timestamp}.csv"
-#             with open(filepath, 'w', encoding='utf-8') as f:
-#                 f.write("ID,Pain Type,Author,Score,Solution\n")
-#                 for sol in solutions:
-#                     f.write(f"{sol['id']},{sol['pain_type']},{sol['author']},{sol['score']},\"{sol['solution_text']}\"\n")
-#         
-#         return json.dumps({
-#             "success": True,
-#             "filepath": filepath,
-#             "format": format_type,
-#             "message": f"✅ Solutions exportées: {filepath}"
-#         })
-#         
-#     except Exception as e:
-#         return json.dumps({
-#             "success": False,
-#             "error": str(e)
-#         })
-
-# @function_tool
-# def export_both_reports(analysis_data: Any, recommendations_data: Any, subreddit: str, format_type: str = "pdf") -> str:
-#     """
-#     Exporte à la fois le rapport final et les solutions exceptionnelles
-#     (Exact de Version_00)
-#     
-#     Args:
-#         analysis_data: Données d'analyse
-#         recommendations_data: Données de recommandations
-#         subreddit: Nom du subreddit
-#         format_type: Format d'export (pdf, json, csv)
-#     
-#     Returns:
-#         Chaîne JSON avec les chemins des fichiers exportés
-#     """
-#     try:
-#         # Exporter le rapport final
-#         report_result_json = export_final_report(analysis_data, recommendations_data, format_type)
-#         report_result = json.loads(report_result_json)
-#         
-#         # Exporter les solutions exceptionnelles
-#         solutions_result_json = export_exceptional_solutions(subreddit, format_type)
-#         solutions_result = json.loads(solutions_result_json)
-#         
-#         return json.dumps({
-#             "success": True,
-#             "report_export": report_result,
-#             "solutions_export": solutions_result,
-#             "message": "✅ Exports combinés terminés"
-#         })
-#         
-#     except Exception as e:
-#         return json.dumps({
-#             "success": False,
-#             "error": str(e)
-#         })
-
-# Fonctions d'export temporairement désactivées
-pass
\ No newline at end of file
+    except Exception as e:
+        print(f"Erreur sauvegarde rapport: {e}")
+        return None
+
+
+async def get_analysis_report(report_id: int) -> Optional[Dict[str, Any]]:
+    """
+    Récupère un rapport d'analyse sauvegardé
+    
+    Args:
+        report_id: ID du rapport dans analysis_reports
+    
+    Returns:
+        Le rapport, ou None s'il n'existe pas
+    """
+    db = await get_db()
+    result = await execute(db.table("analysis_reports").select("*").eq("id", report_id).limit(1))
+    return result.data[0] if result.data else None
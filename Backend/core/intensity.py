@@ -0,0 +1,184 @@
+"""
+Pré-calcul local de l'intensité émotionnelle (1-10) des posts et commentaires.
+
+Score lexical et typographique, en anglais et en français, calculé en un seul lot avec
+NumPy pour tout un scraping :
+- vocabulaire de frustration / douleur pondéré (mots et expressions) ;
+- intensifieurs (very, so, vraiment, trop...) qui renforcent le terme suivant ;
+- points d'exclamation, mots en majuscules, répétitions de lettres (« sooo »).
+
+Les intensités sont jointes aux données envoyées à PainAnalysisAgent : le modèle n'a plus
+à les estimer, et elles sont identiques d'une analyse à l'autre.
+"""
+import re
+import unicodedata
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from core.cache import TTLCache
+
+# Poids des termes de frustration / douleur (texte en minuscules, sans accents)
+_LEXICON = {
+    # Anglais
+    "hate": 3.0, "hated": 3.0, "hating": 3.0, "frustrating": 3.0, "frustrated": 3.0, "frustration": 3.0,
+    "annoying": 2.0, "annoyed": 2.0, "nightmare": 3.0, "terrible": 3.0, "awful": 3.0, "horrible": 3.0,
+    "worst": 3.0, "useless": 2.5, "broken": 2.0, "painful": 2.5, "pain": 1.5, "struggle": 2.0,
+    "struggling": 2.0, "stuck": 2.0, "impossible": 2.0, "ridiculous": 2.5, "garbage": 3.0, "trash": 2.5,
+    "sucks": 3.0, "suck": 2.5, "fail": 1.5, "fails": 1.5, "failing": 2.0, "failed": 1.5, "bug": 1.0,
+    "buggy": 2.0, "slow": 1.0, "confusing": 1.5, "confused": 1.5, "tired": 1.5, "exhausted": 2.0,
+    "desperate": 3.0, "angry": 3.0, "furious": 3.5, "disappointed": 2.0, "disappointing": 2.0,
+    "unusable": 3.0, "waste": 2.0, "wasted": 2.0, "wtf": 3.0, "ugh": 2.0, "damn": 2.0, "hell": 1.5,
+    "fed_up": 3.0, "sick_of": 3.0, "give_up": 2.5, "gave_up": 2.5, "pain_in_the": 3.0, "doesnt_work": 2.0,
+    "not_working": 2.0, "cant_stand": 3.0, "drives_me_crazy": 3.5,
+    # Français
+    "deteste": 3.0, "detester": 3.0, "frustrant": 3.0, "frustre": 3.0, "enervant": 2.5, "enerve": 2.5,
+    "agacant": 2.0, "cauchemar": 3.0, "horrible": 3.0, "nul": 2.0, "nulle": 2.0, "inutile": 2.0,
+    "galere": 2.5, "galerer": 2.5, "chiant": 3.0, "chiante": 3.0, "insupportable": 3.0,
+    "inutilisable": 3.0, "bloque": 2.0, "bloquee": 2.0, "lent": 1.0, "lente": 1.0, "penible": 2.5,
+    "epuise": 2.0, "decu": 2.0, "decevant": 2.0, "desespere": 3.0, "colere": 3.0, "rage": 3.0,
+    "honteux": 2.5, "ridicule": 2.5, "catastrophe": 3.0, "bordel": 2.0, "merde": 3.0,
+    "en_ai_marre": 3.0, "ras_le_bol": 3.0, "perte_de_temps": 2.5, "marche_pas": 2.0,
+    "fonctionne_pas": 2.0, "abandonne": 2.0,
+}
+_INTENSIFIERS = {
+    "very", "so", "really", "extremely", "incredibly", "totally", "absolutely", "super", "insanely",
+    "tres", "trop", "vraiment", "tellement", "completement", "totalement", "hyper", "grave",
+}
+# Expressions de plusieurs mots, réécrites en un seul terme avant découpage
+_PHRASES = sorted((term for term in _LEXICON if "_" in term), key=len, reverse=True)
+_PHRASE_RE = re.compile(r"\b(" + "|".join(re.escape(term.replace("_", " ")) for term in _PHRASES) + r")\b")
+
+_WORD_RE = re.compile(r"[a-z_]+")
+_CAPS_WORD_RE = re.compile(r"\b[A-ZÀ-Ý]{3,}\b")
+_WORD_ANY_RE = re.compile(r"\b\w{3,}\b")
+_ELONGATED_RE = re.compile(r"([a-z])\1{2,}")
+
+# Poids des caractéristiques : [lexique, exclamations, majuscules, lettres répétées]
+_FEATURE_WEIGHTS = np.array([1.0, 0.6, 3.0, 0.8])
+# Saturation : une intensité brute de _SCALE donne environ 6.7 / 10
+_SCALE = 4.0
+
+_post_intensities = TTLCache(max_entries=20000, default_ttl=3600)
+
+
+def _normalize(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text.lower()).encode("ascii", "ignore").decode("ascii")
+    # "doesn't" -> "doesnt", "n'importe" -> "nimporte"
+    text = text.replace("'", "")
+    return _PHRASE_RE.sub(lambda match: match.group(1).replace(" ", "_"), text)
+
+
+def score_intensity(texts: List[str]) -> np.ndarray:
+    """
+    Intensité émotionnelle de chaque texte, de 1 (neutre) à 10 (très intense)
+
+    Args:
+        texts: Textes à noter (anglais ou français)
+
+    Returns:
+        Tableau NumPy des intensités, arrondies au dixième
+    """
+    count = len(texts)
+    if not count:
+        return np.zeros(0)
+
+    # Découpage en mots (Python), puis tout le calcul se fait sur des tableaux
+    doc_ids: List[int] = []
+    weights: List[float] = []
+    boosted: List[bool] = []
+    word_counts = np.zeros(count)
+    for index, text in enumerate(texts):
+        words = _WORD_RE.findall(_normalize(text or ""))
+        word_counts[index] = len(words)
+        previous_intensifier = False
+        for word in words:
+            weight = _LEXICON.get(word)
+            if weight:
+                doc_ids.append(index)
+                weights.append(weight)
+                boosted.append(previous_intensifier)
+            previous_intensifier = word in _INTENSIFIERS
+
+    lexical = np.zeros(count)
+    if doc_ids:
+        term_weights = np.asarray(weights) * np.where(np.asarray(boosted), 1.5, 1.0)
+        np.add.at(lexical, np.asarray(doc_ids), term_weights)
+
+    safe_counts = np.maximum(word_counts, 1)
+    exclamations = np.array([(text or "").count("!") for text in texts], dtype=float)
+    caps = np.array([len(_CAPS_WORD_RE.findall(text or "")) for text in texts], dtype=float)
+    letters = np.array([len(_WORD_ANY_RE.findall(text or "")) for text in texts], dtype=float)
+    elongated = np.array([len(_ELONGATED_RE.findall((text or "").lower())) for text in texts], dtype=float)
+
+    features = np.column_stack([
+        # Densité lexicale : un long texte calme n'est pas intense pour un seul mot négatif
+        lexical / np.sqrt(safe_counts) * 2.0,
+        np.minimum(exclamations, 5.0),
+        caps / np.maximum(letters, 1),
+        np.minimum(elongated, 3.0),
+    ])
+    raw = features @ _FEATURE_WEIGHTS
+    intensity = 1.0 + 9.0 * (1.0 - np.exp(-raw / _SCALE))
+    return np.round(np.clip(intensity, 1.0, 10.0), 1)
+
+
+def annotate_intensity(scrape: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Ajoute les intensités pré-calculées à un résultat de scraping
+
+    Chaque post reçoit "intensity" (titre + texte) et "thread_intensity" (moyenne du post
+    et de ses commentaires), chaque commentaire "intensity". Les thread_intensity sont
+    mémorisées pour calculate_pain_score(post_ids=...).
+
+    Args:
+        scrape: Résultat de scrape_posts (non modifié)
+
+    Returns:
+        Le résultat annoté, avec "avg_intensity" sur l'ensemble des posts
+    """
+    if not scrape.get("success") or not scrape.get("posts"):
+        return scrape
+
+    texts: List[str] = []
+    owners: List[int] = []
+    for post_index, post in enumerate(scrape["posts"]):
+        texts.append(f"{post.get('title', '')}\n{post.get('selftext', '')}")
+        owners.append(post_index)
+        for comment in post.get("comments", []):
+            texts.append(comment.get("body", ""))
+            owners.append(post_index)
+    scores = score_intensity(texts)
+    owner_ids = np.asarray(owners)
+    thread_intensity = np.round(
+        np.bincount(owner_ids, weights=scores) / np.bincount(owner_ids), 1
+    )
+
+    posts = []
+    position = 0
+    for post_index, post in enumerate(scrape["posts"]):
+        post_score = float(scores[position])
+        position += 1
+        comments = []
+        for comment in post.get("comments", []):
+            comments.append({**comment, "intensity": float(scores[position])})
+            position += 1
+        thread = float(thread_intensity[post_index])
+        posts.append({**post, "intensity": post_score, "thread_intensity": thread, "comments": comments})
+        if post.get("id"):
+            _post_intensities.set(post["id"], thread)
+
+    return {**scrape, "posts": posts, "avg_intensity": round(float(thread_intensity.mean()), 1)}
+
+
+def average_post_intensity(post_ids: Iterable[str]) -> Optional[float]:
+    """
+    Intensité moyenne (thread_intensity) des posts donnés, calculée par annotate_intensity
+
+    Returns:
+        La moyenne, ou None si aucun de ces posts n'a été annoté par ce processus
+    """
+    values = [value for value in (_post_intensities.get(post_id) for post_id in post_ids) if value is not None]
+    if not values:
+        return None
+    return round(float(np.mean(values)), 1)
@@ -0,0 +1,290 @@
+"""
+Chemin rapide déterministe devant run_chat : les intentions triviales
+(vérification d'un subreddit, liste des solutions stockées, confirmation
+de paramètres structurés) sont traitées sans appel au LLM.
+
+Pendant que l'utilisateur confirme les paramètres proposés, le scraping correspondant
+est préchargé en arrière-plan (core.prefetch).
+"""
+import re
+import asyncio
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from core.functions import get_subreddit_info, fetch_stored_solutions
+from core.prefetch import cancel_prefetch, confirm_prefetch, start_prefetch
+from core.state import get_state_backend
+
+# Paramètres par défaut (identiques à prompt_0)
+DEFAULT_PARAMETERS = {
+    "num_posts": 5,
+    "comments_limit": 5,
+    "sort_criteria": "top",
+    "time_filter": "month",
+}
+
+SORT_CRITERIA = {"top", "new", "hot", "best", "rising"}
+
+# Périodes acceptées par Reddit, avec leurs équivalents français
+TIME_FILTERS = {
+    "hour": "hour", "heure": "hour",
+    "day": "day", "jour": "day",
+    "week": "week", "semaine": "week",
+    "month": "month", "mois": "month",
+    "year": "year", "année": "year", "annee": "year",
+    "all": "all",
+}
+
+_NAME = r"([A-Za-z0-9_]{2,21})"
+_BARE_SUBREDDIT_RE = re.compile(rf"^\s*/?r/{_NAME}\s*[?!.]*\s*$", re.IGNORECASE)
+# "subreddit X" n'est pris comme nom qu'avec un préfixe r/ ou suivi de "existe"
+# ("un subreddit pour les développeurs" va au LLM)
+_CHECK_RE = re.compile(
+    rf"(?:v[ée]rifie|check|existe|exists?)\b.*?\bsubreddit\s+/?r/{_NAME}\b"
+    rf"|\bsubreddit\s+(?:/?r/)?{_NAME}\s+(?:existe|exists?)\b"
+    rf"|\b/?r/{_NAME}\b.*?\b(?:existe|exists?)\b",
+    re.IGNORECASE,
+)
+# Uniquement les demandes explicites de solutions déjà stockées ("donne-moi des solutions pour..." va au LLM)
+_SOLUTIONS_RE = re.compile(
+    r"\bsolutions?\s+(?:d[ée]j[àa]\s+)?(?:stock[ée]e?s?|enregistr[ée]e?s?|sauvegard[ée]e?s?|stored|saved)\b"
+    r"|\b(?:stored|saved)\s+solutions?\b",
+    re.IGNORECASE,
+)
+_SUBREDDIT_MENTION_RE = re.compile(rf"\b/?r/{_NAME}\b", re.IGNORECASE)
+_POSTS_RE = re.compile(r"(\d+)\s*posts?\b", re.IGNORECASE)
+_COMMENTS_RE = re.compile(r"(\d+)\s*(?:commentaires?|comments?)\b", re.IGNORECASE)
+_TIME_WORDS = r"hour|heure|day|jour|week|semaine|month|mois|year|ann[ée]e|annee|all"
+# Tri et période uniquement à côté d'un mot-clé ("I am new to reddit" n'est pas un tri)
+_SORT_RE = re.compile(
+    rf"\b(?:tri(?:er)?|sort(?:ed)?|crit[èe]re(?:\s+de\s+tri)?)\s*(?:[:=]\s*|(?:par|by)\s+)?({'|'.join(sorted(SORT_CRITERIA))})\b",
+    re.IGNORECASE,
+)
+_TIME_RE = re.compile(
+    rf"\b(?:p[ée]riode|time(?:\s+filter)?|depuis)\s*(?::\s*|=\s*)?"
+    rf"(?:(?:un|une|1|l'|le|la|the|last|past)\s*)?({_TIME_WORDS})\b",
+    re.IGNORECASE,
+)
+# Expressions figées : "top of the week", "top du mois", "top de l'année", "top of all time"
+_TOP_OF_RE = re.compile(
+    rf"\btop\s+(?:of\s+(?:the\s+)?|de\s+(?:la\s+|l'|le\s+)?|du\s+)({_TIME_WORDS})\b",
+    re.IGNORECASE,
+)
+_YES_RE = re.compile(
+    r"^\s*(?:oui|yes|ok|okay|d'accord|parfait|go|vas-y|valide|je (?:confirme|valide)|c'est parti)\b",
+    re.IGNORECASE,
+)
+_CONFIRMED_RE = re.compile(r"\bje (?:confirme|valide)\b", re.IGNORECASE)
+_NO_RE = re.compile(r"^\s*(?:non|no|annule|stop)\b", re.IGNORECASE)
+
+# Analyse en attente de confirmation, par session (état partagé entre workers)
+PENDING_PARAMETERS_TTL = 3600
+
+
+@dataclass
+class FastPathResult:
+    """
+    Résultat du chemin rapide
+
+    Attributes:
+        intent: Intention détectée
+        response: Réponse finale à renvoyer sans LLM (si définie)
+        llm_message: Message réécrit à transmettre au LLM (si la suite exige le workflow)
+    """
+    intent: str
+    response: Optional[str] = None
+    llm_message: Optional[str] = None
+
+
+def parse_parameters(message: str) -> Dict[str, Any]:
+    """
+    Extrait les paramètres d'analyse présents dans un message libre
+
+    Args:
+        message: Message utilisateur
+
+    Returns:
+        Dict ne contenant que les paramètres trouvés
+    """
+    params: Dict[str, Any] = {}
+    if match := _POSTS_RE.search(message):
+        params["num_posts"] = min(int(match.group(1)), 50)
+    if match := _COMMENTS_RE.search(message):
+        params["comments_limit"] = min(int(match.group(1)), 50)
+
+    if match := _TOP_OF_RE.search(message):
+        params["sort_criteria"] = "top"
+        params["time_filter"] = _time_filter(match.group(1))
+    if match := _SORT_RE.search(message):
+        params["sort_criteria"] = match.group(1).lower()
+    if match := _TIME_RE.search(message):
+        params["time_filter"] = _time_filter(match.group(1))
+    return params
+
+
+def _time_filter(word: str) -> str:
+    return TIME_FILTERS[word.lower()]
+
+
+def format_parameters(subreddit: str, params: Dict[str, Any]) -> str:
+    return (
+        f"• Subreddit : r/{subreddit}\n"
+        f"• Nombre de posts : {params['num_posts']}\n"
+        f"• Commentaires par post : {params['comments_limit']}\n"
+        f"• Critère de tri : {params['sort_criteria']}\n"
+        f"• Période : {params['time_filter']}"
+    )
+
+
+def build_analysis_message(subreddit: str, params: Dict[str, Any]) -> str:
+    """Message d'analyse structuré et déjà confirmé, destiné au RouterAgent"""
+    return (
+        f"Analyse le subreddit r/{subreddit} avec {params['num_posts']} posts, "
+        f"{params['comments_limit']} commentaires par post, critère {params['sort_criteria']}, "
+        f"période {params['time_filter']}\n"
+        "Le subreddit existe (déjà vérifié). Je confirme bien que je suis sûr et je valide les paramètres."
+    )
+
+
+# Accès à l'état partagé hors de la boucle d'événements (client Redis synchrone)
+
+async def get_pending_parameters(session_id: str) -> Optional[Dict[str, Any]]:
+    """Analyse en attente de confirmation pour une session"""
+    return await asyncio.to_thread(get_state_backend().get, f"pending:{session_id}")
+
+
+async def set_pending_parameters(session_id: str, subreddit: str, parameters: Dict[str, Any]) -> None:
+    await asyncio.to_thread(
+        get_state_backend().set,
+        f"pending:{session_id}",
+        {"subreddit": subreddit, "parameters": parameters},
+        ttl=PENDING_PARAMETERS_TTL,
+    )
+
+
+async def clear_pending_parameters(session_id: str) -> None:
+    await asyncio.to_thread(get_state_backend().delete, f"pending:{session_id}")
+
+
+def format_check_response(info: Dict[str, Any]) -> str:
+    """Réponse textuelle à une vérification d'existence de subreddit"""
+    if not info["exists"]:
+        return (
+            f"Le subreddit r/{info['subreddit']} n'existe pas ou n'est pas accessible. "
+            "Veuillez vérifier le nom et réessayer."
+        )
+    return f"Le subreddit r/{info['subreddit']} existe ({info['subscribers']:,} abonnés)."
+
+
+async def _check_subreddit(subreddit: str, session_id: str, params: Dict[str, Any]) -> FastPathResult:
+    info = await asyncio.to_thread(get_subreddit_info, subreddit)
+    if not info["exists"]:
+        await clear_pending_parameters(session_id)
+        await cancel_prefetch(session_id)
+        return FastPathResult(intent="check_subreddit", response=format_check_response(info))
+
+    merged = {**DEFAULT_PARAMETERS, **params}
+    await set_pending_parameters(session_id, subreddit, merged)
+    await start_prefetch(session_id, subreddit, merged)
+    intro = "avec vos paramètres" if params else "avec les paramètres par défaut"
+    return FastPathResult(
+        intent="check_subreddit",
+        response=(
+            f"{format_check_response(info)}\n\n"
+            f"Je vous propose de lancer l'analyse {intro} :\n"
+            f"{format_parameters(subreddit, merged)}\n\n"
+            "Confirmez-vous ces paramètres ? (oui / non, ou indiquez les valeurs à modifier)"
+        ),
+    )
+
+
+async def _list_solutions(message: str) -> FastPathResult:
+    mention = _SUBREDDIT_MENTION_RE.search(message)
+    subreddit = mention.group(1) if mention else None
+    data = await fetch_stored_solutions(subreddit)
+    if not data["success"]:
+        # Laisser le LLM gérer l'erreur comme avant
+        return FastPathResult(intent="list_solutions", llm_message=message)
+
+    scope = f" pour r/{subreddit}" if subreddit else ""
+    if not data["count"]:
+        return FastPathResult(intent="list_solutions", response=f"Aucune solution stockée{scope} pour le moment.")
+
+    lines = [f"💡 **{data['count']} solution(s) stockée(s){scope}**", ""]
+    for i, sol in enumerate(data["solutions"][:20], 1):
+        text = sol["solution_text"]
+        text = text[:200] + "..." if len(text) > 200 else text
+        lines.append(f"{i}. **{sol['pain_type']}** (r/{sol['subreddit']}, score {sol['score']})")
+        lines.append(f"   {text}")
+    if data["count"] > 20:
+        lines.append(f"\n… et {data['count'] - 20} autre(s).")
+    return FastPathResult(intent="list_solutions", response="\n".join(lines))
+
+
+async def try_fast_path(message: str, session_id: str) -> Optional[FastPathResult]:
+    """
+    Tente de traiter un message sans LLM
+
+    Args:
+        message: Message utilisateur
+        session_id: ID de la session
+
+    Returns:
+        FastPathResult si une intention triviale est reconnue, None sinon
+    """
+    # Demande d'analyse déjà confirmée (ex. /analyze) : le workflow LLM est nécessaire
+    if _CONFIRMED_RE.search(message) and _SUBREDDIT_MENTION_RE.search(message):
+        await clear_pending_parameters(session_id)
+        return None
+
+    pending = await get_pending_parameters(session_id)
+
+    # Confirmation / refus d'une analyse proposée par le chemin rapide
+    if pending:
+        params = parse_parameters(message)
+        # "ok, mais 50 posts" modifie les paramètres : ce n'est pas une simple confirmation
+        if _YES_RE.match(message) and not params:
+            await clear_pending_parameters(session_id)
+            await confirm_prefetch(session_id)
+            return FastPathResult(
+                intent="confirm_parameters",
+                llm_message=build_analysis_message(pending["subreddit"], pending["parameters"]),
+            )
+        if _NO_RE.match(message):
+            await clear_pending_parameters(session_id)
+            await cancel_prefetch(session_id)
+            return FastPathResult(
+                intent="confirm_parameters",
+                response="D'accord, l'analyse n'est pas lancée. Quel subreddit ou quels paramètres souhaitez-vous ?",
+            )
+        if params and not _SUBREDDIT_MENTION_RE.search(message):
+            merged = {**pending["parameters"], **params}
+            await set_pending_parameters(session_id, pending["subreddit"], merged)
+            await start_prefetch(session_id, pending["subreddit"], merged)
+            return FastPathResult(
+                intent="confirm_parameters",
+                response=(
+                    "Paramètres mis à jour :\n"
+                    f"{format_parameters(pending['subreddit'], merged)}\n\n"
+                    "Confirmez-vous ces paramètres ? (oui / non)"
+                ),
+            )
+
+    # Vérification d'existence : "r/nom" seul ou phrase de vérification
+    if match := _BARE_SUBREDDIT_RE.match(message):
+        return await _check_subreddit(match.group(1), session_id, {})
+    if match := _CHECK_RE.search(message):
+        name = next(group for group in match.groups() if group)
+        return await _check_subreddit(name, session_id, {})
+
+    # Liste des solutions stockées
+    if _SOLUTIONS_RE.search(message):
+        return await _list_solutions(message)
+
+    # Demande structurée "r/nom + paramètres" : vérification puis confirmation
+    mention = _SUBREDDIT_MENTION_RE.search(message)
+    params = parse_parameters(message)
+    if mention and params:
+        return await _check_subreddit(mention.group(1), session_id, params)
+
+    return None
@@ -0,0 +1,220 @@
+"""
+Voies de priorité : interactive (réponses du RouterAgent, vérifications de subreddits)
+et batch (scraping, analyses complètes).
+
+La voie courante est portée par une contextvar, propagée aux sous-tâches et aux threads.
+Chaque voie a son propre quota sur les ressources partagées du worker :
+- appels OpenAI : requêtes HTTP simultanées par voie (transport du client OpenAI par
+  défaut du SDK agents, installé par configure_openai_client) ;
+- threads : les appels bloquants longs de la voie batch (scraping PRAW, lecture du corpus
+  local) passent par un pool dédié de BATCH_THREADS threads ; le pool par défaut reste aux
+  requêtes interactives et aux appels courts (cache LLM, préparation d'un lot), qui
+  n'attendent donc jamais derrière un scraping ;
+- limiteur Reddit : les appels batch laissent passer les appels interactifs en attente
+  et ne consomment pas les derniers jetons (core.ratelimit).
+
+Le quota de requêtes admises par voie est celui de core.admission ("chat" pour la voie
+interactive, "analysis" pour la voie batch).
+"""
+import os
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from typing import Any, Callable, Dict, Iterator, Optional
+
+import httpx
+
+from core.db import ReleasingStream
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+LANES = (INTERACTIVE, BATCH)
+
+OPENAI_INTERACTIVE_CONCURRENCY = int(os.getenv("OPENAI_INTERACTIVE_CONCURRENCY", "8"))  # par worker
+OPENAI_BATCH_CONCURRENCY = int(os.getenv("OPENAI_BATCH_CONCURRENCY", "4"))
+BATCH_THREADS = int(os.getenv("BATCH_THREADS", "4"))
+
+_current_lane: contextvars.ContextVar[str] = contextvars.ContextVar("lane", default=INTERACTIVE)
+
+
+def current_lane() -> str:
+    return _current_lane.get()
+
+
+def is_batch() -> bool:
+    return _current_lane.get() == BATCH
+
+
+@contextmanager
+def use_lane(lane: str) -> Iterator[None]:
+    """
+    Exécute le bloc (et les tâches / threads qu'il lance) dans une voie
+
+    Usage:
+        with use_lane(BATCH):
+            await run_watch(watch)
+    """
+    token = _current_lane.set(lane)
+    try:
+        yield
+    finally:
+        _current_lane.reset(token)
+
+
+# ===== THREADS =====
+
+_batch_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _get_batch_executor() -> ThreadPoolExecutor:
+    global _batch_executor
+    if _batch_executor is None:
+        _batch_executor = ThreadPoolExecutor(max_workers=BATCH_THREADS, thread_name_prefix="batch")
+    return _batch_executor
+
+
+async def to_thread(function: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """
+    asyncio.to_thread dans le pool de la voie courante (contexte copié, comme to_thread)
+
+    Réservé aux appels bloquants longs (scraping) : un appel court passe par
+    asyncio.to_thread pour ne pas attendre derrière eux dans le pool batch.
+    """
+    if not is_batch():
+        return await asyncio.to_thread(function, *args, **kwargs)
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        _get_batch_executor(), partial(context.run, function, *args, **kwargs)
+    )
+
+
+def shutdown_batch_executor() -> None:
+    global _batch_executor
+    if _batch_executor is not None:
+        _batch_executor.shutdown(wait=False, cancel_futures=True)
+        _batch_executor = None
+
+
+# ===== APPELS OPENAI =====
+
+class _LaneStats:
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_use = 0
+        self.waiting = 0
+        self.requests = 0
+        self.total_wait = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "in_use": self.in_use,
+            "waiting": self.waiting,
+            "requests": self.requests,
+            "avg_wait_ms": round(self.total_wait / self.requests * 1000, 2) if self.requests else 0.0,
+        }
+
+
+class LaneTransport(httpx.AsyncBaseTransport):
+    """
+    Transport httpx qui limite les requêtes simultanées par voie
+
+    Une analyse batch ne peut pas occuper plus de OPENAI_BATCH_CONCURRENCY requêtes :
+    les places de la voie interactive lui restent toujours disponibles.
+    """
+
+    def __init__(self, limits: Dict[str, int]):
+        self._transport = httpx.AsyncHTTPTransport(
+            limits=httpx.Limits(max_connections=sum(limits.values()), max_keepalive_connections=sum(limits.values())),
+        )
+        self._slots = {lane: asyncio.Semaphore(limit) for lane, limit in limits.items()}
+        self.stats = {lane: _LaneStats(limit) for lane, limit in limits.items()}
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        lane = current_lane()
+        slots, stats = self._slots[lane], self.stats[lane]
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        stats.waiting += 1
+        try:
+            await slots.acquire()
+        finally:
+            stats.waiting -= 1
+        stats.requests += 1
+        stats.total_wait += loop.time() - started
+        stats.in_use += 1
+
+        released = False
+
+        def release() -> None:
+            nonlocal released
+            if not released:
+                released = True
+                stats.in_use -= 1
+                slots.release()
+
+        try:
+            response = await self._transport.handle_async_request(request)
+        except BaseException:
+            release()
+            raise
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=ReleasingStream(response.stream, release),
+            extensions=response.extensions,
+        )
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+_openai_http: Optional[httpx.AsyncClient] = None
+_openai_transport: Optional[LaneTransport] = None
+
+
+def configure_openai_client() -> bool:
+    """
+    Installe le client OpenAI par défaut du SDK agents sur un transport à quotas par voie
+
+    Appelé par le lifespan de l'API ; sans clé OpenAI, le SDK garde son client par défaut.
+
+    Returns:
+        True si le client est installé
+    """
+    global _openai_http, _openai_transport
+    if _openai_http is not None:
+        return True
+    try:
+        from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+        from agents import set_default_openai_client
+
+        transport = LaneTransport({INTERACTIVE: OPENAI_INTERACTIVE_CONCURRENCY, BATCH: OPENAI_BATCH_CONCURRENCY})
+        http = DefaultAsyncHttpxClient(transport=transport)
+        set_default_openai_client(AsyncOpenAI(http_client=http))
+    except Exception as e:
+        print(f"⚠️ Client OpenAI par voies non installé: {e}")
+        return False
+    _openai_http, _openai_transport = http, transport
+    print(f"🛣️ Voies OpenAI: interactive {OPENAI_INTERACTIVE_CONCURRENCY}, batch {OPENAI_BATCH_CONCURRENCY}")
+    return True
+
+
+async def close_openai_client() -> None:
+    global _openai_http, _openai_transport
+    if _openai_http is not None:
+        await _openai_http.aclose()
+    _openai_http = _openai_transport = None
+
+
+def lane_status() -> Dict[str, Any]:
+    """Occupation des voies du worker (pour /health)"""
+    return {
+        "threads": {INTERACTIVE: "default", BATCH: BATCH_THREADS},
+        "openai": (
+            {lane: stats.to_dict() for lane, stats in _openai_transport.stats.items()}
+            if _openai_transport is not None else None
+        ),
+    }
@@ -0,0 +1,201 @@
+"""
+Store local SQLite : données dérivées et pré-calculées (séries temporelles, index...)
+qui n'ont pas besoin de transiter par Supabase.
+"""
+import os
+import sqlite3
+import threading
+from pathlib import Path
+
+LOCAL_DB_PATH = os.getenv("LOCAL_DB_PATH", "data/local_store.db")
+
+# Schéma du store : chaque fonctionnalité ajoute ses tables ici
+SCHEMA = [
+    # ----- Watchlist et séries temporelles de scores de douleur -----
+    """
+    CREATE TABLE IF NOT EXISTS watchlist (
+        subreddit TEXT PRIMARY KEY,
+        schedule TEXT NOT NULL,
+        num_posts INTEGER NOT NULL,
+        comments_limit INTEGER NOT NULL,
+        sort_criteria TEXT NOT NULL,
+        time_filter TEXT NOT NULL,
+        enabled INTEGER NOT NULL DEFAULT 1,
+        last_run_at TEXT,
+        next_run_at TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS watch_seen_posts (
+        subreddit TEXT NOT NULL,
+        post_id TEXT NOT NULL,
+        seen_at TEXT NOT NULL,
+        PRIMARY KEY (subreddit, post_id)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS pain_runs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        subreddit TEXT NOT NULL,
+        ran_at TEXT NOT NULL,
+        status TEXT NOT NULL,
+        posts_count INTEGER NOT NULL DEFAULT 0,
+        new_posts_count INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_pain_runs_subreddit ON pain_runs (subreddit, id)",
+    """
+    CREATE TABLE IF NOT EXISTS pain_scores (
+        run_id INTEGER NOT NULL,
+        pain_key TEXT NOT NULL,
+        subreddit TEXT NOT NULL,
+        pain_type TEXT NOT NULL,
+        score REAL NOT NULL,
+        frequency INTEGER NOT NULL,
+        PRIMARY KEY (run_id, pain_key)
+    ) WITHOUT ROWID
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_pain_scores_series ON pain_scores (subreddit, pain_key, run_id)",
+    # Noms de subreddits en minuscules (lignes antérieures à la normalisation)
+    "UPDATE OR IGNORE watchlist SET subreddit = lower(subreddit) WHERE subreddit != lower(subreddit)",
+    "UPDATE OR IGNORE watch_seen_posts SET subreddit = lower(subreddit) WHERE subreddit != lower(subreddit)",
+    "UPDATE pain_runs SET subreddit = lower(subreddit) WHERE subreddit != lower(subreddit)",
+    "UPDATE pain_scores SET subreddit = lower(subreddit) WHERE subreddit != lower(subreddit)",
+    # ----- Index plein texte (solutions, posts et commentaires scrapés) -----
+    """
+    CREATE TABLE IF NOT EXISTS search_documents (
+        id INTEGER PRIMARY KEY,
+        doc_key TEXT NOT NULL UNIQUE,
+        kind TEXT NOT NULL,
+        subreddit TEXT,
+        post_id TEXT,
+        author TEXT,
+        score INTEGER,
+        pain_type TEXT,
+        title TEXT,
+        body TEXT NOT NULL,
+        indexed_at TEXT NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_search_documents_filter ON search_documents (kind, subreddit)",
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5(
+        title, body, pain_type,
+        content='search_documents', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    # Triggers : l'index FTS suit la table de contenu (insertion, upsert, suppression)
+    """
+    CREATE TRIGGER IF NOT EXISTS search_documents_ai AFTER INSERT ON search_documents BEGIN
+        INSERT INTO search_fts (rowid, title, body, pain_type) VALUES (new.id, new.title, new.body, new.pain_type);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS search_documents_ad AFTER DELETE ON search_documents BEGIN
+        INSERT INTO search_fts (search_fts, rowid, title, body, pain_type) VALUES ('delete', old.id, old.title, old.body, old.pain_type);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS search_documents_au AFTER UPDATE ON search_documents BEGIN
+        INSERT INTO search_fts (search_fts, rowid, title, body, pain_type) VALUES ('delete', old.id, old.title, old.body, old.pain_type);
+        INSERT INTO search_fts (rowid, title, body, pain_type) VALUES (new.id, new.title, new.body, new.pain_type);
+    END
+    """,
+    # ----- Archive des scrapings (fichiers Arrow) -----
+    """
+    CREATE TABLE IF NOT EXISTS scrape_archive (
+        id INTEGER PRIMARY KEY,
+        subreddit TEXT NOT NULL,
+        sort_criteria TEXT,
+        parameters TEXT,
+        scraped_at TEXT,
+        posts_count INTEGER NOT NULL,
+        comments_count INTEGER NOT NULL,
+        partial INTEGER NOT NULL DEFAULT 0,
+        bytes INTEGER NOT NULL,
+        path TEXT NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_scrape_archive_subreddit ON scrape_archive (subreddit, id)",
+    # ----- Corpus hors ligne (dumps Reddit, cf. core/corpus.py) -----
+    """
+    CREATE TABLE IF NOT EXISTS corpus_posts (
+        id TEXT PRIMARY KEY,
+        subreddit TEXT NOT NULL,
+        created_utc INTEGER NOT NULL,
+        author TEXT,
+        title TEXT NOT NULL,
+        selftext TEXT,
+        score INTEGER NOT NULL,
+        num_comments INTEGER NOT NULL,
+        url TEXT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_corpus_posts_subreddit ON corpus_posts (subreddit COLLATE NOCASE, created_utc)",
+    """
+    CREATE TABLE IF NOT EXISTS corpus_comments (
+        id TEXT PRIMARY KEY,
+        post_id TEXT NOT NULL,
+        subreddit TEXT NOT NULL,
+        created_utc INTEGER NOT NULL,
+        author TEXT,
+        body TEXT NOT NULL,
+        score INTEGER NOT NULL,
+        top_level INTEGER NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_corpus_comments_post ON corpus_comments (post_id, top_level, score)",
+    "CREATE INDEX IF NOT EXISTS idx_corpus_comments_subreddit ON corpus_comments (subreddit)",
+    # ----- Profils matérialisés des subreddits (cf. core/subreddit_profiles.py) -----
+    """
+    CREATE TABLE IF NOT EXISTS subreddit_profiles (
+        subreddit TEXT PRIMARY KEY COLLATE NOCASE,
+        profile TEXT NOT NULL,
+        refreshed_at TEXT NOT NULL,
+        requests INTEGER NOT NULL DEFAULT 0,
+        last_requested_at TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS store_meta (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    )
+    """,
+]
+
+_local = threading.local()
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+
+def _init_schema(connection: sqlite3.Connection) -> None:
+    global _schema_ready
+    with _schema_lock:
+        if _schema_ready:
+            return
+        for statement in SCHEMA:
+            connection.execute(statement)
+        connection.commit()
+        _schema_ready = True
+
+
+def get_connection() -> sqlite3.Connection:
+    """
+    Connexion SQLite du thread courant (une par thread, schéma créé au premier appel)
+
+    Returns:
+        Connexion avec row_factory sqlite3.Row
+    """
+    connection = getattr(_local, "connection", None)
+    if connection is None:
+        Path(LOCAL_DB_PATH).parent.mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(LOCAL_DB_PATH, timeout=30)
+        connection.row_factory = sqlite3.Row
+        # WAL : lectures concurrentes pendant les écritures (plusieurs workers)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        _init_schema(connection)
+        _local.connection = connection
+    return connection
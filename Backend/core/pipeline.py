@@ -0,0 +1,552 @@
+"""
+Étapes du pipeline d'analyse appelées directement (sans RouterAgent ni WorkflowManager) :
+scraping et analyse des douleurs (pipelinés), recommandations et rapport final.
+
+Chaque étape passe par run_tracked : l'usage est comptabilisé dans l'analyse en cours.
+Sous un délai de requête (core.deadlines), chaque étape dispose de sa part du temps
+restant et lève DeadlineExceeded au-delà.
+Les sorties sont mises en cache dans l'état partagé : une même entrée n'est envoyée
+qu'une fois au LLM pendant LLM_CACHE_TTL secondes, tous workers confondus.
+"""
+import os
+import re
+import json
+import asyncio
+import hashlib
+import threading
+import unicodedata
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from agents import Agent
+from agents.exceptions import MaxTurnsExceeded
+
+from core.deadlines import DeadlineExceeded, run_stage
+from core.archive import load_scrape
+from core.corpus import load_corpus_scrape, parse_date
+from core.functions import prepare_for_llm, scrape_posts
+from core.lanes import to_thread
+from core.preprocessing import CORPUS_MAX_TOKENS, post_tokens
+from core.reddit_agents import agent_3, agent_4, agent_5
+from core.state import SharedCache
+from core.usage import BudgetExceededError, run_tracked, tracked_analysis
+
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", "86400"))
+llm_cache = SharedCache("llm", default_ttl=LLM_CACHE_TTL)
+
+# Mode pipeliné : les posts scrapés partent à l'analyse par lots de PIPELINE_BATCH_SIZE
+# pendant que le scraping continue (0 = analyse unique après le scraping complet)
+PIPELINE_BATCH_SIZE = int(os.getenv("PIPELINE_BATCH_SIZE", "5"))
+PIPELINE_ANALYSIS_WORKERS = int(os.getenv("PIPELINE_ANALYSIS_WORKERS", "2"))
+# Analyse du corpus local : lots remplis jusqu'à CORPUS_MAX_TOKENS (au plus CORPUS_BATCH_MAX_POSTS posts),
+# et budget de l'analyse augmenté de CORPUS_BATCH_TOKENS / CORPUS_BATCH_TURNS par lot
+CORPUS_BATCH_MAX_POSTS = int(os.getenv("CORPUS_BATCH_MAX_POSTS", "50"))
+CORPUS_BATCH_TOKENS = int(os.getenv("CORPUS_BATCH_TOKENS", "100000"))
+CORPUS_BATCH_TURNS = int(os.getenv("CORPUS_BATCH_TURNS", "8"))
+# Similarité (Jaccard sur les mots) à partir de laquelle deux douleurs sont fusionnées
+PAIN_SIMILARITY_THRESHOLD = float(os.getenv("PAIN_SIMILARITY_THRESHOLD", "0.5"))
+
+# Champs qui changent à chaque scraping sans changer le contenu analysé
+_VOLATILE_KEYS = ("scraped_at", "cached", "archive_id")
+
+_JSON_BLOCK_RE = re.compile(r"\{.*\}", re.DOTALL)
+
+_STOPWORDS = {
+    "les", "des", "une", "pour", "dans", "sur", "avec", "par", "aux", "du", "de", "la", "le",
+    "the", "and", "for", "with", "of", "to", "in", "on", "lack", "manque", "probleme", "problemes", "problem", "problems",
+}
+
+
+def pain_tokens(label: str) -> frozenset:
+    """Mots significatifs d'un libellé de douleur (minuscules, sans accents ni mots vides)"""
+    text = unicodedata.normalize("NFKD", label.lower()).encode("ascii", "ignore").decode("ascii")
+    return frozenset(
+        word for word in re.findall(r"[a-z0-9]+", text)
+        if len(word) > 2 and word not in _STOPWORDS
+    )
+
+
+def pain_key(label: str) -> str:
+    """Clé stable d'une douleur, pour la suivre d'une analyse à l'autre"""
+    tokens = pain_tokens(label)
+    return " ".join(sorted(tokens)) if tokens else label.strip().lower()
+
+
+def _as_float(value: Any) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def merge_pain_lists(analyses: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Fusionne les listes de douleurs de plusieurs subreddits (ou de plusieurs lots de posts)
+
+    Deux douleurs sont regroupées quand leurs libellés partagent assez de mots
+    (similarité de Jaccard >= PAIN_SIMILARITY_THRESHOLD).
+
+    Args:
+        analyses: Analyse (format prompt_3) par subreddit (ou par lot)
+
+    Returns:
+        Dict avec "merged" (toutes les douleurs), "shared_pains" et "unique_pains" (par clé)
+    """
+    clusters: List[Dict[str, Any]] = []
+    for subreddit, analysis in analyses.items():
+        for pain in analysis.get("top_pains", []):
+            label = str(pain.get("pain_type", "")).strip()
+            if not label:
+                continue
+            tokens = pain_tokens(label)
+
+            best, best_similarity = None, 0.0
+            for cluster in clusters:
+                union = tokens | cluster["tokens"]
+                similarity = len(tokens & cluster["tokens"]) / len(union) if union else 0.0
+                if similarity > best_similarity:
+                    best, best_similarity = cluster, similarity
+            if best is None or best_similarity < PAIN_SIMILARITY_THRESHOLD:
+                best = {"tokens": tokens, "labels": {}, "by_subreddit": {}}
+                clusters.append(best)
+
+            score = _as_float(pain.get("score"))
+            best["labels"][label] = max(score, best["labels"].get(label, 0.0))
+            entry = best["by_subreddit"].setdefault(subreddit, {"score": 0.0, "frequency": 0, "description": ""})
+            entry["score"] = max(entry["score"], score)
+            entry["frequency"] += int(_as_float(pain.get("frequency")))
+            entry["description"] = entry["description"] or pain.get("description", "")
+
+    merged = []
+    for cluster in clusters:
+        by_subreddit = cluster["by_subreddit"]
+        scores = [entry["score"] for entry in by_subreddit.values()]
+        merged.append({
+            # Libellé le mieux noté du groupe
+            "pain_type": max(cluster["labels"], key=cluster["labels"].get),
+            "subreddits": sorted(by_subreddit),
+            "shared": len(by_subreddit) > 1,
+            "score": round(sum(scores) / len(scores), 2),
+            "max_score": round(max(scores), 2),
+            "frequency": sum(entry["frequency"] for entry in by_subreddit.values()),
+            "description": next((e["description"] for e in by_subreddit.values() if e["description"]), ""),
+            "by_subreddit": by_subreddit,
+        })
+    merged.sort(key=lambda pain: (len(pain["subreddits"]), pain["score"]), reverse=True)
+
+    unique_pains: Dict[str, List[Dict[str, Any]]] = {subreddit: [] for subreddit in analyses}
+    for pain in merged:
+        if not pain["shared"]:
+            unique_pains[pain["subreddits"][0]].append(pain)
+
+    return {
+        "merged": merged,
+        "shared_pains": [pain for pain in merged if pain["shared"]],
+        "unique_pains": unique_pains,
+    }
+
+
+def parse_agent_json(output: Any) -> Dict[str, Any]:
+    """
+    Extrait l'objet JSON d'une sortie d'agent (avec ou sans bloc ```json```)
+
+    Args:
+        output: final_output d'un RunResult
+
+    Returns:
+        Le dict décodé, ou {} si la sortie ne contient pas de JSON valide
+    """
+    if isinstance(output, dict):
+        return output
+    match = _JSON_BLOCK_RE.search(str(output))
+    if not match:
+        return {}
+    try:
+        return json.loads(match.group(0))
+    except json.JSONDecodeError:
+        return {}
+
+
+async def _run_step(agent: Agent, data: Dict[str, Any]) -> Any:
+    """Exécute une étape (run_tracked) en passant par le cache LLM partagé"""
+    payload = json.dumps(data, ensure_ascii=False)
+    if not LLM_CACHE_TTL:
+        return (await run_tracked(agent, payload)).final_output
+
+    stable = {key: value for key, value in data.items() if key not in _VOLATILE_KEYS}
+    digest = hashlib.sha256(
+        f"{agent.model}\n{agent.instructions}\n{json.dumps(stable, sort_keys=True)}".encode("utf-8")
+    ).hexdigest()
+    key = f"{agent.name}:{digest}"
+
+    cached = await asyncio.to_thread(llm_cache.get, key)
+    if cached is not None:
+        return cached
+    output = str((await run_tracked(agent, payload)).final_output)
+    if output.strip():
+        await asyncio.to_thread(llm_cache.set, key, output)
+    return output
+
+
+async def analyze_pains(scrape_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Étape PainAnalysisAgent sur des données scrapées
+
+    Les données passent par prepare_for_llm : commentaires déjà stockés retirés,
+    corpus ramené à CORPUS_MAX_TOKENS, intensités pré-calculées jointes.
+
+    Args:
+        scrape_data: Résultat de scrape_posts
+
+    Returns:
+        Analyse structurée (top_pains, solutions_stored...) au format de prompt_3
+    """
+    scrape_data = await asyncio.to_thread(prepare_for_llm, scrape_data)
+    analysis = parse_agent_json(await run_stage("pain_analysis", _run_step, agent_3, scrape_data))
+    analysis.setdefault("subreddit", scrape_data.get("subreddit"))
+    analysis.setdefault("top_pains", [])
+    return analysis
+
+
+def merge_batch_analyses(subreddit: str, analyses: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Étape de fusion du mode pipeliné : une seule analyse à partir de celles des lots
+
+    Les douleurs proches (même regroupement que merge_pain_lists) sont fusionnées :
+    fréquences additionnées, score moyen des lots où la douleur apparaît.
+
+    Args:
+        subreddit: Subreddit analysé
+        analyses: Analyses (format prompt_3) des lots
+
+    Returns:
+        Analyse au format prompt_3
+    """
+    if len(analyses) == 1:
+        return analyses[0]
+    merged = merge_pain_lists({str(index): analysis for index, analysis in enumerate(analyses)})["merged"]
+    # Une douleur retrouvée dans plusieurs lots est une douleur récurrente
+    merged.sort(key=lambda pain: (pain["frequency"], pain["score"]), reverse=True)
+    return {
+        "analysis_success": any(analysis.get("analysis_success", True) for analysis in analyses),
+        "subreddit": subreddit,
+        "top_pains": [
+            {key: pain[key] for key in ("pain_type", "score", "description", "frequency")}
+            for pain in merged
+        ],
+        "solutions_stored": sum(int(_as_float(analysis.get("solutions_stored"))) for analysis in analyses),
+        "batches": len(analyses),
+    }
+
+
+async def scrape_and_analyze(
+    subreddit: str,
+    num_posts: int = 10,
+    sort_criteria: str = "top",
+    comments_limit: int = 10,
+    time_filter: str = "month",
+    skip_post_ids: Optional[set] = None,
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Scraping et analyse des douleurs en recouvrement
+
+    Les posts sont envoyés par lots de PIPELINE_BATCH_SIZE à PIPELINE_ANALYSIS_WORKERS
+    analyses concurrentes dès qu'ils sont scrapés ; les analyses des lots sont fusionnées
+    une fois scraping et analyses terminés. Le temps total se rapproche de
+    max(scraping, analyse) au lieu de leur somme.
+
+    Args:
+        subreddit: Nom du subreddit
+        num_posts, sort_criteria, comments_limit, time_filter: Paramètres de scrape_posts
+        skip_post_ids: Posts déjà traités à ignorer (scraping incrémental)
+
+    Returns:
+        (résultat de scrape_posts, analyse fusionnée au format prompt_3) ; l'analyse est
+        vide si aucun post n'a été récupéré, et marquée "partial" si un lot a dépassé le délai
+
+    Raises:
+        DeadlineExceeded: si le scraping dépasse son budget
+    """
+    scrape_function = partial(
+        scrape_posts, subreddit, num_posts, sort_criteria, comments_limit, time_filter, skip_post_ids
+    )
+    return await _fetch_and_analyze(subreddit, sort_criteria, scrape_function)
+
+
+async def _fetch_and_analyze(
+    subreddit: str,
+    sort_criteria: str,
+    fetch_function: Callable[..., Dict[str, Any]],
+    batch_size: int = PIPELINE_BATCH_SIZE,
+    batch_tokens: int = 0,
+    on_batch: Optional[Callable[[], None]] = None,
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Analyse pipelinée sur une source de posts quelconque
+
+    Args:
+        fetch_function: Fonction synchrone (exécutée dans un thread) qui retourne un résultat
+            au format scrape_posts et accepte on_post=callback
+        batch_size: Posts par lot (0 = analyse unique après la récupération complète)
+        batch_tokens: Tokens estimés par lot au plus (0 = lots de batch_size posts)
+        on_batch: Appelé avant l'analyse de chaque lot
+    """
+    if batch_size <= 0:
+        scrape = await run_stage("scrape", to_thread, fetch_function)
+        if not scrape["success"] or not scrape["posts"]:
+            return scrape, {}
+        return scrape, await analyze_pains(scrape)
+
+    loop = asyncio.get_running_loop()
+    batches: asyncio.Queue = asyncio.Queue()
+    pending: List[Dict[str, Any]] = []
+    pending_tokens = 0
+    # Le thread peut survivre à l'étape (délai dépassé) : une fois le lot final envoyé,
+    # ses posts suivants sont ignorés au lieu d'arriver après la fin des analyses
+    pending_lock = threading.Lock()
+    closed = False
+
+    def flush() -> None:
+        # Appelé sous pending_lock ; call_soon_threadsafe garde l'ordre d'envoi des lots
+        nonlocal pending_tokens
+        if pending:
+            loop.call_soon_threadsafe(batches.put_nowait, pending[:])
+            pending.clear()
+            pending_tokens = 0
+
+    def on_post(post: Dict[str, Any]) -> None:
+        # Appelé depuis le thread de récupération des posts
+        nonlocal pending_tokens
+        tokens = post_tokens(post) if batch_tokens else 0
+        with pending_lock:
+            if closed:
+                return
+            if pending and batch_tokens and pending_tokens + tokens > batch_tokens:
+                flush()
+            pending.append(post)
+            pending_tokens += tokens
+            if len(pending) >= batch_size:
+                flush()
+
+    async def scrape() -> Dict[str, Any]:
+        nonlocal closed
+        try:
+            return await run_stage("scrape", to_thread, partial(fetch_function, on_post=on_post))
+        finally:
+            # Dernier lot incomplet puis fin des lots, après tous les lots déjà envoyés
+            with pending_lock:
+                closed = True
+                flush()
+                for _ in range(PIPELINE_ANALYSIS_WORKERS):
+                    loop.call_soon_threadsafe(batches.put_nowait, None)
+
+    analyses: List[Dict[str, Any]] = []
+    timed_out_batches = 0
+
+    async def analysis_worker() -> None:
+        nonlocal timed_out_batches
+        while (posts := await batches.get()) is not None:
+            batch = {
+                "success": True,
+                "subreddit": subreddit,
+                "sort_criteria": sort_criteria,
+                "posts_count": len(posts),
+                "posts": posts,
+            }
+            if on_batch is not None:
+                on_batch()
+            try:
+                analyses.append(await analyze_pains(batch))
+            except DeadlineExceeded:
+                timed_out_batches += 1
+
+    tasks = [asyncio.ensure_future(scrape())]
+    tasks += [asyncio.ensure_future(analysis_worker()) for _ in range(PIPELINE_ANALYSIS_WORKERS)]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+    scrape_result = tasks[0].result()
+    if not analyses:
+        return scrape_result, {"partial": True} if timed_out_batches else {}
+    analysis = merge_batch_analyses(scrape_result.get("subreddit", subreddit), analyses)
+    if timed_out_batches:
+        analysis = {**analysis, "partial": True, "timed_out_batches": timed_out_batches}
+    print(f"🔀 r/{subreddit}: {len(analyses)} lots analysés pendant le scraping")
+    return scrape_result, analysis
+
+
+async def generate_recommendations(pain_analysis: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Étape RecommendationsAgent
+
+    Args:
+        pain_analysis: Sortie de analyze_pains (ou analyse fusionnée)
+
+    Returns:
+        Recommandations structurées au format de prompt_4
+    """
+    return parse_agent_json(await run_stage("recommendations", _run_step, agent_4, pain_analysis))
+
+
+async def generate_report(
+    pain_analysis: Dict[str, Any],
+    recommendations: Dict[str, Any],
+    parameters: Dict[str, Any],
+) -> str:
+    """
+    Étape ReportGenerator
+
+    Args:
+        pain_analysis: Analyse des douleurs
+        recommendations: Recommandations
+        parameters: Paramètres de l'analyse (affichés dans le rapport)
+
+    Returns:
+        Rapport final markdown
+    """
+    payload = {
+        "parameters": parameters,
+        "pain_analysis": pain_analysis,
+        "recommendations": recommendations,
+    }
+    return str(await run_stage("report", _run_step, agent_5, payload))
+
+
+async def reanalyze_archived_scrape(archive_id: int, session_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Relance analyse des douleurs, recommandations et rapport sur un scraping archivé
+
+    Aucun appel Reddit : les posts sont relus depuis l'archive (core.archive). Pratique
+    pour itérer sur les prompts ; une étape dont le prompt n'a pas changé est servie
+    par le cache LLM.
+
+    Args:
+        archive_id: ID de l'archive (scrape_archive)
+        session_id: Session à laquelle imputer l'usage
+
+    Returns:
+        Dict avec le rapport, l'analyse, les recommandations et l'usage
+    """
+    scrape = await asyncio.to_thread(load_scrape, archive_id)
+    if scrape is None:
+        return {"success": False, "error": f"Archive {archive_id} introuvable", "archive_id": archive_id}
+    session_id = session_id or f"reanalysis_{archive_id}"
+    parameters = {**scrape["parameters"], "scraped_at": scrape["scraped_at"]}
+
+    tracker = None
+    try:
+        async with tracked_analysis(session_id) as tracker:
+            analysis = await analyze_pains(scrape)
+            recommendations = await generate_recommendations(analysis)
+            report = await generate_report(analysis, recommendations, parameters)
+    except (BudgetExceededError, MaxTurnsExceeded) as e:
+        return {
+            "success": False,
+            "error": f"Analyse interrompue : {e.message}",
+            "archive_id": archive_id,
+            "session_id": session_id,
+            "usage": tracker.to_dict() if tracker else None,
+        }
+
+    return {
+        "success": True,
+        "archive_id": archive_id,
+        "subreddit": scrape["subreddit"],
+        "parameters": scrape["parameters"],
+        "report": report,
+        "pain_analysis": analysis,
+        "recommendations": recommendations,
+        "session_id": session_id,
+        "usage": tracker.to_dict(),
+    }
+
+
+async def analyze_corpus(
+    subreddit: str,
+    num_posts: int = 100,
+    comments_limit: int = 10,
+    sort_criteria: str = "top",
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    session_id: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Analyse complète à partir du corpus local (dumps ingérés) au lieu du scraping Reddit
+
+    Les posts sont lus et analysés par lots comme pour un scraping (mode pipeliné),
+    ce qui permet d'analyser bien plus que les 50 posts d'un scraping. Les lots sont
+    remplis jusqu'au budget de tokens d'un appel (CORPUS_MAX_TOKENS) et chaque lot
+    ajoute sa part au budget de l'analyse : le budget suit la taille du corpus.
+
+    Args:
+        subreddit: Subreddit du corpus
+        num_posts, comments_limit, sort_criteria, since, until: Cf. load_corpus_scrape
+        session_id: Session à laquelle imputer l'usage
+
+    Returns:
+        Dict avec le rapport, l'analyse, les recommandations et l'usage
+
+    Raises:
+        ValueError: Période invalide (since / until)
+    """
+    parse_date(since), parse_date(until)
+    session_id = session_id or f"corpus_{subreddit}"
+    fetch_function = partial(load_corpus_scrape, subreddit, num_posts, comments_limit, sort_criteria, since, until)
+    parameters = {
+        "source": "corpus",
+        "num_posts": num_posts,
+        "comments_limit": comments_limit,
+        "sort_criteria": sort_criteria,
+        "since": since,
+        "until": until,
+    }
+
+    tracker = None
+    try:
+        async with tracked_analysis(session_id) as tracker:
+            corpus, analysis = await _fetch_and_analyze(
+                subreddit,
+                sort_criteria,
+                fetch_function,
+                batch_size=CORPUS_BATCH_MAX_POSTS if PIPELINE_BATCH_SIZE > 0 else 0,
+                batch_tokens=CORPUS_MAX_TOKENS,
+                on_batch=partial(tracker.extend_budget, CORPUS_BATCH_TOKENS, CORPUS_BATCH_TURNS),
+            )
+            if not corpus["success"]:
+                return {"success": False, "error": corpus["error"], "session_id": session_id}
+            if not analysis.get("top_pains"):
+                # Tous les lots en échec ou interrompus : pas de recommandations ni de rapport sur du vide
+                return {
+                    "success": False,
+                    "error": analysis.get("error") or "Aucune douleur extraite du corpus",
+                    "posts_count": corpus["posts_count"],
+                    "session_id": session_id,
+                    "usage": tracker.to_dict(),
+                }
+            recommendations = await generate_recommendations(analysis)
+            report = await generate_report(analysis, recommendations, {**parameters, "num_posts": corpus["posts_count"]})
+    except (BudgetExceededError, MaxTurnsExceeded) as e:
+        return {
+            "success": False,
+            "error": f"Analyse interrompue : {e.message}",
+            "session_id": session_id,
+            "usage": tracker.to_dict() if tracker else None,
+        }
+
+    return {
+        "success": True,
+        "subreddit": corpus["subreddit"],
+        "parameters": parameters,
+        "posts_count": corpus["posts_count"],
+        "report": report,
+        "pain_analysis": analysis,
+        "recommendations": recommendations,
+        "partial": bool(analysis.get("partial")),
+        "session_id": session_id,
+        "usage": tracker.to_dict(),
+    }
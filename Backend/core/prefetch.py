@@ -0,0 +1,179 @@
+"""
+Préchargement spéculatif du scraping pendant la confirmation des paramètres.
+
+Dès que le chemin rapide (core.intents) a vérifié le subreddit et proposé des paramètres,
+le scraping correspondant démarre en arrière-plan (voie batch) et remplit le cache de
+scraping : quand l'utilisateur confirme, scrape_posts trouve le résultat en cache, ou
+attend sur le verrou partagé la fin du scraping déjà lancé au lieu de le recommencer.
+
+Le préchargement en cours d'une session est enregistré dans l'état partagé : s'il est
+annulé (refus, autres paramètres, autre subreddit), le scraping s'arrête au prochain post,
+quel que soit le worker qui l'exécute, et son résultat partiel n'est ni mis en cache, ni
+indexé, ni archivé. Une fois l'analyse confirmée, sa limite passe de PREFETCH_MAX_SECONDS
+à PREFETCH_CONFIRMED_MAX_SECONDS : l'analyse qui l'attend n'a pas à tout recommencer.
+"""
+import os
+import time
+import uuid
+import asyncio
+import contextvars
+from typing import Any, Dict
+
+from core.deadlines import Deadline, deadline_scope
+from core.functions import SCRAPE_CACHE_TTL, scrape_posts
+from core.lanes import BATCH, to_thread, use_lane
+from core.state import get_state_backend
+
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "true").lower() == "true"
+PREFETCH_MAX_SECONDS = float(os.getenv("PREFETCH_MAX_SECONDS", "120"))
+# Limite après confirmation (attente max de scrape_posts sur le verrou de scraping)
+PREFETCH_CONFIRMED_MAX_SECONDS = float(os.getenv("PREFETCH_CONFIRMED_MAX_SECONDS", "300"))
+# Fréquence de vérification de l'annulation depuis le thread de scraping
+_CANCEL_CHECK_INTERVAL = 1.0
+
+# Préchargements lancés par ce worker (références gardées jusqu'à la fin des tâches)
+_tasks: Dict[str, asyncio.Task] = {}
+_stats = {"started": 0, "completed": 0, "cancelled": 0, "failed": 0}
+
+
+def _key(session_id: str) -> str:
+    return f"prefetch:{session_id}"
+
+
+class _PrefetchDeadline(Deadline):
+    """
+    Échéance annulée dès que la session ne veut plus de ce préchargement (tous workers),
+    prolongée dès que l'analyse est confirmée
+    """
+
+    def __init__(self, seconds: float, session_id: str, prefetch_id: str):
+        super().__init__(seconds)
+        self.session_id = session_id
+        self.prefetch_id = prefetch_id
+        self.started_at = time.monotonic()
+        self.confirmed = False
+        self._checked_at = 0.0
+
+    @property
+    def cancelled(self) -> bool:
+        if self._cancelled:
+            return True
+        now = time.monotonic()
+        if now - self._checked_at >= _CANCEL_CHECK_INTERVAL:
+            self._checked_at = now
+            current = get_state_backend().get(_key(self.session_id))
+            if current is None or current["id"] != self.prefetch_id:
+                self.cancel()
+            elif current.get("confirmed") and not self.confirmed:
+                self.confirmed = True
+                self.expires_at = max(self.expires_at, self.started_at + PREFETCH_CONFIRMED_MAX_SECONDS)
+        return self._cancelled
+
+
+async def _prefetch(session_id: str, prefetch_id: str, subreddit: str, parameters: Dict[str, Any]) -> None:
+    deadline = _PrefetchDeadline(PREFETCH_MAX_SECONDS, session_id, prefetch_id)
+    try:
+        with use_lane(BATCH), deadline_scope(deadline):
+            result = await to_thread(
+                scrape_posts,
+                subreddit,
+                parameters["num_posts"],
+                parameters["sort_criteria"],
+                parameters["comments_limit"],
+                parameters["time_filter"],
+            )
+        if deadline.cancelled:
+            _stats["cancelled"] += 1
+            print(f"🔮 Préchargement r/{subreddit} annulé (session {session_id})")
+        elif result["success"] and not result.get("partial"):
+            _stats["completed"] += 1
+            print(f"🔮 Scraping r/{subreddit} préchargé ({result['posts_count']} posts"
+                  f"{', déjà en cache' if result.get('cached') else ''})")
+        else:
+            _stats["failed"] += 1
+            print(f"⚠️ Préchargement r/{subreddit} incomplet: {result.get('error', 'délai dépassé')}")
+    except asyncio.CancelledError:
+        deadline.cancel()
+        _stats["cancelled"] += 1
+        raise
+    except Exception as e:
+        _stats["failed"] += 1
+        print(f"❌ Erreur préchargement r/{subreddit}: {e}")
+    finally:
+        await asyncio.to_thread(_clear_entry, session_id, prefetch_id)
+
+
+def _clear_entry(session_id: str, prefetch_id: str) -> None:
+    backend = get_state_backend()
+    current = backend.get(_key(session_id))
+    if current is not None and current["id"] == prefetch_id:
+        backend.delete(_key(session_id))
+
+
+# Les accès à l'état partagé (client Redis synchrone) passent par asyncio.to_thread
+
+async def start_prefetch(session_id: str, subreddit: str, parameters: Dict[str, Any]) -> None:
+    """
+    Lance le scraping spéculatif d'une analyse proposée (remplace celui en cours pour la session)
+
+    Args:
+        session_id: Session qui doit confirmer l'analyse
+        subreddit: Subreddit vérifié
+        parameters: num_posts, comments_limit, sort_criteria, time_filter
+    """
+    if not PREFETCH_ENABLED or not SCRAPE_CACHE_TTL:
+        return
+    backend = get_state_backend()
+    current = await asyncio.to_thread(backend.get, _key(session_id))
+    if current is not None and current["subreddit"].lower() == subreddit.lower() and current["parameters"] == parameters:
+        return
+
+    prefetch_id = uuid.uuid4().hex
+    # Remplacer l'entrée annule l'ancien préchargement, même s'il tourne sur un autre worker
+    await asyncio.to_thread(
+        backend.set,
+        _key(session_id),
+        {"id": prefetch_id, "subreddit": subreddit, "parameters": parameters},
+        ttl=PREFETCH_MAX_SECONDS + 60,
+    )
+    previous = _tasks.get(session_id)
+    if previous is not None and not previous.done():
+        previous.cancel()
+
+    # Contexte vierge : le préchargement survit à la requête, sans son délai ni son suivi d'usage
+    task = asyncio.create_task(
+        _prefetch(session_id, prefetch_id, subreddit, parameters), context=contextvars.Context()
+    )
+    _tasks[session_id] = task
+    _stats["started"] += 1
+
+    def forget(done: asyncio.Task) -> None:
+        if _tasks.get(session_id) is done:
+            del _tasks[session_id]
+
+    task.add_done_callback(forget)
+
+
+async def confirm_prefetch(session_id: str) -> None:
+    """L'utilisateur a confirmé l'analyse : le préchargement en cours n'est plus spéculatif"""
+    await asyncio.to_thread(_confirm, session_id)
+
+
+def _confirm(session_id: str) -> None:
+    backend = get_state_backend()
+    current = backend.get(_key(session_id))
+    if current is not None:
+        backend.set(_key(session_id), {**current, "confirmed": True}, ttl=PREFETCH_CONFIRMED_MAX_SECONDS + 60)
+
+
+async def cancel_prefetch(session_id: str) -> None:
+    """Abandonne le préchargement de la session (l'utilisateur a changé d'avis)"""
+    await asyncio.to_thread(get_state_backend().delete, _key(session_id))
+    task = _tasks.get(session_id)
+    if task is not None and not task.done():
+        task.cancel()
+
+
+def prefetch_status() -> Dict[str, Any]:
+    """Compteurs des préchargements du worker (pour /health)"""
+    return {"enabled": PREFETCH_ENABLED, "running": sum(not task.done() for task in _tasks.values()), **_stats}
@@ -0,0 +1,233 @@
+"""
+Nettoyage et mise au budget (tokens) du contenu Reddit envoyé au LLM.
+
+- Nettoyage : balisage markdown, citations (>), blocs de code, URLs, entités HTML,
+  signatures de bots ; les contenus supprimés ([deleted] / [removed]) et les
+  commentaires de bots sont écartés.
+- Budget : chaque élément (texte du post, commentaire) est tronqué à un nombre de
+  tokens, puis le corpus entier est ramené à CORPUS_MAX_TOKENS avant l'appel LLM
+  (les commentaires les moins bien notés partent en premier).
+
+Le nombre de tokens est une estimation locale (aucun appel réseau, aucun tokenizer
+à télécharger), suffisante pour dimensionner les prompts.
+"""
+import os
+import re
+import html
+import math
+from typing import Any, Dict, List
+from urllib.parse import urlparse
+
+POST_MAX_TOKENS = int(os.getenv("POST_MAX_TOKENS", "300"))
+COMMENT_MAX_TOKENS = int(os.getenv("COMMENT_MAX_TOKENS", "150"))
+CORPUS_MAX_TOKENS = int(os.getenv("CORPUS_MAX_TOKENS", "12000"))  # 0 = pas de limite
+# Comptes de bots supplémentaires (séparés par des virgules), en plus de AutoModerator et des *_bot / *Bot
+BOT_AUTHORS = {name.strip().lower() for name in os.getenv("BOT_AUTHORS", "").split(",") if name.strip()}
+
+REMOVED_BODIES = {"[deleted]", "[removed]"}
+# Texte d'un post en dessous duquel on ne tronque plus pour tenir le budget du corpus
+MIN_POST_TOKENS = 50
+TRUNCATION_MARK = " […]"
+
+_CODE_FENCE_RE = re.compile(r"```.*?(```|$)", re.DOTALL)
+_INDENTED_CODE_RE = re.compile(r"(?:^(?: {4}|\t).*(?:\n|$))+", re.MULTILINE)
+_QUOTE_LINE_RE = re.compile(r"^\s*>.*$", re.MULTILINE)
+_MARKDOWN_LINK_RE = re.compile(r"\[([^\]]*)\]\(\s*<?([^)\s>]+)>?[^)]*\)")
+_URL_RE = re.compile(r"(?:https?://|www\.)[^\s<>()\[\]]+", re.IGNORECASE)
+_BOT_SIGNATURE_RE = re.compile(
+    r"^.*(?:i am a bot|i'm a bot|je suis un bot|this action was performed automatically|beep boop).*$",
+    re.IGNORECASE | re.MULTILINE,
+)
+_HEADING_RE = re.compile(r"^\s{0,3}#{1,6}\s*", re.MULTILINE)
+_LIST_MARKER_RE = re.compile(r"^\s*(?:[-*+]|\d+[.)])\s+", re.MULTILINE)
+_TABLE_RULE_RE = re.compile(r"^\s*\|?(?:\s*:?-{3,}:?\s*\|)+\s*:?-*:?\s*$", re.MULTILINE)
+# Marqueurs appariés uniquement : "2^10" et "__init__" restent intacts
+_EMPHASIS_RE = re.compile(
+    r"(\*{1,3}|~~)(?=\S)(.+?)(?<=\S)\1"
+    r"|(?<!\w)(_{2,3})(?=\S)([^_\n]*?\s[^_\n]*?)(?<=\S)\3(?!\w)"
+)
+# Suffixe de bot séparé : some_bot, some-bot, RemindMeBot (pas "Abbot" ni "talbot")
+_BOT_NAME_RE = re.compile(r"(?:[_-][Bb][Oo][Tt]|[a-z0-9]Bot)$")
+_INLINE_CODE_RE = re.compile(r"`([^`]*)`")
+_ZERO_WIDTH_RE = re.compile("[\u200b\u200c\u200d\u2060\ufeff]")
+_SPACES_RE = re.compile(r"[ \t\xa0]+")
+_BLANK_LINES_RE = re.compile(r"\n\s*\n+")
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimation locale du nombre de tokens (tokenizers BPE des modèles OpenAI)
+
+    Un mot court vaut un token, un mot long environ un token par 4 caractères ;
+    chaque signe de ponctuation compte pour un token.
+    """
+    if not text:
+        return 0
+    return sum(math.ceil(len(token) / 4) for token in _TOKEN_RE.findall(text))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """
+    Tronque un texte à max_tokens (estimés), sur une limite de mot
+
+    Returns:
+        Le texte inchangé s'il tient dans le budget, sinon le début du texte suivi de " […]"
+    """
+    if max_tokens <= 0 or estimate_tokens(text) <= max_tokens:
+        return text
+    used = 0
+    end = 0
+    for match in _TOKEN_RE.finditer(text):
+        used += math.ceil(len(match.group(0)) / 4)
+        if used > max_tokens:
+            break
+        end = match.end()
+    cut = text[:end]
+    # On préfère finir sur une phrase complète si elle n'est pas trop loin
+    sentence_end = max(cut.rfind(". "), cut.rfind("! "), cut.rfind("? "), cut.rfind("\n"))
+    if sentence_end > len(cut) * 0.7:
+        cut = cut[:sentence_end + 1]
+    return cut.rstrip() + TRUNCATION_MARK
+
+
+def _domain(url: str) -> str:
+    domain = urlparse(url if "://" in url else "http://" + url).netloc.lower()
+    return domain.removeprefix("www.")
+
+
+def clean_text(text: str) -> str:
+    """
+    Normalise un texte Reddit (markdown) en texte brut
+
+    Les citations sont retirées (elles répètent le message parent), les blocs de code
+    remplacés par [code], les liens réduits à leur texte ou à leur domaine.
+    """
+    if not text:
+        return ""
+    text = html.unescape(text)
+    text = _ZERO_WIDTH_RE.sub("", text).replace("\r\n", "\n")
+    if text.strip().lower() in REMOVED_BODIES:
+        return ""
+
+    text = _CODE_FENCE_RE.sub(" [code] ", text)
+    text = _INDENTED_CODE_RE.sub(" [code]\n", text)
+    text = _QUOTE_LINE_RE.sub("", text)
+    text = _BOT_SIGNATURE_RE.sub("", text)
+    text = _MARKDOWN_LINK_RE.sub(lambda match: match.group(1) or _domain(match.group(2)), text)
+    text = _URL_RE.sub(lambda match: _domain(match.group(0)), text)
+    text = _INLINE_CODE_RE.sub(r"\1", text)
+    text = _TABLE_RULE_RE.sub("", text)
+    text = _HEADING_RE.sub("", text)
+    text = _LIST_MARKER_RE.sub("- ", text)
+    text = _EMPHASIS_RE.sub(lambda match: match.group(2) if match.group(2) is not None else match.group(4), text)
+
+    text = _SPACES_RE.sub(" ", text)
+    text = "\n".join(line.strip() for line in text.split("\n"))
+    text = _BLANK_LINES_RE.sub("\n", text)
+    return text.strip()
+
+
+def is_bot_author(author: Any) -> bool:
+    """Compte de bot : AutoModerator, suffixe de bot séparé (_bot, -bot, ...Bot), ou listé dans BOT_AUTHORS"""
+    name = str(author or "")
+    return name.lower() in ("automoderator", *BOT_AUTHORS) or bool(_BOT_NAME_RE.search(name))
+
+
+def prepare_comment_body(author: Any, body: str) -> str:
+    """
+    Texte d'un commentaire prêt pour l'analyse
+
+    Returns:
+        Le texte nettoyé et tronqué à COMMENT_MAX_TOKENS, ou "" si le commentaire
+        est à écarter (bot, supprimé, vide après nettoyage)
+    """
+    if is_bot_author(author):
+        return ""
+    return truncate_to_tokens(clean_text(body), COMMENT_MAX_TOKENS)
+
+
+def prepare_post_text(selftext: str) -> str:
+    """Texte d'un post nettoyé et tronqué à POST_MAX_TOKENS"""
+    return truncate_to_tokens(clean_text(selftext), POST_MAX_TOKENS)
+
+
+def post_tokens(post: Dict[str, Any]) -> int:
+    """Tokens estimés d'un post et de ses commentaires"""
+    return (
+        estimate_tokens(post.get("title", ""))
+        + estimate_tokens(post.get("selftext", ""))
+        + sum(estimate_tokens(comment.get("body", "")) for comment in post.get("comments", []))
+    )
+
+
+def fit_corpus(scrape: Dict[str, Any], max_tokens: int = CORPUS_MAX_TOKENS) -> Dict[str, Any]:
+    """
+    Ramène un résultat de scraping au budget de tokens du corpus, avant l'appel LLM
+
+    Ordre de réduction : commentaires les moins bien notés (en gardant le meilleur de
+    chaque post), puis textes des posts raccourcis, puis posts les moins bien notés.
+
+    Args:
+        scrape: Résultat de scrape_posts (non modifié)
+        max_tokens: Budget du corpus (0 = pas de limite)
+
+    Returns:
+        Le résultat réduit, avec "corpus_tokens" (et "corpus_trimmed" si réduit)
+    """
+    if not scrape.get("success") or not scrape.get("posts"):
+        return scrape
+    posts: List[Dict[str, Any]] = [
+        {**post, "comments": list(post.get("comments", []))} for post in scrape["posts"]
+    ]
+    total = sum(post_tokens(post) for post in posts)
+    if not max_tokens or total <= max_tokens:
+        return {**scrape, "posts": posts, "corpus_tokens": total}
+    tokens_before = total
+
+    # 1. Commentaires les moins bien notés, tous posts confondus
+    droppable = sorted(
+        (
+            (comment.get("score") or 0, post_index, comment)
+            for post_index, post in enumerate(posts)
+            for comment in sorted(post["comments"], key=lambda c: c.get("score") or 0, reverse=True)[1:]
+        ),
+        key=lambda item: item[0],
+    )
+    dropped_comments = 0
+    for _, post_index, comment in droppable:
+        if total <= max_tokens:
+            break
+        posts[post_index]["comments"].remove(comment)
+        total -= estimate_tokens(comment.get("body", ""))
+        dropped_comments += 1
+
+    # 2. Textes des posts, par moitiés successives
+    post_limit = POST_MAX_TOKENS
+    while total > max_tokens and post_limit > MIN_POST_TOKENS:
+        post_limit = max(MIN_POST_TOKENS, post_limit // 2)
+        for post in posts:
+            post["selftext"] = truncate_to_tokens(post.get("selftext", ""), post_limit)
+        total = sum(post_tokens(post) for post in posts)
+
+    # 3. Posts les moins bien notés
+    dropped_posts = 0
+    while total > max_tokens and len(posts) > 1:
+        weakest = min(posts, key=lambda post: post.get("score") or 0)
+        posts.remove(weakest)
+        total -= post_tokens(weakest)
+        dropped_posts += 1
+
+    print(f"✂️ Corpus réduit de {tokens_before} à {total} tokens "
+          f"({dropped_comments} commentaires, {dropped_posts} posts retirés)")
+    return {
+        **scrape,
+        "posts": posts,
+        "posts_count": len(posts),
+        "corpus_tokens": total,
+        "corpus_trimmed": {
+            "tokens_before": tokens_before,
+            "dropped_comments": dropped_comments,
+            "dropped_posts": dropped_posts,
+        },
+    }
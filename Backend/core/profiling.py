@@ -0,0 +1,391 @@
+"""
+Profilage à la demande des requêtes de chat (run_chat, agents et outils).
+
+Désactivé par défaut (PROFILING_ENABLED). Une fois activé, une requête est profilée si
+elle porte l'en-tête X-Profile: 1, ou si sa session a été marquée par l'endpoint
+d'administration. Pour une requête profilée :
+- arbre de spans chronométrés : run_chat, outils des agents, appels LLM (via le tracing
+  du SDK agents), appels Reddit / OpenAI / Supabase (core.resilience), prétraitement ;
+  les spans ouverts dans des threads (PRAW) se rattachent à leur parent (contextvars) ;
+- échantillonnage pyinstrument (optionnel) de l'event loop, un profil à la fois par worker.
+
+Fichiers écrits sous PROFILE_DIR :
+- <id>.json : arbre de spans ;
+- <id>.speedscope.json : le même arbre en flamegraph (https://www.speedscope.app) ;
+- <id>.sampled.speedscope.json : profil échantillonné pyinstrument, s'il est installé.
+
+Sans profil en cours, span() se limite à la lecture d'une contextvar.
+"""
+import os
+import json
+import time
+import uuid
+import asyncio
+import threading
+import contextvars
+import dataclasses
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from agents import FunctionTool
+from agents.tracing import TracingProcessor, add_trace_processor
+
+from core.state import get_state_backend
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+PROFILE_DIR = os.getenv("PROFILE_DIR", "data/profiles")
+PROFILE_SAMPLING_INTERVAL = float(os.getenv("PROFILE_SAMPLING_INTERVAL", "0.001"))
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "200"))  # profils gardés, les plus anciens sont supprimés
+PROFILE_SESSION_TTL = int(os.getenv("PROFILE_SESSION_TTL", "3600"))
+
+PROFILE_FORMATS = {
+    "json": ".json",
+    "speedscope": ".speedscope.json",
+    "sampled": ".sampled.speedscope.json",
+}
+
+
+class Span:
+    """Intervalle chronométré de l'arbre de profilage"""
+
+    __slots__ = ("name", "attributes", "start", "end", "thread", "children")
+
+    def __init__(self, name: str, attributes: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.attributes = attributes or {}
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.thread = threading.current_thread().name
+        self.children: List["Span"] = []
+
+    def close(self) -> None:
+        if self.end is None:
+            self.end = time.perf_counter()
+
+    @property
+    def duration(self) -> float:
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    def to_dict(self, origin: float) -> Dict[str, Any]:
+        entry: Dict[str, Any] = {
+            "name": self.name,
+            "start_ms": round((self.start - origin) * 1000, 3),
+            "duration_ms": round(self.duration * 1000, 3),
+            "thread": self.thread,
+        }
+        if self.attributes:
+            entry["attributes"] = self.attributes
+        if self.end is None:
+            entry["unfinished"] = True
+        if self.children:
+            entry["children"] = [child.to_dict(origin) for child in sorted(self.children, key=lambda s: s.start)]
+        return entry
+
+
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("profile_span", default=None)
+# Posé par le middleware HTTP quand la requête demande un profil ; reçoit l'ID du profil produit
+_request_profile: contextvars.ContextVar[Optional[Dict[str, Any]]] = contextvars.ContextVar("profile_request", default=None)
+
+
+class _SpanContext:
+    __slots__ = ("_span", "_parent", "_token")
+
+    def __init__(self, parent: Span, name: str, attributes: Dict[str, Any]):
+        self._parent = parent
+        self._span = Span(name, attributes)
+
+    def __enter__(self) -> Span:
+        self._parent.children.append(self._span)
+        self._token = _current_span.set(self._span)
+        return self._span
+
+    def __exit__(self, exc_type: Any, exc: Any, traceback: Any) -> None:
+        if exc_type is not None:
+            self._span.attributes["error"] = exc_type.__name__
+        self._span.close()
+        _current_span.reset(self._token)
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> None:
+        return None
+
+    def __exit__(self, exc_type: Any, exc: Any, traceback: Any) -> None:
+        return None
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name: str, **attributes: Any) -> Any:
+    """
+    Context manager qui chronomètre un bloc dans le profil en cours (sans effet sinon)
+
+    Usage:
+        with span("reddit:listing", subreddit=name):
+            ...
+    """
+    parent = _current_span.get()
+    if parent is None:
+        return _NULL_SPAN
+    return _SpanContext(parent, name, attributes)
+
+
+def profiling_active() -> bool:
+    return _current_span.get() is not None
+
+
+# ===== APPELS LLM (tracing du SDK agents) =====
+
+class _LLMSpanProcessor(TracingProcessor):
+    """Ajoute les appels modèle du SDK agents au profil en cours"""
+
+    def __init__(self) -> None:
+        self._open: Dict[str, Span] = {}
+
+    def on_span_start(self, sdk_span: Any) -> None:
+        parent = _current_span.get()
+        if parent is None or sdk_span.span_data.type not in ("response", "generation"):
+            return
+        child = Span(f"llm:{sdk_span.span_data.type}")
+        parent.children.append(child)
+        self._open[sdk_span.span_id] = child
+
+    def on_span_end(self, sdk_span: Any) -> None:
+        child = self._open.pop(sdk_span.span_id, None)
+        if child is None:
+            return
+        child.close()
+        model = getattr(getattr(sdk_span.span_data, "response", None), "model", None) or getattr(sdk_span.span_data, "model", None)
+        if model:
+            child.attributes["model"] = model
+
+    def on_trace_start(self, trace: Any) -> None:
+        pass
+
+    def on_trace_end(self, trace: Any) -> None:
+        pass
+
+    def shutdown(self) -> None:
+        pass
+
+    def force_flush(self) -> None:
+        pass
+
+
+if PROFILING_ENABLED:
+    add_trace_processor(_LLMSpanProcessor())
+
+
+# ===== OUTILS DES AGENTS =====
+
+def profile_tools(tools: List[Any]) -> List[Any]:
+    """
+    Enveloppe les function tools pour qu'ils apparaissent dans le profil ("tool:<nom>")
+
+    Les outils hébergés (WebSearchTool) sont laissés tels quels.
+    """
+    if not PROFILING_ENABLED:
+        return tools
+
+    def wrap(tool: FunctionTool) -> FunctionTool:
+        invoke = tool.on_invoke_tool
+
+        async def on_invoke_tool(context: Any, arguments: str) -> Any:
+            with span(f"tool:{tool.name}"):
+                return await invoke(context, arguments)
+
+        return dataclasses.replace(tool, on_invoke_tool=on_invoke_tool)
+
+    return [wrap(tool) if isinstance(tool, FunctionTool) else tool for tool in tools]
+
+
+# ===== PROFIL D'UNE REQUÊTE =====
+
+def request_profiling() -> None:
+    """Marque la requête HTTP courante (sa tâche) comme à profiler ; appelé par le middleware"""
+    _request_profile.set({})
+
+
+def requested_profile_id() -> Optional[str]:
+    """ID du profil produit pendant la requête courante, s'il y en a un"""
+    holder = _request_profile.get()
+    return holder.get("profile_id") if holder else None
+
+
+def enable_session_profiling(session_id: str, enabled: bool = True, ttl: int = PROFILE_SESSION_TTL) -> None:
+    """Profile (ou plus) toutes les requêtes d'une session pendant ttl secondes"""
+    if enabled:
+        get_state_backend().set(f"profiling:{session_id}", True, ttl=ttl)
+    else:
+        get_state_backend().delete(f"profiling:{session_id}")
+
+
+async def _should_profile(session_id: str) -> bool:
+    if not PROFILING_ENABLED or profiling_active():
+        return False
+    if _request_profile.get() is not None:
+        return True
+    return bool(await asyncio.to_thread(get_state_backend().get, f"profiling:{session_id}"))
+
+
+_sampler_busy = False
+
+
+def _start_sampler() -> Optional[Any]:
+    """Profiler pyinstrument démarré, ou None (non installé, ou déjà utilisé par une autre requête)"""
+    global _sampler_busy
+    if _sampler_busy:
+        return None
+    try:
+        from pyinstrument import Profiler
+    except ImportError:
+        return None
+    profiler = Profiler(interval=PROFILE_SAMPLING_INTERVAL, async_mode="enabled")
+    profiler.start()
+    _sampler_busy = True
+    return profiler
+
+
+def _speedscope_from_spans(root: Span, name: str) -> Dict[str, Any]:
+    """Flamegraph speedscope de l'arbre : un échantillon par span, pondéré par son temps propre"""
+    frames: List[Dict[str, str]] = []
+    frame_index: Dict[str, int] = {}
+    samples: List[List[int]] = []
+    weights: List[float] = []
+
+    def visit(node: Span, stack: List[int]) -> None:
+        if node.name not in frame_index:
+            frame_index[node.name] = len(frames)
+            frames.append({"name": node.name})
+        stack = stack + [frame_index[node.name]]
+        # Les enfants concurrents (gather) peuvent dépasser le parent : temps propre borné à 0
+        own = node.duration - sum(child.duration for child in node.children)
+        samples.append(stack)
+        weights.append(round(max(own, 0.0) * 1000, 3))
+        for child in node.children:
+            visit(child, stack)
+
+    visit(root, [])
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "name": name,
+        "exporter": "core.profiling",
+        "shared": {"frames": frames},
+        "profiles": [{
+            "type": "sampled",
+            "name": name,
+            "unit": "milliseconds",
+            "startValue": 0,
+            "endValue": round(root.duration * 1000, 3),
+            "samples": samples,
+            "weights": weights,
+        }],
+    }
+
+
+def _profile_documents(directory: Path) -> List[Path]:
+    """Fichiers <id>.json (arbres de spans), du plus récent au plus ancien"""
+    documents = [path for path in directory.glob("*.json") if path.name.count(".") == 1]
+    return sorted(documents, key=lambda path: path.stat().st_mtime, reverse=True)
+
+
+def _write_profile(profile_id: str, root: Span, sampled: Optional[str], metadata: Dict[str, Any]) -> None:
+    directory = Path(PROFILE_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    document = {**metadata, "id": profile_id, "duration_ms": round(root.duration * 1000, 3), "spans": root.to_dict(root.start)}
+    (directory / f"{profile_id}.json").write_text(json.dumps(document, ensure_ascii=False, default=str))
+    (directory / f"{profile_id}.speedscope.json").write_text(json.dumps(_speedscope_from_spans(root, profile_id)))
+    if sampled is not None:
+        (directory / f"{profile_id}.sampled.speedscope.json").write_text(sampled)
+
+    # Rotation : on ne garde que les PROFILE_MAX_FILES profils les plus récents
+    for old in _profile_documents(directory)[PROFILE_MAX_FILES:]:
+        for suffix in PROFILE_FORMATS.values():
+            old.with_name(old.name.removesuffix(".json") + suffix).unlink(missing_ok=True)
+
+
+@asynccontextmanager
+async def profile_request(name: str, session_id: str) -> AsyncIterator[Optional[str]]:
+    """
+    Profile le bloc si la requête ou la session le demande
+
+    Usage:
+        async with profile_request("run_chat", session_id) as profile_id:
+            ...
+
+    Yields:
+        ID du profil (fichiers écrits à la sortie du bloc), ou None si non profilé
+    """
+    global _sampler_busy
+    if not await _should_profile(session_id):
+        yield None
+        return
+
+    profile_id = f"{time.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+    root = Span(name, {"session_id": session_id})
+    token = _current_span.set(root)
+    sampler = _start_sampler()
+    started_at = time.time()
+    try:
+        yield profile_id
+    finally:
+        root.close()
+        _current_span.reset(token)
+        sampled = None
+        if sampler is not None:
+            sampler.stop()
+            _sampler_busy = False
+            from pyinstrument.renderers import SpeedscopeRenderer
+            sampled = sampler.output(SpeedscopeRenderer())
+        metadata = {
+            "name": name,
+            "session_id": session_id,
+            "started_at": started_at,
+            "sampled": sampled is not None,
+        }
+        try:
+            await asyncio.to_thread(_write_profile, profile_id, root, sampled, metadata)
+            holder = _request_profile.get()
+            if holder is not None:
+                holder["profile_id"] = profile_id
+            print(f"🔬 Profil {profile_id} enregistré ({root.duration * 1000:.0f} ms)")
+        except Exception as e:
+            print(f"Erreur écriture du profil {profile_id}: {e}")
+
+
+def list_profiles(limit: int = 50) -> List[Dict[str, Any]]:
+    """Profils enregistrés, du plus récent au plus ancien (sans l'arbre de spans)"""
+    directory = Path(PROFILE_DIR)
+    if not directory.exists():
+        return []
+    profiles = []
+    for path in _profile_documents(directory)[:limit]:
+        try:
+            document = json.loads(path.read_text())
+        except (OSError, ValueError):
+            continue
+        document.pop("spans", None)
+        profiles.append(document)
+    return profiles
+
+
+def profile_path(profile_id: str, format: str = "json") -> Optional[Path]:
+    """
+    Fichier d'un profil
+
+    Args:
+        profile_id: ID du profil
+        format: "json" (arbre de spans), "speedscope" ou "sampled" (pyinstrument)
+
+    Returns:
+        Le chemin, ou None si le profil (ou ce format) n'existe pas
+    """
+    # L'ID vient de l'URL : on refuse tout ce qui pourrait sortir du répertoire
+    if format not in PROFILE_FORMATS or not profile_id.replace("_", "").isalnum():
+        return None
+    path = Path(PROFILE_DIR) / f"{profile_id}{PROFILE_FORMATS[format]}"
+    return path if path.exists() else None
@@ -33,6 +33,26 @@ Ne JAMAIS répéter ce message de bienvenue.
 8. Handoff vers WorkflowManager
 9. PRENDRE EXACTEMENT le rapport de workflow manager et le RETRANSCRIRE MOT POUR MOT sans aucune modification, ajout ou suppression !
 ```
+### Scénario C : Question sur des solutions ou discussions déjà collectées
+```
+1. Utiliser search_stored_content avec les mots-clés de la question (ex: "quelles solutions existent pour la facturation ?" → query "facturation")
+2. Filtrer avec kind="solution" pour les solutions, et subreddit si l'utilisateur en précise un
+3. Présenter les résultats les plus pertinents avec leur extrait, leur subreddit et leur score
+4. Si aucun résultat → le dire et proposer de lancer une analyse
+5. Ne PAS utiliser get_stored_solutions pour ce type de question (il renvoie toute la table)
+```
+### Scénario D : Aperçu d'un subreddit déjà analysé
+```
+1. Si l'utilisateur demande les problèmes principaux d'un subreddit sans exiger une nouvelle analyse → get_subreddit_profile
+2. Si "exists" est true → présenter les douleurs principales (avec leur score) et les meilleures solutions,
+   en indiquant la date du profil (refreshed_at), puis proposer une analyse complète et à jour
+3. Si "exists" est false → suivre le Scénario B
+```
+### Service momentanément indisponible
+```
+Si un outil renvoie une erreur "momentanément indisponible" (Reddit, OpenAI ou Supabase), ne PAS rappeler l'outil :
+les nouvelles tentatives sont déjà faites côté serveur. Informer l'utilisateur et proposer de réessayer dans quelques instants.
+```
 
 
 ## PARAMÈTRES ET EXPLICATIONS
@@ -154,11 +174,18 @@ prompt_3 = """ Tu es maintenant un TOOL utilisé par Workflow manager pour analy
 
 Ton rôle est de:
 1. Recevoir les données scrapées d'Workflow manager
-2. Analyser sentiments et intensité émotionnelle
-3. Identifier les douleurs récurrentes
-4. Calculer les scores avec calculate_pain_score
-5. Stocker les solutions exceptionnelles avec store_exceptional_solution
-6. Retourner l'analyse structurée à Workflow manager
+2. Identifier les douleurs récurrentes
+3. Calculer les scores avec calculate_pain_score
+4. Stocker les solutions exceptionnelles avec store_exceptional_solution
+5. Retourner l'analyse structurée à Workflow manager
+
+INTENSITÉ ÉMOTIONNELLE (PRÉ-CALCULÉE):
+- Chaque post et chaque commentaire a un champ "intensity" (1-10), chaque post un champ
+  "thread_intensity" (moyenne du post et de ses commentaires) : ne les estime pas toi-même
+- Pour calculate_pain_score, passe dans post_ids les IDs des posts concernés par la douleur :
+  l'intensité moyenne est calculée à partir de ces valeurs (avg_intensity n'est qu'un repli,
+  mets-y la moyenne des thread_intensity de ces posts)
+- Pour store_exceptional_solution, utilise comme intensity l'intensity du post concerné (arrondie)
 
 CRITÈRES SOLUTIONS EXCEPTIONNELLES:
 - Score du commentaire > 10
@@ -0,0 +1,125 @@
+"""
+Limiteur de débit partagé (token bucket) pour les appels à l'API Reddit.
+
+Les appels PRAW sont synchrones et s'exécutent dans des threads : le limiteur
+est donc thread-safe et bloquant. Le seau local lisse le débit du processus ; un compteur
+par fenêtre de REDDIT_SHARED_WINDOW_SECONDS dans le backend d'état partagé borne en plus
+le débit de tous les workers réunis (quota OAuth commun à l'application).
+
+Les appels d'arrière-plan (voie batch, cf. core.lanes) passent après les appels
+interactifs en attente et laissent `reserve` jetons dans le seau : une vérification de
+subreddit n'attend pas derrière le scraping d'une analyse.
+"""
+import os
+import time
+import threading
+from typing import Optional
+
+from core.state import get_state_backend
+
+
+class RateLimiter:
+    """
+    Token bucket : `rate` jetons par seconde, au plus `burst` jetons accumulés
+
+    Args:
+        rate: Débit moyen autorisé (requêtes par seconde)
+        burst: Nombre de requêtes autorisées d'un coup
+        reserve: Jetons que les appels d'arrière-plan ne consomment pas
+        shared_key: Clé du quota commun à tous les workers (None = seau local seulement)
+        shared_window: Durée d'une fenêtre du quota commun (secondes)
+    """
+
+    def __init__(self, rate: float, burst: int, reserve: int = 0, shared_key: Optional[str] = None, shared_window: float = 10):
+        self.rate = rate
+        self.burst = burst
+        self.reserve = max(0, min(reserve, burst - 1))
+        self.shared_key = shared_key
+        self.shared_window = shared_window
+        self._tokens = float(burst)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+        self._foreground_waiting = 0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def try_acquire(self, background: bool = False) -> float:
+        """
+        Prend un jeton s'il y en a un
+
+        Args:
+            background: Appel d'arrière-plan (cède la place aux appels interactifs)
+
+        Returns:
+            0 si le jeton est pris, sinon le temps d'attente estimé en secondes
+        """
+        with self._lock:
+            self._refill()
+            if background and self._foreground_waiting:
+                return 1 / self.rate
+            needed = 1 + (self.reserve if background else 0)
+            if self._tokens < needed:
+                return (needed - self._tokens) / self.rate
+            self._tokens -= 1
+        wait = self._try_acquire_shared(background)
+        if wait > 0:
+            # Quota commun épuisé : le jeton local est rendu
+            with self._lock:
+                self._tokens = min(self.burst, self._tokens + 1)
+        return wait
+
+    def _try_acquire_shared(self, background: bool) -> float:
+        """Compte l'appel dans la fenêtre commune ; 0 si accepté, sinon l'attente jusqu'à la suivante"""
+        if self.shared_key is None:
+            return 0.0
+        now = time.time()
+        window = int(now // self.shared_window)
+        key = f"ratelimit:{self.shared_key}:{window}"
+        limit = self.rate * self.shared_window - (self.reserve if background else 0)
+        try:
+            backend = get_state_backend()
+            count = backend.incr_fields(key, {"count": 1}, ttl=2 * self.shared_window)["count"]
+            if count <= limit:
+                return 0.0
+            backend.incr_fields(key, {"count": -1}, ttl=2 * self.shared_window)
+        except Exception as e:
+            # Backend indisponible : le seau local continue de borner ce worker
+            print(f"⚠️ Quota {self.shared_key} commun non vérifié: {e}")
+            return 0.0
+        return (window + 1) * self.shared_window - now
+
+    def acquire(self, background: bool = False) -> None:
+        """Attend (en bloquant le thread courant) qu'un jeton soit disponible"""
+        if not background:
+            with self._lock:
+                self._foreground_waiting += 1
+        try:
+            while True:
+                wait = self.try_acquire(background)
+                if wait <= 0:
+                    return
+                time.sleep(wait)
+        finally:
+            if not background:
+                with self._lock:
+                    self._foreground_waiting -= 1
+
+
+# Reddit autorise ~100 requêtes/minute en OAuth : on garde une marge
+REDDIT_REQUESTS_PER_MINUTE = float(os.getenv("REDDIT_REQUESTS_PER_MINUTE", "90"))
+REDDIT_BURST = int(os.getenv("REDDIT_BURST", "10"))
+# Jetons gardés pour les appels interactifs (vérifications de subreddits)
+REDDIT_INTERACTIVE_RESERVE = int(os.getenv("REDDIT_INTERACTIVE_RESERVE", "2"))
+# Fenêtre du quota commun à tous les workers (REDDIT_REQUESTS_PER_MINUTE au total)
+REDDIT_SHARED_WINDOW_SECONDS = float(os.getenv("REDDIT_SHARED_WINDOW_SECONDS", "10"))
+
+reddit_limiter = RateLimiter(
+    REDDIT_REQUESTS_PER_MINUTE / 60,
+    REDDIT_BURST,
+    REDDIT_INTERACTIVE_RESERVE,
+    shared_key="reddit",
+    shared_window=REDDIT_SHARED_WINDOW_SECONDS,
+)
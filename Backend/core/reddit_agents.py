@@ -1,12 +1,31 @@
-from agents import Agent, WebSearchTool, Runner, trace
-from core.functions import supabase  # C'est une variable globale, pas un module
+import asyncio
+from agents import Agent, WebSearchTool, Runner, trace, function_tool, ItemHelpers, RunContextWrapper
+from agents.exceptions import AgentsException, MaxTurnsExceeded
+from agents.tool import default_tool_error_function
+from core.db import execute, get_db
 from core.prompts import prompt_0, prompt_1, prompt_2, prompt_3, prompt_4, prompt_5
+from core.intents import try_fast_path, clear_pending_parameters
+from core.prefetch import cancel_prefetch
+from core.deadlines import get_current_deadline, format_partial_response
+from core.profiling import profile_request, profile_tools
+from core.lanes import BATCH, use_lane
+from core.usage import (
+    UsageTracker,
+    BudgetExceededError,
+    run_tracked,
+    start_tracking,
+    stop_tracking,
+    record_session_usage,
+    persist_usage,
+)
 from .functions import (
     check_subreddit_exists,
     scrape_subreddit_posts,
     calculate_pain_score,
     store_exceptional_solution,
-    get_stored_solutions
+    get_stored_solutions,
+    get_subreddit_profile,
+    search_stored_content
 )
 
 # Agent 0 - RouterAgent
@@ -16,7 +35,9 @@ agent_0 = Agent(
     tools=[
         WebSearchTool(),
         check_subreddit_exists,
-        get_stored_solutions
+        get_stored_solutions,
+        search_stored_content,
+        get_subreddit_profile
     ], 
     model="gpt-4o-mini"
 )
@@ -59,11 +80,37 @@ agent_5 = Agent(
 )
 
 
+def _tool_error(ctx: RunContextWrapper, error: Exception) -> str:
+    # Les dépassements de budget / de tours doivent interrompre tout le run
+    if isinstance(error, AgentsException):
+        raise error
+    return default_tool_error_function(ctx, error)
+
+
+def agent_as_tool(agent: Agent, tool_name: str, tool_description: str):
+    """
+    Équivalent de Agent.as_tool dont le sous-run est comptabilisé dans l'analyse en cours
+
+    Les sous-runs (scraping, analyse, rapport) s'exécutent dans la voie batch (core.lanes).
+    """
+    @function_tool(
+        name_override=tool_name,
+        description_override=tool_description,
+        failure_error_function=_tool_error,
+    )
+    async def run_agent(context: RunContextWrapper, input: str) -> str:
+        with use_lane(BATCH):
+            result = await run_tracked(agent, input, context=context.context)
+        return ItemHelpers.text_message_outputs(result.new_items)
+
+    return run_agent
+
+
 # Convertir les agents en tools
-Scraper_tool = agent_2.as_tool(tool_name="scraper_tool", tool_description="scrape a subreddit")
-PainAnalysis_tool = agent_3.as_tool(tool_name="pain_analysis_tool", tool_description="analyze the pain of a subreddit")
-Recommendations_tool = agent_4.as_tool(tool_name="recommendations_tool", tool_description="generate recommendations")
-ReportGenerator_tool = agent_5.as_tool(tool_name="report_generator_tool", tool_description="generate final report from pain analysis and recommendations")
+Scraper_tool = agent_as_tool(agent_2, tool_name="scraper_tool", tool_description="scrape a subreddit")
+PainAnalysis_tool = agent_as_tool(agent_3, tool_name="pain_analysis_tool", tool_description="analyze the pain of a subreddit")
+Recommendations_tool = agent_as_tool(agent_4, tool_name="recommendations_tool", tool_description="generate recommendations")
+ReportGenerator_tool = agent_as_tool(agent_5, tool_name="report_generator_tool", tool_description="generate final report from pain analysis and recommendations")
 
 
 
@@ -83,6 +130,10 @@ agent_1 = Agent(
 agent_0.handoffs = [agent_1]
 agent_1.handoffs = [agent_0]
 
+# Outils visibles dans les profils de requête (sans effet si PROFILING_ENABLED est désactivé)
+for _agent in (agent_0, agent_1, agent_2, agent_3, agent_4, agent_5):
+    _agent.tools = profile_tools(_agent.tools)
+
 # Agent principal pour l'export
 ROUTER_AGENT = agent_0
 
@@ -92,56 +143,135 @@ ROUTER_AGENT = agent_0
 async def run_chat(message: str, session_id: str = "default") -> dict:
     """
     Fonction principale pour le chat avec l'agent RouterAgent
+
+    Profilée à la demande (core.profiling) : l'ID du profil est alors retourné
+    sous la clé "profile_id".
+    """
+    async with profile_request("run_chat", session_id) as profile_id:
+        result = await _run_chat(message, session_id)
+    if profile_id:
+        result["profile_id"] = profile_id
+    return result
+
+
+async def _run_chat(message: str, session_id: str) -> dict:
+    """
+    Chat avec l'agent RouterAgent
     (Adapté Version_00 pour Supabase)
+
+    Les intentions triviales passent d'abord par le chemin rapide (core.intents),
+    sans LLM. L'usage (tokens, tours, coût) de tous les runs et sous-runs est agrégé
+    dans un UsageTracker, persisté et retourné sous la clé "usage".
+
+    Sous un délai de requête (core.deadlines), le run est annulé à l'échéance et la
+    réponse est construite à partir des agents-tools déjà terminés ("partial": True).
     """
+    try:
+        fast = await try_fast_path(message, session_id)
+    except Exception as e:
+        print(f"⚠️ [DEBUG] Chemin rapide indisponible: {e}")
+        fast = None
+
+    if fast is not None and fast.response is not None:
+        print(f"⚡ [DEBUG] Chemin rapide ({fast.intent}) pour session {session_id}")
+        await save_to_history(session_id, message, fast.response)
+        return {
+            "success": True,
+            "response": fast.response,
+            "session_id": session_id,
+            "fast_path": fast.intent
+        }
+
+    # Message réécrit (ex. confirmation structurée) : c'est lui qu'on envoie au LLM,
+    # mais l'historique garde le message d'origine
+    llm_message = fast.llm_message if fast is not None and fast.llm_message else message
+
+    tracker = UsageTracker(session_id)
+    token = start_tracking(tracker)
+    status = "success"
     try:
         print(f"🔍 [DEBUG] run_chat appelé avec message: {message}")
         print(f"🔍 [DEBUG] session_id: {session_id}")
         
         # Construire le contexte avec l'historique
-        context = get_conversation_history(session_id)
-        full_context = f"{context}\nHumain: {message}\nAssistant: "
+        context = await get_conversation_history(session_id)
+        full_context = f"{context}\nHumain: {llm_message}\nAssistant: "
         
         print(f"🔍 [DEBUG] Contexte construit: {len(full_context)} caractères")
         
         # Lancer l'agent principal
         with trace(f"chat_session_{session_id}"):
             print(f"🔍 [DEBUG] Lancement de l'Agent 0...")
-            result = await Runner.run(agent_0, full_context)
+            deadline = get_current_deadline()
+            result = await asyncio.wait_for(
+                run_tracked(agent_0, full_context),
+                timeout=deadline.remaining() if deadline else None
+            )
             
             print(f"🔍 [DEBUG] Agent 0 terminé")
             print(f"🔍 [DEBUG] result.final_output: {result.final_output}")
-            print(f"🔍 [DEBUG] result.intermediate_steps: {len(result.intermediate_steps) if hasattr(result, 'intermediate_steps') else 'N/A'}")
-            
-            # Afficher les étapes intermédiaires si disponibles
-            if hasattr(result, 'intermediate_steps') and result.intermediate_steps:
-                print(f"🔍 [DEBUG] Étapes intermédiaires:")
-                for i, step in enumerate(result.intermediate_steps):
-                    print(f"  Étape {i}: {step}")
+            print(f"🔍 [DEBUG] usage: {tracker.total}")
             
             # Sauvegarder dans l'historique
-            save_to_history(session_id, message, result.final_output)
+            await save_to_history(session_id, message, result.final_output)
             
             return {
                 "success": True,
                 "response": result.final_output,
-                "session_id": session_id
+                "session_id": session_id,
+                "usage": tracker.to_dict()
             }
+
+    except asyncio.TimeoutError:
+        status = "timeout"
+        print(f"⏱️ [DEBUG] Délai dépassé dans run_chat (tools terminés: {list(tracker.tool_outputs)})")
+        response = format_partial_response(tracker.tool_outputs)
+        await save_to_history(session_id, message, response)
+        return {
+            "success": True,
+            "response": response,
+            "session_id": session_id,
+            "partial": True,
+            "usage": tracker.to_dict()
+        }
+
+    except asyncio.CancelledError:
+        # Client déconnecté ou arrêt du serveur : rien à renvoyer
+        status = "cancelled"
+        raise
+
+    except (BudgetExceededError, MaxTurnsExceeded) as e:
+        status = "budget_exceeded"
+        print(f"⛔ [DEBUG] Budget dépassé dans run_chat: {e.message}")
+        return {
+            "success": False,
+            "error": f"Analyse interrompue : {e.message}",
+            "session_id": session_id,
+            "usage": tracker.to_dict()
+        }
             
     except Exception as e:
+        status = "error"
         print(f"❌ [DEBUG] Erreur dans run_chat: {e}")
         return {
             "success": False,
             "error": str(e),
-            "session_id": session_id
+            "session_id": session_id,
+            "usage": tracker.to_dict()
         }
 
-def get_conversation_history(session_id: str) -> str:
+    finally:
+        stop_tracking(token)
+        await asyncio.to_thread(record_session_usage, tracker)
+        await persist_usage(tracker, status)
+
+async def get_conversation_history(session_id: str) -> str:
     """
     Récupère l'historique de conversation depuis Supabase
     """
     try:
-        result = supabase.table("conversation_history").select("user_message, agent_response").eq("session_id", session_id).order("timestamp", desc=False).execute()
+        db = await get_db()
+        result = await execute(db.table("conversation_history").select("user_message, agent_response").eq("session_id", session_id).order("timestamp", desc=False))
         
         context = ""
         for msg in result.data:
@@ -152,26 +282,30 @@ def get_conversation_history(session_id: str) -> str:
     except Exception:
         return ""
 
-def save_to_history(session_id: str, user_message: str, agent_response: str):
+async def save_to_history(session_id: str, user_message: str, agent_response: str):
     """
     Sauvegarde un échange dans l'historique Supabase
     """
     try:
-        supabase.table("conversation_history").insert({
+        db = await get_db()
+        await execute(db.table("conversation_history").insert({
             "session_id": session_id,
             "user_message": user_message,
             "agent_response": agent_response
-        }).execute()
+        }), write=True)
         
     except Exception as e:
         print(f"Erreur sauvegarde historique: {e}")
 
-def clear_conversation_history(session_id: str):
+async def clear_conversation_history(session_id: str):
     """
     Efface l'historique de conversation
     """
+    await clear_pending_parameters(session_id)
+    await cancel_prefetch(session_id)
     try:
-        supabase.table("conversation_history").delete().eq("session_id", session_id).execute()
+        db = await get_db()
+        await execute(db.table("conversation_history").delete().eq("session_id", session_id), write=True)
         print(f"Historique effacé pour session {session_id}")
         
     except Exception as e:
@@ -0,0 +1,233 @@
+"""
+Rendu PDF / HTML des rapports du ReportGenerator.
+
+La mise en page (coûteuse en CPU) s'exécute dans un pool de processus, jamais sur
+l'event loop. Chaque artefact est stocké sous le hash de son contenu : un rapport
+déjà rendu est resservi depuis le disque et son hash sert d'ETag.
+"""
+import os
+import re
+import html
+import asyncio
+import hashlib
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+# Version du moteur de rendu : la changer invalide tous les artefacts en cache
+RENDERER_VERSION = "1"
+
+ARTIFACTS_DIR = Path(os.getenv("ARTIFACTS_DIR", "artifacts"))
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", "2"))
+DEFAULT_TITLE = "Rapport d'analyse Reddit"
+
+RENDER_FORMATS = {
+    "pdf": "application/pdf",
+    "html": "text/html; charset=utf-8",
+}
+
+_executor: Optional[ProcessPoolExecutor] = None
+# Rendus en cours, pour qu'un même artefact ne soit calculé qu'une fois
+_in_flight: Dict[str, "asyncio.Future[str]"] = {}
+
+_BOLD_RE = re.compile(r"\*\*(.+?)\*\*")
+_NUMBERED_RE = re.compile(r"^\d+\.\s")
+
+
+def artifact_key(report: str, format_type: str, title: str = DEFAULT_TITLE) -> str:
+    """Hash du contenu (rapport + titre + format + version du moteur), utilisé comme nom de fichier et ETag"""
+    digest = hashlib.sha256()
+    digest.update(f"{RENDERER_VERSION}:{format_type}:".encode("utf-8"))
+    digest.update(f"{len(title)}:{title}:".encode("utf-8"))
+    digest.update(report.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def artifact_path(key: str, format_type: str) -> Path:
+    return ARTIFACTS_DIR / key[:2] / f"{key}.{format_type}"
+
+
+# ===== RENDUS (exécutés dans les processus du pool) =====
+
+def _inline_html(text: str) -> str:
+    return _BOLD_RE.sub(r"<b>\1</b>", html.escape(text))
+
+
+def _report_blocks(report: str) -> List[tuple]:
+    """Découpe le rapport markdown en blocs (titre, item numéroté, puce, paragraphe)"""
+    blocks = []
+    for raw in report.splitlines():
+        line = raw.strip()
+        if not line:
+            continue
+        if line.startswith("**") and line.endswith("**") or line.startswith("#"):
+            blocks.append(("heading", line.strip("#").strip()))
+        elif _NUMBERED_RE.match(line):
+            blocks.append(("item", line))
+        elif line.startswith(("•", "-", "*")):
+            blocks.append(("bullet", line.lstrip("•-* ").strip(), raw.startswith((" ", "\t"))))
+        elif any(line.startswith(emoji) for emoji in ("📊", "🔥", "💡")):
+            blocks.append(("heading", line))
+        else:
+            blocks.append(("text", line))
+    return blocks
+
+
+def render_html(report: str, title: str = DEFAULT_TITLE) -> bytes:
+    """
+    Rend un rapport en page HTML autonome
+
+    Args:
+        report: Rapport markdown du ReportGenerator
+        title: Titre de la page
+
+    Returns:
+        Document HTML encodé en UTF-8
+    """
+    parts = [
+        "<!DOCTYPE html>",
+        '<html lang="fr"><head><meta charset="utf-8">',
+        f"<title>{html.escape(title)}</title>",
+        "<style>body{font-family:system-ui,sans-serif;max-width:860px;margin:2rem auto;"
+        "line-height:1.5;color:#1f2937}h2{border-bottom:1px solid #e5e7eb;padding-bottom:.25rem}"
+        "li.sub{margin-left:1.5rem;color:#4b5563}</style>",
+        "</head><body>",
+        f"<h1>{html.escape(title)}</h1>",
+    ]
+    in_list = False
+    for block in _report_blocks(report):
+        kind, text = block[0], block[1]
+        if kind == "bullet":
+            if not in_list:
+                parts.append("<ul>")
+                in_list = True
+            css = ' class="sub"' if block[2] else ""
+            parts.append(f"<li{css}>{_inline_html(text)}</li>")
+            continue
+        if in_list:
+            parts.append("</ul>")
+            in_list = False
+        if kind == "heading":
+            parts.append(f"<h2>{html.escape(text.replace('**', ''))}</h2>")
+        elif kind == "item":
+            parts.append(f"<h3>{_inline_html(text)}</h3>")
+        else:
+            parts.append(f"<p>{_inline_html(text)}</p>")
+    if in_list:
+        parts.append("</ul>")
+    parts.append("</body></html>")
+    return "\n".join(parts).encode("utf-8")
+
+
+def _pdf_safe(text: str) -> str:
+    # Les polices PDF standard ne couvrent pas les émojis : on ne garde que le Latin-1
+    return text.encode("latin-1", "ignore").decode("latin-1").strip()
+
+
+def render_pdf(report: str, title: str = DEFAULT_TITLE) -> bytes:
+    """
+    Rend un rapport en PDF (reportlab)
+
+    Args:
+        report: Rapport markdown du ReportGenerator
+        title: Titre du document
+
+    Returns:
+        Document PDF
+    """
+    from io import BytesIO
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.lib.units import cm
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
+
+    styles = getSampleStyleSheet()
+    bullet_style = ParagraphStyle("bullet", parent=styles["BodyText"], leftIndent=12, bulletIndent=0)
+    sub_bullet_style = ParagraphStyle("sub_bullet", parent=bullet_style, leftIndent=28, bulletIndent=16)
+
+    buffer = BytesIO()
+    document = SimpleDocTemplate(
+        buffer, pagesize=A4, title=title,
+        leftMargin=2 * cm, rightMargin=2 * cm, topMargin=2 * cm, bottomMargin=2 * cm,
+    )
+    story = [Paragraph(html.escape(title), styles["Title"]), Spacer(1, 12)]
+    for block in _report_blocks(report):
+        kind, text = block[0], _inline_html(_pdf_safe(block[1]))
+        if not text:
+            continue
+        if kind == "heading":
+            story.append(Paragraph(text.replace("*", ""), styles["Heading2"]))
+        elif kind == "item":
+            story.append(Paragraph(text, styles["Heading3"]))
+        elif kind == "bullet":
+            style = sub_bullet_style if block[2] else bullet_style
+            story.append(Paragraph(text, style, bulletText="-" if block[2] else "•"))
+        else:
+            story.append(Paragraph(text, styles["BodyText"]))
+    document.build(story)
+    return buffer.getvalue()
+
+
+_RENDERERS = {
+    "pdf": render_pdf,
+    "html": render_html,
+}
+
+
+def _render_to_file(report: str, format_type: str, title: str, destination: str) -> str:
+    # Point d'entrée du processus de rendu : écriture atomique de l'artefact
+    data = _RENDERERS[format_type](report, title)
+    path = Path(destination)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(f"{path.suffix}.{os.getpid()}.tmp")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
+    return str(path)
+
+
+# ===== POOL DE RENDU =====
+
+def get_executor() -> ProcessPoolExecutor:
+    """Pool de processus de rendu, créé au premier usage"""
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=RENDER_WORKERS)
+    return _executor
+
+
+def shutdown_executor() -> None:
+    """Arrête le pool de rendu (appelé à l'arrêt de l'application)"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+async def get_or_render(report: str, format_type: str, title: str = DEFAULT_TITLE) -> Path:
+    """
+    Retourne le chemin de l'artefact, en le rendant dans le pool s'il n'existe pas encore
+
+    Args:
+        report: Rapport markdown
+        format_type: "pdf" ou "html"
+        title: Titre du document
+
+    Returns:
+        Chemin du fichier rendu
+    """
+    key = artifact_key(report, format_type, title)
+    path = artifact_path(key, format_type)
+    if path.exists():
+        return path
+
+    pending = _in_flight.get(key)
+    if pending is not None:
+        return Path(await asyncio.shield(pending))
+
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(get_executor(), _render_to_file, report, format_type, title, str(path))
+    _in_flight[key] = future
+    try:
+        return Path(await asyncio.shield(future))
+    finally:
+        _in_flight.pop(key, None)
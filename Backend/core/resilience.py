@@ -0,0 +1,319 @@
+"""
+Résilience des appels sortants (Reddit, OpenAI, Supabase).
+
+- Classification des erreurs : seules les erreurs transitoires (réseau, 429, 5xx,
+  timeouts, surcharge de Postgres) sont retentées ; une erreur client (404, 403,
+  requête invalide) remonte immédiatement.
+- Backoff exponentiel avec jitter complet, qui respecte Retry-After ; un Retry-After
+  supérieur à RETRY_MAX_DELAY, ou une attente qui dépasserait le délai de la requête
+  (core.deadlines), arrête les tentatives.
+- Un disjoncteur par dépendance : après BREAKER_FAILURE_THRESHOLD échecs transitoires
+  consécutifs, les appels échouent tout de suite (DependencyUnavailable) pendant
+  BREAKER_RESET_SECONDS, puis un seul appel test décide de la réouverture.
+- Requêtes « couvertes » (hedging) pour les lectures idempotentes asynchrones : si la
+  réponse tarde au-delà du p95 observé, une seconde requête identique part et la
+  première réponse gagne.
+
+Les disjoncteurs sont propres à chaque worker (état exposé par /health).
+"""
+import os
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar, Union
+
+import httpx
+import openai
+import prawcore
+from postgrest.exceptions import APIError
+
+from core.deadlines import get_current_deadline
+from core.profiling import span
+
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "3"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.5"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "10"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", "30"))
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "true").lower() == "true"
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.05"))
+# Nombre minimal de latences observées avant de couvrir une requête
+HEDGE_MIN_SAMPLES = 20
+HEDGE_QUANTILE = 0.95
+
+# Codes Postgres transitoires : connexion, ressources, annulation (timeout), conflit de sérialisation
+_RETRYABLE_PG_PREFIXES = ("08", "53", "57", "40001", "40P01")
+
+T = TypeVar("T")
+# True / False, ou prédicat sur l'erreur (ex. écriture retentée seulement si la requête n'est pas partie)
+RetryPolicy = Union[bool, Callable[[BaseException], bool]]
+
+
+class DependencyUnavailable(Exception):
+    """Disjoncteur ouvert : la dépendance est considérée comme indisponible"""
+
+    def __init__(self, dependency: str, retry_after: float):
+        self.dependency = dependency
+        self.retry_after = retry_after
+        super().__init__(f"{dependency} momentanément indisponible, réessayez dans {retry_after:.0f}s")
+
+
+class CircuitBreaker:
+    """
+    Disjoncteur d'une dépendance (thread-safe : utilisé par les threads PRAW et l'event loop)
+
+    Args:
+        name: Nom de la dépendance
+        failure_threshold: Échecs transitoires consécutifs avant ouverture
+        reset_timeout: Durée d'ouverture avant un appel test (secondes)
+    """
+
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURE_THRESHOLD, reset_timeout: float = BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._latencies: deque = deque(maxlen=200)
+        self._lock = threading.Lock()
+        self.retries = 0
+        self.hedges = 0
+        self.rejected = 0
+
+    def before_call(self) -> None:
+        """Lève DependencyUnavailable si le disjoncteur refuse l'appel"""
+        with self._lock:
+            if self.state == "closed":
+                return
+            remaining = self.reset_timeout - (time.monotonic() - self._opened_at)
+            if self.state == "open" and remaining <= 0:
+                self.state = "half_open"
+            if self.state == "half_open" and not self._probing:
+                # Un seul appel test à la fois
+                self._probing = True
+                return
+            self.rejected += 1
+            raise DependencyUnavailable(self.name, max(remaining, 1.0))
+
+    def record_success(self, latency: Optional[float] = None) -> None:
+        with self._lock:
+            if self.state != "closed":
+                print(f"🟢 Disjoncteur {self.name} refermé")
+            self.state = "closed"
+            self._failures = 0
+            self._probing = False
+            if latency is not None:
+                self._latencies.append(latency)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self.state == "half_open" or (self.state == "closed" and self._failures >= self.failure_threshold):
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                print(f"🔴 Disjoncteur {self.name} ouvert ({self._failures} échecs consécutifs)")
+
+    def abandon_call(self) -> None:
+        """Appel annulé sans résultat : libère la place d'appel test"""
+        with self._lock:
+            self._probing = False
+
+    def hedge_delay(self) -> Optional[float]:
+        """Délai avant une requête de couverture (p95 des latences), None si trop peu de mesures"""
+        with self._lock:
+            if len(self._latencies) < HEDGE_MIN_SAMPLES:
+                return None
+            latencies = sorted(self._latencies)
+        return max(HEDGE_MIN_DELAY, latencies[int(len(latencies) * HEDGE_QUANTILE) - 1])
+
+    def to_dict(self) -> Dict[str, Any]:
+        delay = self.hedge_delay()
+        return {
+            "state": self.state,
+            "consecutive_failures": self._failures,
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "rejected": self.rejected,
+            "hedge_delay_ms": round(delay * 1000, 1) if delay is not None else None,
+        }
+
+
+reddit_breaker = CircuitBreaker("Reddit")
+openai_breaker = CircuitBreaker("OpenAI")
+supabase_breaker = CircuitBreaker("Supabase")
+
+
+def breaker_status() -> Dict[str, Any]:
+    """État des disjoncteurs du worker courant"""
+    return {breaker.name.lower(): breaker.to_dict() for breaker in (reddit_breaker, openai_breaker, supabase_breaker)}
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Erreur transitoire, qui mérite une nouvelle tentative (et compte pour le disjoncteur)"""
+    if isinstance(error, DependencyUnavailable):
+        return False
+    # Réseau / timeouts
+    if isinstance(error, (prawcore.RequestException, prawcore.ServerError, prawcore.TooManyRequests)):
+        return True
+    if isinstance(error, prawcore.ResponseException):
+        return error.response.status_code == 429 or error.response.status_code >= 500
+    if isinstance(error, (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)):
+        return True
+    if isinstance(error, httpx.PoolTimeout):
+        # Pool local saturé : la dépendance n'est pas en cause
+        return False
+    if isinstance(error, httpx.TransportError):
+        return True
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code == 429 or error.response.status_code >= 500
+    if isinstance(error, APIError):
+        code = error.code
+        if isinstance(code, int):
+            return code == 429 or code >= 500
+        return isinstance(code, str) and code.startswith(_RETRYABLE_PG_PREFIXES)
+    return isinstance(error, (TimeoutError, ConnectionError))
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Délai demandé par le serveur (en-tête Retry-After, en secondes ou en date HTTP)"""
+    value = getattr(error, "retry_after", None)
+    response = getattr(error, "response", None)
+    if value is None and response is not None:
+        value = response.headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, error: BaseException) -> float:
+    """Attente avant la tentative suivante : jitter complet, au moins le Retry-After"""
+    delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+    requested = retry_after(error)
+    return max(delay, requested) if requested is not None else delay
+
+
+def _should_retry(attempt: int, delay: float) -> bool:
+    if attempt + 1 >= RETRY_MAX_ATTEMPTS or delay > RETRY_MAX_DELAY:
+        return False
+    deadline = get_current_deadline()
+    return deadline is None or deadline.remaining() > delay
+
+
+def _handle_failure(breaker: CircuitBreaker, error: Exception, attempt: int, retry: RetryPolicy) -> Optional[float]:
+    """Met à jour le disjoncteur ; retourne l'attente avant nouvelle tentative, ou None pour abandonner"""
+    if not is_retryable(error):
+        # La dépendance a répondu : l'erreur vient de la requête
+        if not isinstance(error, (DependencyUnavailable, httpx.PoolTimeout)):
+            breaker.record_success()
+        return None
+    breaker.record_failure()
+    delay = backoff_delay(attempt, error)
+    if not retry or (callable(retry) and not retry(error)) or not _should_retry(attempt, delay):
+        return None
+    breaker.retries += 1
+    print(f"🔁 {breaker.name}: nouvelle tentative dans {delay:.1f}s ({type(error).__name__}: {error})")
+    return delay
+
+
+def call_with_retry(breaker: CircuitBreaker, function: Callable[..., T], *args: Any, retry: RetryPolicy = True, **kwargs: Any) -> T:
+    """
+    Appel synchrone (threads) protégé par le disjoncteur, retenté sur erreur transitoire
+
+    Args:
+        breaker: Disjoncteur de la dépendance
+        function: Appel à exécuter (doit être idempotent si retry=True)
+        retry: False pour seulement passer par le disjoncteur, ou prédicat sur l'erreur
+
+    Raises:
+        DependencyUnavailable: si le disjoncteur est ouvert
+    """
+    with span(f"{breaker.name.lower()}:{getattr(function, '__name__', 'call')}"):
+        attempt = 0
+        while True:
+            breaker.before_call()
+            started = time.monotonic()
+            try:
+                result = function(*args, **kwargs)
+            except Exception as error:
+                delay = _handle_failure(breaker, error, attempt, retry)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                continue
+            breaker.record_success(time.monotonic() - started)
+            return result
+
+
+async def _hedged(breaker: CircuitBreaker, factory: Callable[[], Awaitable[T]]) -> T:
+    """Lance une seconde requête identique si la première dépasse le p95 ; la première réponse gagne"""
+    delay = breaker.hedge_delay() if HEDGE_ENABLED else None
+    if delay is None:
+        return await factory()
+
+    tasks = {asyncio.ensure_future(factory())}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done:
+            breaker.hedges += 1
+            tasks.add(asyncio.ensure_future(factory()))
+        error: Optional[BaseException] = None
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def acall_with_retry(breaker: CircuitBreaker, factory: Callable[[], Awaitable[T]], retry: RetryPolicy = True, hedge: bool = False, label: str = "call") -> T:
+    """
+    Appel asynchrone protégé par le disjoncteur, retenté sur erreur transitoire
+
+    Args:
+        breaker: Disjoncteur de la dépendance
+        factory: Construit la coroutine à chaque tentative
+        retry: False pour seulement passer par le disjoncteur, ou prédicat sur l'erreur
+        hedge: Couvrir la requête (lectures idempotentes uniquement)
+        label: Nom de l'appel dans le profil de la requête (core.profiling)
+
+    Raises:
+        DependencyUnavailable: si le disjoncteur est ouvert
+    """
+    with span(f"{breaker.name.lower()}:{label}"):
+        attempt = 0
+        while True:
+            breaker.before_call()
+            started = time.monotonic()
+            try:
+                result = await (_hedged(breaker, factory) if hedge else factory())
+            except asyncio.CancelledError:
+                breaker.abandon_call()
+                raise
+            except Exception as error:
+                delay = _handle_failure(breaker, error, attempt, retry)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            breaker.record_success(time.monotonic() - started)
+            return result
@@ -0,0 +1,460 @@
+"""
+Surveillance planifiée de subreddits (watchlist).
+
+Chaque subreddit surveillé est ré-analysé selon une expression cron à 5 champs,
+en scraping incrémental (les posts déjà vus sont ignorés). Les scores de douleur
+de chaque run sont stockés en série temporelle dans le store local ; les tendances
+sont calculées à partir de ces séries, sans aucun appel LLM.
+
+Chaque run n'analyse que les nouveaux posts : ses scores bruts ne sont pas comparables
+d'un run à l'autre. Les tendances portent donc sur la part de chaque douleur dans son
+run (score x fréquence, rapporté au total du run), indépendante du nombre de posts et
+de l'échelle de notation du LLM.
+
+Les subreddits sont identifiés par leur nom en minuscules (comme le cache de scraping).
+"""
+import os
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Set
+
+from core.lanes import BATCH, use_lane
+from core.local_store import get_connection
+from core.pipeline import PAIN_SIMILARITY_THRESHOLD, pain_key, pain_tokens, scrape_and_analyze
+from core.usage import tracked_analysis
+
+WATCHLIST_SCHEDULER_ENABLED = os.getenv("WATCHLIST_SCHEDULER_ENABLED", "true").lower() == "true"
+WATCHLIST_POLL_SECONDS = int(os.getenv("WATCHLIST_POLL_SECONDS", "60"))
+DEFAULT_WATCH_SCHEDULE = os.getenv("DEFAULT_WATCH_SCHEDULE", "0 6 * * 1")  # lundi 6h UTC
+# Nombre de posts déjà vus conservés par subreddit pour le scraping incrémental
+SEEN_POSTS_RETENTION = 5000
+# Pente (points de pourcentage de part par run) en dessous de laquelle une douleur est stable
+TREND_STABLE_SLOPE = float(os.getenv("TREND_STABLE_SLOPE", "2"))
+
+
+# ===== EXPRESSIONS CRON =====
+
+class CronSchedule:
+    """
+    Expression cron à 5 champs (minute heure jour mois jour_semaine), en UTC
+
+    Chaque champ accepte "*", "*/n", "a-b", "a-b/n" et les listes "a,b,c".
+    Le jour de la semaine va de 0 (dimanche) à 6 (7 est accepté pour dimanche).
+    """
+
+    _BOUNDS = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Expression cron invalide (5 champs attendus): {expression}")
+        self.expression = expression
+        parsed = [self._parse_field(field, low, high) for field, (low, high) in zip(fields, self._BOUNDS)]
+        self.minutes, self.hours, self.days, self.months, weekdays = parsed
+        self.weekdays = {0 if day == 7 else day for day in weekdays}
+        self._any_day = fields[2] == "*"
+        self._any_weekday = fields[4] == "*"
+
+    @staticmethod
+    def _parse_field(field: str, low: int, high: int) -> Set[int]:
+        values: Set[int] = set()
+        for part in field.split(","):
+            step = 1
+            if "/" in part:
+                part, step_text = part.split("/", 1)
+                step = int(step_text)
+            if part == "*":
+                start, end = low, high
+            elif "-" in part:
+                start_text, end_text = part.split("-", 1)
+                start, end = int(start_text), int(end_text)
+            else:
+                start = end = int(part)
+            if start < low or end > high or start > end or step < 1:
+                raise ValueError(f"Champ cron hors limites: {field}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, moment: datetime) -> bool:
+        day_ok = moment.day in self.days
+        weekday_ok = (moment.isoweekday() % 7) in self.weekdays
+        # Sémantique cron : si les deux champs sont restreints, l'un OU l'autre suffit
+        if not self._any_day and not self._any_weekday:
+            return day_ok or weekday_ok
+        return day_ok and weekday_ok
+
+    def next_after(self, moment: datetime) -> datetime:
+        """Prochaine échéance strictement après `moment`"""
+        candidate = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = candidate + timedelta(days=366 * 5)
+        while candidate < limit:
+            if candidate.month not in self.months or not self._day_matches(candidate):
+                candidate = (candidate + timedelta(days=1)).replace(hour=0, minute=0)
+                continue
+            if candidate.hour not in self.hours:
+                candidate = (candidate + timedelta(hours=1)).replace(minute=0)
+                continue
+            if candidate.minute not in self.minutes:
+                candidate += timedelta(minutes=1)
+                continue
+            return candidate
+        raise ValueError(f"Aucune échéance trouvée pour: {self.expression}")
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def watch_key(subreddit: str) -> str:
+    """Nom normalisé d'un subreddit surveillé (sans 'r/', en minuscules)"""
+    return subreddit.strip().removeprefix("/").removeprefix("r/").lower()
+
+
+# ===== WATCHLIST =====
+
+def add_to_watchlist(
+    subreddit: str,
+    schedule: str = DEFAULT_WATCH_SCHEDULE,
+    num_posts: int = 25,
+    comments_limit: int = 5,
+    sort_criteria: str = "new",
+    time_filter: str = "week",
+) -> Dict[str, Any]:
+    """
+    Ajoute (ou met à jour) un subreddit dans la watchlist
+
+    Raises:
+        ValueError: si l'expression cron est invalide
+    """
+    subreddit = watch_key(subreddit)
+    next_run_at = CronSchedule(schedule).next_after(_now())
+    connection = get_connection()
+    connection.execute(
+        """
+        INSERT INTO watchlist (subreddit, schedule, num_posts, comments_limit, sort_criteria, time_filter, enabled, next_run_at)
+        VALUES (?, ?, ?, ?, ?, ?, 1, ?)
+        ON CONFLICT (subreddit) DO UPDATE SET
+            schedule = excluded.schedule, num_posts = excluded.num_posts,
+            comments_limit = excluded.comments_limit, sort_criteria = excluded.sort_criteria,
+            time_filter = excluded.time_filter, enabled = 1, next_run_at = excluded.next_run_at
+        """,
+        (subreddit, schedule, num_posts, comments_limit, sort_criteria, time_filter, next_run_at.isoformat()),
+    )
+    connection.commit()
+    return get_watch(subreddit)
+
+
+def remove_from_watchlist(subreddit: str) -> bool:
+    """Retire un subreddit de la watchlist (les séries déjà stockées sont conservées)"""
+    connection = get_connection()
+    cursor = connection.execute("DELETE FROM watchlist WHERE subreddit = ?", (watch_key(subreddit),))
+    connection.commit()
+    return cursor.rowcount > 0
+
+
+def get_watch(subreddit: str) -> Optional[Dict[str, Any]]:
+    row = get_connection().execute("SELECT * FROM watchlist WHERE subreddit = ?", (watch_key(subreddit),)).fetchone()
+    return dict(row) if row else None
+
+
+def list_watchlist() -> List[Dict[str, Any]]:
+    rows = get_connection().execute("SELECT * FROM watchlist ORDER BY subreddit").fetchall()
+    return [dict(row) for row in rows]
+
+
+def _claim_due_watches() -> List[Dict[str, Any]]:
+    """
+    Réserve les surveillances arrivées à échéance
+
+    La prochaine échéance est avancée dans la même requête UPDATE : si plusieurs
+    workers partagent le store, un seul d'entre eux exécute chaque run.
+    """
+    now = _now()
+    connection = get_connection()
+    claimed = []
+    rows = connection.execute(
+        "SELECT * FROM watchlist WHERE enabled = 1 AND next_run_at <= ?", (now.isoformat(),)
+    ).fetchall()
+    for row in rows:
+        next_run_at = CronSchedule(row["schedule"]).next_after(now)
+        cursor = connection.execute(
+            "UPDATE watchlist SET next_run_at = ?, last_run_at = ? WHERE subreddit = ? AND next_run_at = ?",
+            (next_run_at.isoformat(), now.isoformat(), row["subreddit"], row["next_run_at"]),
+        )
+        if cursor.rowcount:
+            claimed.append(dict(row))
+    connection.commit()
+    return claimed
+
+
+# ===== RUNS ET SÉRIES TEMPORELLES =====
+
+def _seen_post_ids(subreddit: str) -> Set[str]:
+    rows = get_connection().execute(
+        "SELECT post_id FROM watch_seen_posts WHERE subreddit = ?", (subreddit,)
+    ).fetchall()
+    return {row["post_id"] for row in rows}
+
+
+def _match_series_key(label: str, known_keys: List[str]) -> str:
+    """
+    Rattache un libellé de douleur à une série existante du subreddit
+
+    Les libellés varient d'un run à l'autre ("Lack of documentation" / "Documentation lacking") :
+    on réutilise la clé existante la plus proche (Jaccard >= PAIN_SIMILARITY_THRESHOLD).
+    """
+    key = pain_key(label)
+    if key in known_keys:
+        return key
+    tokens = pain_tokens(label)
+    best, best_similarity = key, 0.0
+    for known in known_keys:
+        known_tokens = set(known.split())
+        union = tokens | known_tokens
+        similarity = len(tokens & known_tokens) / len(union) if union else 0.0
+        if similarity >= PAIN_SIMILARITY_THRESHOLD and similarity > best_similarity:
+            best, best_similarity = known, similarity
+    return best
+
+
+def _record_run(subreddit: str, status: str, scrape: Dict[str, Any], pains: List[Dict[str, Any]]) -> int:
+    now = _now().isoformat()
+    connection = get_connection()
+    posts = scrape.get("posts", [])
+    cursor = connection.execute(
+        "INSERT INTO pain_runs (subreddit, ran_at, status, posts_count, new_posts_count) VALUES (?, ?, ?, ?, ?)",
+        (subreddit, now, status, len(posts) + scrape.get("skipped_posts", 0), len(posts)),
+    )
+    run_id = cursor.lastrowid
+    known_keys = [
+        row["pain_key"] for row in connection.execute(
+            "SELECT DISTINCT pain_key FROM pain_scores WHERE subreddit = ?", (subreddit,)
+        )
+    ]
+
+    scores: Dict[str, tuple] = {}
+    for pain in pains:
+        label = str(pain.get("pain_type", "")).strip()
+        if not label:
+            continue
+        try:
+            score = float(pain.get("score", 0))
+            frequency = int(float(pain.get("frequency", 0)))
+        except (TypeError, ValueError):
+            continue
+        key = _match_series_key(label, known_keys)
+        # Deux libellés équivalents dans un même run : on garde le meilleur score
+        if key not in scores or score > scores[key][2]:
+            scores[key] = (run_id, key, subreddit, label, score, frequency)
+    connection.executemany(
+        "INSERT INTO pain_scores (run_id, pain_key, subreddit, pain_type, score, frequency) VALUES (?, ?, ?, ?, ?, ?)",
+        list(scores.values()),
+    )
+
+    # Posts d'une analyse échouée non marqués comme vus : ils seront réanalysés au prochain run
+    if status == "success":
+        connection.executemany(
+            "INSERT OR IGNORE INTO watch_seen_posts (subreddit, post_id, seen_at) VALUES (?, ?, ?)",
+            [(subreddit, post["id"], now) for post in posts],
+        )
+        connection.execute(
+            """
+            DELETE FROM watch_seen_posts WHERE subreddit = ? AND post_id NOT IN (
+                SELECT post_id FROM watch_seen_posts WHERE subreddit = ? ORDER BY seen_at DESC LIMIT ?
+            )
+            """,
+            (subreddit, subreddit, SEEN_POSTS_RETENTION),
+        )
+    connection.commit()
+    return run_id
+
+
+async def run_watch(watch: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Exécute un run de surveillance : scraping incrémental, analyse des douleurs
+    et enregistrement des scores
+
+    Args:
+        watch: Ligne de la watchlist
+
+    Returns:
+        Résumé du run
+    """
+    subreddit = watch["subreddit"]
+    seen = await asyncio.to_thread(_seen_post_ids, subreddit)
+    # Les nouveaux posts sont analysés par lots pendant le scraping
+    async with tracked_analysis(f"watch_{subreddit}"):
+        scrape, analysis = await scrape_and_analyze(
+            subreddit,
+            watch["num_posts"],
+            watch["sort_criteria"],
+            watch["comments_limit"],
+            watch["time_filter"],
+            seen,
+        )
+    if not scrape["success"]:
+        run_id = await asyncio.to_thread(_record_run, subreddit, "error", {}, [])
+        return {"success": False, "run_id": run_id, "subreddit": subreddit, "error": scrape["error"]}
+
+    if not scrape["posts"]:
+        # Rien de nouveau : aucun appel LLM
+        run_id = await asyncio.to_thread(_record_run, subreddit, "no_new_posts", scrape, [])
+        return {"success": True, "run_id": run_id, "subreddit": subreddit, "new_posts": 0, "pains": []}
+
+    pains = analysis.get("top_pains") or []
+    if not pains:
+        # Analyse en erreur ou inexploitable (ex: sortie non JSON) : run hors séries
+        run_id = await asyncio.to_thread(_record_run, subreddit, "analysis_failed", scrape, [])
+        return {
+            "success": False,
+            "run_id": run_id,
+            "subreddit": subreddit,
+            "error": analysis.get("error") or "Analyse des douleurs sans résultat",
+        }
+
+    run_id = await asyncio.to_thread(_record_run, subreddit, "success", scrape, pains)
+    return {
+        "success": True,
+        "run_id": run_id,
+        "subreddit": subreddit,
+        "new_posts": len(scrape["posts"]),
+        "pains": pains,
+    }
+
+
+def get_pain_series(subreddit: str, runs: int = 10) -> Dict[str, Any]:
+    """
+    Séries de scores par douleur sur les `runs` derniers runs ayant produit des scores
+
+    Returns:
+        Dict avec la liste des runs et, par douleur, un score brut et une part du run
+        (en %, cf. en-tête du module) par run (None si absente)
+    """
+    subreddit = watch_key(subreddit)
+    connection = get_connection()
+    run_rows = connection.execute(
+        """
+        SELECT id, ran_at FROM pain_runs
+        WHERE subreddit = ? AND status = 'success'
+        ORDER BY id DESC LIMIT ?
+        """,
+        (subreddit, runs),
+    ).fetchall()
+    run_rows = list(reversed(run_rows))
+    if not run_rows:
+        return {"subreddit": subreddit, "runs": [], "pains": {}}
+
+    positions = {row["id"]: index for index, row in enumerate(run_rows)}
+    placeholders = ",".join("?" * len(positions))
+    score_rows = connection.execute(
+        f"SELECT run_id, pain_key, pain_type, score, frequency FROM pain_scores WHERE run_id IN ({placeholders})",
+        list(positions),
+    ).fetchall()
+
+    # Poids d'une douleur dans son run : score x fréquence (au moins une occurrence)
+    weights = {(row["run_id"], row["pain_key"]): row["score"] * max(row["frequency"], 1) for row in score_rows}
+    run_totals: Dict[int, float] = {}
+    for (run_id, _), weight in weights.items():
+        run_totals[run_id] = run_totals.get(run_id, 0.0) + weight
+
+    pains: Dict[str, Dict[str, Any]] = {}
+    for row in score_rows:
+        pain = pains.setdefault(row["pain_key"], {
+            "pain_type": row["pain_type"],
+            "scores": [None] * len(run_rows),
+            "shares": [None] * len(run_rows),
+        })
+        position = positions[row["run_id"]]
+        total = run_totals[row["run_id"]]
+        pain["scores"][position] = row["score"]
+        pain["shares"][position] = round(100 * weights[(row["run_id"], row["pain_key"])] / total, 2) if total else 0.0
+        pain["pain_type"] = row["pain_type"]
+    return {
+        "subreddit": subreddit,
+        "runs": [{"run_id": row["id"], "ran_at": row["ran_at"]} for row in run_rows],
+        "pains": pains,
+    }
+
+
+def _slope(points: List[tuple]) -> float:
+    # Régression linéaire (moindres carrés) du score sur l'index du run
+    n = len(points)
+    mean_x = sum(x for x, _ in points) / n
+    mean_y = sum(y for _, y in points) / n
+    variance = sum((x - mean_x) ** 2 for x, _ in points)
+    if not variance:
+        return 0.0
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / variance
+
+
+def get_pain_trends(subreddit: str, runs: int = 5) -> Dict[str, Any]:
+    """
+    Tendances des douleurs sur les N derniers runs (lecture des séries pré-calculées)
+
+    La tendance est la pente de la part de la douleur dans chaque run (en points de
+    pourcentage par run) : les scores bruts de runs portant sur des posts différents ne
+    sont pas comparables. Une douleur absente d'un run compte pour une part de 0 à
+    partir de sa première apparition.
+
+    Returns:
+        Dict avec les douleurs en hausse, en baisse et stables
+    """
+    series = get_pain_series(subreddit, runs)
+    trends = []
+    for key, pain in series["pains"].items():
+        scores, shares = pain["scores"], pain["shares"]
+        first_index = next(index for index, share in enumerate(shares) if share is not None)
+        points = [(index, share or 0.0) for index, share in enumerate(shares) if index >= first_index]
+        slope = _slope(points) if len(points) > 1 else 0.0
+        direction = "stable"
+        if len(points) == 1 and first_index > 0:
+            direction = "new"
+        elif slope > TREND_STABLE_SLOPE:
+            direction = "rising"
+        elif slope < -TREND_STABLE_SLOPE:
+            direction = "falling"
+        trends.append({
+            "pain_key": key,
+            "pain_type": pain["pain_type"],
+            "direction": direction,
+            "slope": round(slope, 3),
+            "first_share": points[0][1],
+            "last_share": points[-1][1],
+            "scores": scores,
+            "shares": shares,
+        })
+
+    return {
+        "subreddit": subreddit,
+        "runs": series["runs"],
+        "rising": sorted((t for t in trends if t["direction"] in ("rising", "new")), key=lambda t: -t["slope"]),
+        "falling": sorted((t for t in trends if t["direction"] == "falling"), key=lambda t: t["slope"]),
+        "stable": [t for t in trends if t["direction"] == "stable"],
+    }
+
+
+# ===== BOUCLE DU PLANIFICATEUR =====
+
+async def run_scheduler(stop_event: asyncio.Event) -> None:
+    """
+    Boucle du planificateur : exécute les surveillances à échéance toutes les
+    WATCHLIST_POLL_SECONDS secondes, jusqu'à ce que stop_event soit levé
+    """
+    print(f"⏰ Planificateur de watchlist démarré (toutes les {WATCHLIST_POLL_SECONDS}s)")
+    while not stop_event.is_set():
+        try:
+            for watch in await asyncio.to_thread(_claim_due_watches):
+                print(f"⏰ Run planifié pour r/{watch['subreddit']}")
+                try:
+                    with use_lane(BATCH):
+                        result = await run_watch(watch)
+                    print(f"✅ Run r/{watch['subreddit']} terminé: {result.get('new_posts', 0)} nouveaux posts")
+                except Exception as e:
+                    print(f"❌ Erreur run planifié r/{watch['subreddit']}: {e}")
+        except Exception as e:
+            print(f"❌ Erreur planificateur: {e}")
+
+        try:
+            await asyncio.wait_for(stop_event.wait(), timeout=WATCHLIST_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
@@ -0,0 +1,224 @@
+"""
+Recherche plein texte (SQLite FTS5 du store local) sur les solutions stockées,
+les titres de posts et les commentaires scrapés.
+
+Les documents sont indexés au fil de l'eau (scraping, stockage d'une solution) et
+les solutions Supabase sont synchronisées de façon incrémentale au démarrage.
+"""
+import re
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+from core.local_store import get_connection
+
+SEARCH_KINDS = ("solution", "post", "comment")
+SEARCH_MAX_RESULTS = 50
+# Balises de surlignage des extraits (markdown, affiché tel quel dans le chat)
+HIGHLIGHT_OPEN = "**"
+HIGHLIGHT_CLOSE = "**"
+SNIPPET_TOKENS = 24
+# Poids BM25 par colonne (title, body, pain_type)
+BM25_WEIGHTS = (4.0, 1.0, 2.0)
+
+_UPSERT_SQL = """
+    INSERT INTO search_documents (doc_key, kind, subreddit, post_id, author, score, pain_type, title, body, indexed_at)
+    VALUES (:doc_key, :kind, :subreddit, :post_id, :author, :score, :pain_type, :title, :body, :indexed_at)
+    ON CONFLICT (doc_key) DO UPDATE SET
+        subreddit = excluded.subreddit, post_id = excluded.post_id, author = excluded.author,
+        score = excluded.score, pain_type = excluded.pain_type, title = excluded.title,
+        body = excluded.body, indexed_at = excluded.indexed_at
+"""
+
+_SOLUTIONS_SYNC_KEY = "search_solutions_last_id"
+
+
+# ===== INDEXATION =====
+
+def _index_documents(documents: Iterable[Dict[str, Any]]) -> int:
+    now = datetime.now(timezone.utc).isoformat()
+    rows = [{**document, "indexed_at": now} for document in documents if document["body"]]
+    if rows:
+        connection = get_connection()
+        connection.executemany(_UPSERT_SQL, rows)
+        connection.commit()
+    return len(rows)
+
+
+def _solution_document(solution: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "doc_key": f"solution:{solution['comment_id']}",
+        "kind": "solution",
+        "subreddit": solution.get("subreddit"),
+        "post_id": solution.get("post_id"),
+        "author": solution.get("author"),
+        "score": solution.get("score"),
+        "pain_type": solution.get("pain_type"),
+        "title": None,
+        "body": solution.get("solution_text") or "",
+    }
+
+
+def index_solutions(solutions: Iterable[Dict[str, Any]]) -> int:
+    """
+    Indexe (ou ré-indexe) des solutions stockées
+
+    Args:
+        solutions: Lignes au format de la table solutions
+
+    Returns:
+        Nombre de documents indexés
+    """
+    return _index_documents(_solution_document(solution) for solution in solutions)
+
+
+def index_scrape(scrape: Dict[str, Any]) -> int:
+    """
+    Indexe les posts (titre + texte) et les commentaires d'un résultat de scrape_posts
+
+    Returns:
+        Nombre de documents indexés
+    """
+    subreddit = scrape.get("subreddit")
+    documents = []
+    for post in scrape.get("posts", []):
+        documents.append({
+            "doc_key": f"post:{post['id']}",
+            "kind": "post",
+            "subreddit": subreddit,
+            "post_id": post["id"],
+            "author": post.get("author"),
+            "score": post.get("score"),
+            "pain_type": None,
+            "title": post.get("title"),
+            "body": post.get("selftext") or post.get("title") or "",
+        })
+        for comment in post.get("comments", []):
+            documents.append({
+                "doc_key": f"comment:{comment['id']}",
+                "kind": "comment",
+                "subreddit": subreddit,
+                "post_id": post["id"],
+                "author": comment.get("author"),
+                "score": comment.get("score"),
+                "pain_type": None,
+                "title": post.get("title"),
+                "body": comment.get("body") or "",
+            })
+    return _index_documents(documents)
+
+
+def sync_solutions_index() -> int:
+    """
+    Synchronise l'index avec la table Supabase solutions (uniquement les nouvelles lignes)
+
+    Returns:
+        Nombre de solutions indexées
+    """
+    # Import local : core.exports dépend de core.functions, qui dépend de ce module
+    from core.exports import iter_rows
+
+    connection = get_connection()
+    row = connection.execute("SELECT value FROM store_meta WHERE key = ?", (_SOLUTIONS_SYNC_KEY,)).fetchone()
+    last_id = int(row["value"]) if row else 0
+
+    indexed = 0
+    for page in iter_rows("solutions", after_id=last_id):
+        indexed += index_solutions(page)
+        last_id = page[-1]["id"]
+        connection.execute(
+            "INSERT INTO store_meta (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+            (_SOLUTIONS_SYNC_KEY, str(last_id)),
+        )
+        connection.commit()
+    return indexed
+
+
+# ===== RECHERCHE =====
+
+def build_match_query(query: str, match_all: bool = True) -> str:
+    """
+    Convertit une saisie libre en requête FTS5 sûre
+
+    Chaque mot devient un préfixe entre guillemets (aucune syntaxe FTS5 n'est interprétée).
+
+    Args:
+        query: Texte saisi
+        match_all: Tous les mots requis (AND) ou au moins un (OR)
+
+    Returns:
+        Expression MATCH, vide si la saisie ne contient aucun mot
+    """
+    words = re.findall(r"\w+", query.lower())
+    return f" {'AND' if match_all else 'OR'} ".join(f'"{word}"*' for word in words)
+
+
+def _run_search(match: str, kind: Optional[str], subreddit: Optional[str], limit: int) -> List[Dict[str, Any]]:
+    sql = f"""
+        SELECT d.kind, d.subreddit, d.post_id, d.author, d.score, d.pain_type, d.title, d.doc_key,
+               bm25(search_fts, {', '.join(map(str, BM25_WEIGHTS))}) AS rank,
+               snippet(search_fts, -1, ?, ?, '…', {SNIPPET_TOKENS}) AS snippet
+        FROM search_fts
+        JOIN search_documents d ON d.id = search_fts.rowid
+        WHERE search_fts MATCH ?
+    """
+    params: List[Any] = [HIGHLIGHT_OPEN, HIGHLIGHT_CLOSE, match]
+    if kind:
+        sql += " AND d.kind = ?"
+        params.append(kind)
+    if subreddit:
+        sql += " AND d.subreddit = ? COLLATE NOCASE"
+        params.append(subreddit)
+    sql += " ORDER BY rank LIMIT ?"
+    params.append(limit)
+
+    results = []
+    for row in get_connection().execute(sql, params):
+        result = dict(row)
+        result["id"] = result.pop("doc_key").split(":", 1)[1]
+        # bm25 est négatif (plus petit = plus pertinent) : on expose un score positif
+        result["rank"] = round(-result["rank"], 4)
+        results.append(result)
+    return results
+
+
+def search(
+    query: str,
+    kind: Optional[str] = None,
+    subreddit: Optional[str] = None,
+    limit: int = 20,
+) -> Dict[str, Any]:
+    """
+    Recherche classée (BM25) avec extraits surlignés
+
+    Tous les mots sont d'abord requis ; si rien ne correspond, on élargit à n'importe quel mot.
+
+    Args:
+        query: Texte recherché
+        kind: "solution", "post" ou "comment" (optionnel)
+        subreddit: Filtre sur le subreddit (optionnel)
+        limit: Nombre maximum de résultats
+
+    Returns:
+        Dict avec les résultats classés
+    """
+    if kind and kind not in SEARCH_KINDS:
+        return {"success": False, "error": f"Type inconnu: {kind} (types: {', '.join(SEARCH_KINDS)})"}
+
+    limit = max(1, min(limit, SEARCH_MAX_RESULTS))
+    match = build_match_query(query)
+    if not match:
+        return {"success": False, "error": "Requête vide"}
+
+    results = _run_search(match, kind, subreddit, limit)
+    broadened = False
+    if not results and " AND " in match:
+        results = _run_search(build_match_query(query, match_all=False), kind, subreddit, limit)
+        broadened = bool(results)
+
+    return {
+        "success": True,
+        "query": query,
+        "broadened": broadened,
+        "count": len(results),
+        "results": results,
+    }
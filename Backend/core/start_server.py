@@ -2,8 +2,8 @@
 """
 Script de démarrage simple pour l'API Reddit Analysis SaaS
 """
+import os
 import uvicorn
-from .api import app
 
 if __name__ == "__main__":
     print("🚀 Démarrage du serveur API...")
@@ -11,10 +11,11 @@ if __name__ == "__main__":
     print("📚 Documentation: http://localhost:8000/docs")
     print("=" * 50)
     
+    # Développement uniquement (RELOAD=true) ; en production : start_production.py
     uvicorn.run(
-        app,
+        "core.api:app",  # chaîne d'import : requise par reload
         host="127.0.0.1",  # localhost spécifiquement
         port=8000,
-        reload=True,
+        reload=os.getenv("RELOAD", "false").lower() == "true",
         log_level="info"
     ) 
\ No newline at end of file
@@ -0,0 +1,369 @@
+"""
+État partagé entre workers et réplicas : caches, état de session, verrous et files de jobs.
+
+Deux backends :
+- MemoryBackend : un seul processus (par défaut, aucun service externe)
+- RedisBackend : tout serveur parlant le protocole Redis (Redis, Valkey, KeyDB...),
+  activé avec STATE_BACKEND_URL=redis://... (paquet `redis` requis)
+
+Les valeurs sont sérialisées en JSON dans les deux cas : une valeur lue est toujours
+une copie, quel que soit le backend.
+"""
+import os
+import json
+import time
+import uuid
+import asyncio
+import threading
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Dict, Iterator, Optional
+
+from core.cache import TTLCache
+
+STATE_BACKEND_URL = os.getenv("STATE_BACKEND_URL", "")
+STATE_KEY_PREFIX = os.getenv("STATE_KEY_PREFIX", "ras:")
+STATE_MEMORY_MAX_ENTRIES = int(os.getenv("STATE_MEMORY_MAX_ENTRIES", "20000"))
+LOCK_POLL_INTERVAL = 0.05
+ASYNC_LOCK_POLL_INTERVAL = 0.5
+
+
+class StateBackend:
+    """Interface commune des backends d'état partagé"""
+
+    name = "base"
+
+    def get(self, key: str) -> Optional[Any]:
+        """Valeur de la clé, ou None si absente ou expirée"""
+        raise NotImplementedError
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        """Stocke une valeur JSON-sérialisable (sans expiration si ttl est None)"""
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def delete_prefix(self, prefix: str) -> int:
+        """Supprime toutes les clés commençant par prefix, retourne leur nombre"""
+        raise NotImplementedError
+
+    def incr_fields(self, key: str, amounts: Dict[str, float], ttl: Optional[float] = None) -> Dict[str, float]:
+        """Incrémente atomiquement des compteurs nommés, retourne tous les compteurs de la clé"""
+        raise NotImplementedError
+
+    def get_fields(self, key: str) -> Dict[str, float]:
+        """Compteurs de la clé ({} si absente)"""
+        raise NotImplementedError
+
+    @contextmanager
+    def lock(self, name: str, ttl: float = 60, wait: float = 60) -> Iterator[bool]:
+        """
+        Verrou exclusif entre workers (coalescence de calculs coûteux)
+
+        Args:
+            name: Nom du verrou
+            ttl: Durée de vie maximale du verrou (libéré si le détenteur meurt)
+            wait: Temps d'attente maximal pour l'obtenir
+
+        Yields:
+            True si le verrou est obtenu, False après `wait` secondes sans l'obtenir
+        """
+        raise NotImplementedError
+        yield False
+
+    @asynccontextmanager
+    async def alock(self, name: str, ttl: float = 60, wait: float = 60) -> AsyncIterator[bool]:
+        """
+        lock() depuis la boucle d'événements : chaque tentative et la libération passent
+        par un thread, l'attente entre deux tentatives est asynchrone
+
+        Yields:
+            True si le verrou est obtenu, False après `wait` secondes sans l'obtenir
+        """
+        deadline = time.monotonic() + wait
+        while True:
+            manager = self.lock(name, ttl=ttl, wait=0)
+            acquired = await asyncio.to_thread(manager.__enter__)
+            remaining = deadline - time.monotonic()
+            if acquired or remaining <= 0:
+                break
+            # Verrou non obtenu : la sortie ne touche pas au backend
+            manager.__exit__(None, None, None)
+            await asyncio.sleep(min(ASYNC_LOCK_POLL_INTERVAL, remaining))
+        try:
+            yield acquired
+        finally:
+            await asyncio.to_thread(manager.__exit__, None, None, None)
+
+    def push(self, queue: str, item: Any) -> None:
+        """Ajoute un job en fin de file"""
+        raise NotImplementedError
+
+    def pop(self, queue: str, timeout: float = 0) -> Optional[Any]:
+        """Retire le job en tête de file, en attendant au plus timeout secondes (None si vide)"""
+        raise NotImplementedError
+
+    def queue_length(self, queue: str) -> int:
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.name}
+
+
+class MemoryBackend(StateBackend):
+    """Backend mono-processus (thread-safe)"""
+
+    name = "memory"
+
+    def __init__(self, max_entries: int = STATE_MEMORY_MAX_ENTRIES):
+        self._store = TTLCache(max_entries=max_entries, default_ttl=float("inf"))
+        self._lock = threading.Lock()
+        self._locks: Dict[str, float] = {}
+        self._locks_changed = threading.Condition()
+        self._queues: Dict[str, deque] = {}
+        self._queues_changed = threading.Condition()
+
+    def get(self, key: str) -> Optional[Any]:
+        raw = self._store.get(key)
+        return None if raw is None else json.loads(raw)
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        self._store.set(key, json.dumps(value), ttl=ttl)
+
+    def delete(self, key: str) -> None:
+        self._store.delete(key)
+
+    def delete_prefix(self, prefix: str) -> int:
+        return self._store.delete_prefix(prefix)
+
+    def incr_fields(self, key: str, amounts: Dict[str, float], ttl: Optional[float] = None) -> Dict[str, float]:
+        with self._lock:
+            fields = self.get_fields(key)
+            for field, amount in amounts.items():
+                fields[field] = fields.get(field, 0) + amount
+            self.set(key, fields, ttl=ttl)
+            return dict(fields)
+
+    def get_fields(self, key: str) -> Dict[str, float]:
+        return self.get(key) or {}
+
+    @contextmanager
+    def lock(self, name: str, ttl: float = 60, wait: float = 60) -> Iterator[bool]:
+        deadline = time.monotonic() + wait
+        acquired = False
+        with self._locks_changed:
+            while True:
+                now = time.monotonic()
+                if self._locks.get(name, 0) < now:
+                    self._locks[name] = now + ttl
+                    acquired = True
+                    break
+                if now >= deadline:
+                    break
+                self._locks_changed.wait(min(deadline, self._locks[name]) - now)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                with self._locks_changed:
+                    self._locks.pop(name, None)
+                    self._locks_changed.notify_all()
+
+    def push(self, queue: str, item: Any) -> None:
+        with self._queues_changed:
+            self._queues.setdefault(queue, deque()).append(json.dumps(item))
+            self._queues_changed.notify_all()
+
+    def pop(self, queue: str, timeout: float = 0) -> Optional[Any]:
+        deadline = time.monotonic() + timeout
+        with self._queues_changed:
+            while not self._queues.get(queue):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._queues_changed.wait(remaining)
+            return json.loads(self._queues[queue].popleft())
+
+    def queue_length(self, queue: str) -> int:
+        with self._queues_changed:
+            return len(self._queues.get(queue, ()))
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.name, **self._store.stats()}
+
+
+class RedisBackend(StateBackend):
+    """
+    Backend partagé sur le protocole Redis
+
+    Args:
+        url: URL de connexion (redis://, rediss://, unix://)
+        client: Client déjà construit (ex: fakeredis.FakeRedis(decode_responses=True))
+        prefix: Préfixe des clés (plusieurs applications sur un même serveur)
+    """
+
+    name = "redis"
+
+    def __init__(self, url: Optional[str] = None, client: Any = None, prefix: str = STATE_KEY_PREFIX):
+        if client is None:
+            try:
+                import redis
+            except ImportError as e:
+                raise ImportError("STATE_BACKEND_URL nécessite le paquet 'redis' (pip install redis)") from e
+            client = redis.Redis.from_url(url, decode_responses=True, health_check_interval=30)
+        self.client = client
+        self.prefix = prefix
+
+    def _key(self, key: str) -> str:
+        return self.prefix + key
+
+    def get(self, key: str) -> Optional[Any]:
+        raw = self.client.get(self._key(key))
+        return None if raw is None else json.loads(raw)
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        self.client.set(self._key(key), json.dumps(value), px=int(ttl * 1000) if ttl else None)
+
+    def delete(self, key: str) -> None:
+        self.client.delete(self._key(key))
+
+    def delete_prefix(self, prefix: str) -> int:
+        deleted = 0
+        batch = []
+        # SCAN plutôt que KEYS : ne bloque pas le serveur sur une grosse base
+        for key in self.client.scan_iter(match=self._key(prefix) + "*", count=500):
+            batch.append(key)
+            if len(batch) >= 500:
+                deleted += self.client.delete(*batch)
+                batch = []
+        if batch:
+            deleted += self.client.delete(*batch)
+        return deleted
+
+    def incr_fields(self, key: str, amounts: Dict[str, float], ttl: Optional[float] = None) -> Dict[str, float]:
+        full_key = self._key(key)
+        pipeline = self.client.pipeline(transaction=True)
+        for field, amount in amounts.items():
+            pipeline.hincrbyfloat(full_key, field, amount)
+        if ttl:
+            pipeline.pexpire(full_key, int(ttl * 1000))
+        pipeline.hgetall(full_key)
+        return {field: float(value) for field, value in pipeline.execute()[-1].items()}
+
+    def get_fields(self, key: str) -> Dict[str, float]:
+        return {field: float(value) for field, value in self.client.hgetall(self._key(key)).items()}
+
+    @contextmanager
+    def lock(self, name: str, ttl: float = 60, wait: float = 60) -> Iterator[bool]:
+        # SET NX PX avec un jeton propre au détenteur ; libération par WATCH/MULTI
+        # (pas de script Lua : fonctionne aussi avec les serveurs / fakes sans scripting)
+        key = self._key("lock:" + name)
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + wait
+        acquired = bool(self.client.set(key, token, nx=True, px=int(ttl * 1000)))
+        while not acquired and time.monotonic() < deadline:
+            time.sleep(LOCK_POLL_INTERVAL)
+            acquired = bool(self.client.set(key, token, nx=True, px=int(ttl * 1000)))
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                self._release(key, token)
+
+    def _release(self, key: str, token: str) -> None:
+        with self.client.pipeline(transaction=True) as pipeline:
+            try:
+                pipeline.watch(key)
+                # Verrou expiré puis repris par un autre worker : on n'y touche pas
+                if pipeline.get(key) == token:
+                    pipeline.multi()
+                    pipeline.delete(key)
+                    pipeline.execute()
+            except Exception as e:
+                print(f"Erreur libération du verrou {key}: {e}")
+
+    def push(self, queue: str, item: Any) -> None:
+        self.client.rpush(self._key("queue:" + queue), json.dumps(item))
+
+    def pop(self, queue: str, timeout: float = 0) -> Optional[Any]:
+        key = self._key("queue:" + queue)
+        if timeout > 0:
+            result = self.client.blpop([key], timeout=timeout)
+            raw = result[1] if result else None
+        else:
+            raw = self.client.lpop(key)
+        return None if raw is None else json.loads(raw)
+
+    def queue_length(self, queue: str) -> int:
+        return self.client.llen(self._key("queue:" + queue))
+
+
+_backend: Optional[StateBackend] = None
+_backend_lock = threading.Lock()
+
+
+def shared_state_configured() -> bool:
+    """True si STATE_BACKEND_URL désigne un serveur partagé entre processus"""
+    return bool(STATE_BACKEND_URL) and not STATE_BACKEND_URL.startswith("memory://")
+
+
+def get_state_backend() -> StateBackend:
+    """Backend d'état partagé du processus (choisi par STATE_BACKEND_URL)"""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            if shared_state_configured():
+                _backend = RedisBackend(STATE_BACKEND_URL)
+            else:
+                _backend = MemoryBackend()
+            print(f"🗄️ Backend d'état partagé: {_backend.name}")
+        return _backend
+
+
+def set_state_backend(backend: StateBackend) -> None:
+    """Remplace le backend du processus (ex: serveur local ou fakeredis)"""
+    global _backend
+    with _backend_lock:
+        _backend = backend
+
+
+class SharedCache:
+    """
+    Cache à TTL stocké dans le backend d'état partagé (même interface que TTLCache)
+
+    Les compteurs hits / misses sont propres au processus.
+
+    Args:
+        namespace: Espace de noms des clés (ex: "subreddit")
+        default_ttl: TTL par défaut en secondes
+    """
+
+    def __init__(self, namespace: str, default_ttl: float):
+        self.namespace = namespace
+        self.default_ttl = default_ttl
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, key: str) -> str:
+        return f"cache:{self.namespace}:{key}"
+
+    def get(self, key: str) -> Optional[Any]:
+        value = get_state_backend().get(self._key(key))
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        get_state_backend().set(self._key(key), value, ttl=self.default_ttl if ttl is None else ttl)
+
+    def delete(self, key: str) -> None:
+        get_state_backend().delete(self._key(key))
+
+    def clear(self) -> None:
+        get_state_backend().delete_prefix(f"cache:{self.namespace}:")
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": get_state_backend().name, "hits": self.hits, "misses": self.misses}
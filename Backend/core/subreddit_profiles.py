@@ -0,0 +1,273 @@
+"""
+Profils matérialisés des subreddits, servis en stale-while-revalidate.
+
+Un profil regroupe les métadonnées du subreddit, les dernières douleurs principales
+(scores), les meilleures solutions stockées et le dernier rapport d'analyse. Il est
+stocké dans le store local (table subreddit_profiles) et servi tel quel, même un peu
+ancien : au-delà de PROFILE_STALE_SECONDS, la lecture renvoie le profil existant et
+lance un rafraîchissement en arrière-plan (voie batch, un seul à la fois par subreddit,
+tous workers confondus).
+
+Les subreddits populaires (au moins PROFILE_POPULAR_MIN_REQUESTS lectures depuis le
+dernier rafraîchissement) sont rafraîchis régulièrement par run_profile_refresher,
+dès qu'ils vont devenir périmés avant le passage suivant : un client ne tombe pas sur
+un profil périmé.
+
+Le calcul d'un profil (premier calcul ou rafraîchissement) est protégé par le verrou
+partagé profile_refresh:<subreddit> : un seul calcul à la fois par subreddit.
+"""
+import os
+import json
+import asyncio
+import contextvars
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from core.db import execute, get_db
+from core.deadlines import ANALYSIS_DEADLINE_SECONDS, run_with_deadline
+from core.functions import get_subreddit_info
+from core.lanes import BATCH, use_lane
+from core.local_store import get_connection
+from core.pipeline import scrape_and_analyze
+from core.state import get_state_backend
+from core.usage import tracked_analysis
+
+PROFILE_STALE_SECONDS = float(os.getenv("PROFILE_STALE_SECONDS", "21600"))  # 6 h
+PROFILE_NUM_POSTS = int(os.getenv("PROFILE_NUM_POSTS", "25"))
+PROFILE_COMMENTS_LIMIT = int(os.getenv("PROFILE_COMMENTS_LIMIT", "5"))
+PROFILE_TOP_PAINS = int(os.getenv("PROFILE_TOP_PAINS", "10"))
+PROFILE_TOP_SOLUTIONS = int(os.getenv("PROFILE_TOP_SOLUTIONS", "5"))
+PROFILE_REFRESH_ENABLED = os.getenv("PROFILE_REFRESH_ENABLED", "true").lower() == "true"
+PROFILE_REFRESH_POLL_SECONDS = int(os.getenv("PROFILE_REFRESH_POLL_SECONDS", "600"))
+PROFILE_POPULAR_MIN_REQUESTS = int(os.getenv("PROFILE_POPULAR_MIN_REQUESTS", "3"))
+PROFILE_REFRESH_BATCH = int(os.getenv("PROFILE_REFRESH_BATCH", "2"))  # rafraîchissements par passage
+
+# Rafraîchissements en cours dans ce worker (références gardées jusqu'à la fin des tâches)
+_refreshing: Dict[str, asyncio.Task] = {}
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _normalize(subreddit: str) -> str:
+    return subreddit.strip().removeprefix("/").removeprefix("r/")
+
+
+def _read_profile(subreddit: str, count_request: bool) -> Optional[Dict[str, Any]]:
+    connection = get_connection()
+    row = connection.execute(
+        "SELECT profile, refreshed_at, requests FROM subreddit_profiles WHERE subreddit = ?", (subreddit,)
+    ).fetchone()
+    if row is None:
+        return None
+    if count_request:
+        connection.execute(
+            "UPDATE subreddit_profiles SET requests = requests + 1, last_requested_at = ? WHERE subreddit = ?",
+            (_now().isoformat(), subreddit),
+        )
+        connection.commit()
+    profile = json.loads(row["profile"])
+    age = (_now() - datetime.fromisoformat(row["refreshed_at"])).total_seconds()
+    profile.update({
+        "refreshed_at": row["refreshed_at"],
+        "age_seconds": round(age),
+        "stale": age > PROFILE_STALE_SECONDS,
+        "requests_since_refresh": row["requests"] + int(count_request),
+    })
+    return profile
+
+
+def _write_profile(subreddit: str, profile: Dict[str, Any]) -> None:
+    connection = get_connection()
+    connection.execute(
+        """
+        INSERT INTO subreddit_profiles (subreddit, profile, refreshed_at, requests)
+        VALUES (?, ?, ?, 0)
+        ON CONFLICT (subreddit) DO UPDATE SET
+            profile = excluded.profile, refreshed_at = excluded.refreshed_at, requests = 0
+        """,
+        (subreddit, json.dumps(profile, ensure_ascii=False), _now().isoformat()),
+    )
+    connection.commit()
+
+
+async def _top_solutions(subreddit: str) -> List[Dict[str, Any]]:
+    db = await get_db()
+    result = await execute(
+        db.table("solutions")
+        .select("id, author, solution_text, score, pain_type, intensity, created_at")
+        .eq("subreddit", subreddit)
+        .order("score", desc=True)
+        .limit(PROFILE_TOP_SOLUTIONS)
+    )
+    return result.data
+
+
+async def _last_report(subreddit: str) -> Optional[Dict[str, Any]]:
+    db = await get_db()
+    result = await execute(
+        db.table("analysis_reports")
+        .select("id, num_posts, comments_limit, sort_criteria, time_filter, report, created_at")
+        .eq("subreddit", subreddit)
+        .order("created_at", desc=True)
+        .limit(1)
+    )
+    return result.data[0] if result.data else None
+
+
+async def build_profile(subreddit: str) -> Dict[str, Any]:
+    """
+    Calcule et enregistre le profil d'un subreddit (scraping + analyse des douleurs)
+
+    Args:
+        subreddit: Nom du subreddit (sans le 'r/')
+
+    Returns:
+        Dict avec "success" et le profil enregistré, ou "error"
+    """
+    subreddit = _normalize(subreddit)
+    info = await asyncio.to_thread(get_subreddit_info, subreddit)
+    if not info["exists"]:
+        return {"success": False, "subreddit": subreddit, "error": info.get("error", f"r/{subreddit} introuvable")}
+
+    with use_lane(BATCH):
+        async with tracked_analysis(f"profile_{subreddit}"):
+            scrape, analysis = await scrape_and_analyze(
+                subreddit, PROFILE_NUM_POSTS, "top", PROFILE_COMMENTS_LIMIT, "month"
+            )
+        solutions, report = await asyncio.gather(_top_solutions(subreddit), _last_report(subreddit))
+    if not scrape["success"]:
+        return {"success": False, "subreddit": subreddit, "error": scrape.get("error", "Scraping impossible")}
+
+    pains = sorted(analysis.get("top_pains", []), key=lambda pain: pain.get("score") or 0, reverse=True)
+    if not pains:
+        # Analyse vide ou interrompue trop tôt : on garde le profil existant
+        return {"success": False, "subreddit": subreddit, "error": "Aucune douleur extraite, profil non mis à jour"}
+    profile = {
+        "subreddit": info.get("subreddit", subreddit),
+        "info": {key: info.get(key) for key in ("title", "description", "subscribers", "url")},
+        "top_pains": pains[:PROFILE_TOP_PAINS],
+        "posts_analyzed": len(scrape["posts"]),
+        "partial": bool(analysis.get("partial")),
+        "top_solutions": solutions,
+        "last_report": report,
+    }
+    await asyncio.to_thread(_write_profile, subreddit, profile)
+    print(f"🧩 Profil r/{subreddit} rafraîchi ({len(profile['top_pains'])} douleurs)")
+    return {"success": True, "refreshing": False, **await asyncio.to_thread(_read_profile, subreddit, False)}
+
+
+def _lock_name(subreddit: str) -> str:
+    return f"profile_refresh:{subreddit.lower()}"
+
+
+async def build_missing_profile(subreddit: str) -> Dict[str, Any]:
+    """
+    Premier calcul d'un profil : les demandes simultanées pour un même subreddit
+    attendent le calcul en cours (tous workers) au lieu d'en lancer chacune un
+
+    Returns:
+        Le profil, ou le résultat en échec de build_profile
+    """
+    name = _normalize(subreddit)
+    lock = get_state_backend().alock(_lock_name(name), ttl=ANALYSIS_DEADLINE_SECONDS, wait=ANALYSIS_DEADLINE_SECONDS)
+    async with lock as acquired:
+        # Calculé pendant l'attente du verrou par une autre requête
+        profile = await asyncio.to_thread(_read_profile, name, False)
+        if profile is not None:
+            return {**profile, "success": True, "refreshing": False}
+        if not acquired:
+            return {"success": False, "subreddit": name, "error": f"Calcul du profil r/{name} déjà en cours"}
+        return await build_profile(name)
+
+
+async def _refresh(subreddit: str) -> None:
+    # Un seul rafraîchissement par subreddit, tous workers confondus
+    async with get_state_backend().alock(_lock_name(subreddit), ttl=ANALYSIS_DEADLINE_SECONDS, wait=0) as acquired:
+        if not acquired:
+            return
+        try:
+            result = await run_with_deadline(lambda: build_profile(subreddit), ANALYSIS_DEADLINE_SECONDS)
+            if not result["success"]:
+                print(f"⚠️ Profil r/{subreddit} non rafraîchi: {result['error']}")
+        except Exception as e:
+            print(f"❌ Erreur rafraîchissement du profil r/{subreddit}: {e}")
+
+
+def refresh_in_background(subreddit: str) -> None:
+    """Lance le rafraîchissement d'un profil s'il n'est pas déjà en cours dans ce worker"""
+    name = _normalize(subreddit)
+    key = name.lower()
+    task = _refreshing.get(key)
+    if task is not None and not task.done():
+        return
+    # Contexte vierge : la tâche survit à la requête, sans son délai, son suivi d'usage ni son profil
+    task = asyncio.create_task(_refresh(name), context=contextvars.Context())
+    _refreshing[key] = task
+
+    def forget(done: asyncio.Task) -> None:
+        if _refreshing.get(key) is done:
+            del _refreshing[key]
+
+    task.add_done_callback(forget)
+
+
+async def get_profile(subreddit: str, build_missing: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    Profil d'un subreddit, servi immédiatement depuis le store local
+
+    Un profil périmé est renvoyé tel quel ("stale": True) pendant qu'un rafraîchissement
+    tourne en arrière-plan ("refreshing": True).
+
+    Args:
+        subreddit: Nom du subreddit
+        build_missing: Calcule le profil s'il n'existe pas encore (analyse complète)
+
+    Returns:
+        Le profil, ou None s'il n'existe pas (et build_missing est False)
+    """
+    name = _normalize(subreddit)
+    profile = await asyncio.to_thread(_read_profile, name, True)
+    if profile is None:
+        if not build_missing:
+            return None
+        return await build_missing_profile(name)
+    if profile["stale"]:
+        refresh_in_background(name)
+    profile["success"] = True
+    profile["refreshing"] = profile["stale"]
+    return profile
+
+
+def _due_popular_profiles() -> List[str]:
+    # Profils périmés avant le prochain passage : rafraîchis dès maintenant
+    threshold = (_now() - timedelta(seconds=max(PROFILE_STALE_SECONDS - PROFILE_REFRESH_POLL_SECONDS, 0))).isoformat()
+    rows = get_connection().execute(
+        """
+        SELECT subreddit FROM subreddit_profiles
+        WHERE refreshed_at < ? AND requests >= ?
+        ORDER BY requests DESC LIMIT ?
+        """,
+        (threshold, PROFILE_POPULAR_MIN_REQUESTS, PROFILE_REFRESH_BATCH),
+    ).fetchall()
+    return [row["subreddit"] for row in rows]
+
+
+async def run_profile_refresher(stop_event: asyncio.Event) -> None:
+    """
+    Boucle de rafraîchissement des profils populaires, toutes les
+    PROFILE_REFRESH_POLL_SECONDS secondes, jusqu'à ce que stop_event soit levé
+    """
+    print(f"🧩 Rafraîchissement des profils populaires démarré (toutes les {PROFILE_REFRESH_POLL_SECONDS}s)")
+    while not stop_event.is_set():
+        try:
+            for subreddit in await asyncio.to_thread(_due_popular_profiles):
+                await _refresh(subreddit)
+        except Exception as e:
+            print(f"❌ Erreur rafraîchissement des profils: {e}")
+
+        try:
+            await asyncio.wait_for(stop_event.wait(), timeout=PROFILE_REFRESH_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
@@ -0,0 +1,422 @@
+"""
+Comptabilité des tokens et des coûts par session et par analyse,
+avec budgets (tokens / tours LLM) qui interrompent proprement un run.
+"""
+import os
+import uuid
+import asyncio
+import contextvars
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, Optional
+
+from agents import Agent, Runner, RunConfig, RunHooks, RunContextWrapper
+from agents.exceptions import AgentsException, MaxTurnsExceeded
+from agents.models.interface import Model, ModelProvider
+from agents.models.multi_provider import MultiProvider
+from agents.result import RunResult
+from agents.usage import Usage
+
+from core.db import execute, get_db
+from core.profiling import span
+from core.resilience import acall_with_retry, is_retryable, openai_breaker
+from core.deadlines import DeadlineExceeded
+from core.state import get_state_backend
+
+# Limites par analyse (0 = pas de limite)
+MAX_TOKENS_PER_ANALYSIS = int(os.getenv("MAX_TOKENS_PER_ANALYSIS", "200000"))
+MAX_TURNS_PER_ANALYSIS = int(os.getenv("MAX_TURNS_PER_ANALYSIS", "40"))
+# Limite cumulée par session (0 = pas de limite)
+MAX_TOKENS_PER_SESSION = int(os.getenv("MAX_TOKENS_PER_SESSION", "0"))
+
+# Tarifs gpt-4o-mini en dollars par million de tokens
+INPUT_COST_PER_1M = float(os.getenv("OPENAI_INPUT_COST_PER_1M", "0.15"))
+OUTPUT_COST_PER_1M = float(os.getenv("OPENAI_OUTPUT_COST_PER_1M", "0.60"))
+
+# Totaux par session dans l'état partagé (compteurs atomiques, communs à tous les workers)
+SESSION_USAGE_TTL = 30 * 24 * 3600
+_SESSION_COUNTERS = ("analyses", "requests", "input_tokens", "output_tokens", "total_tokens")
+
+# Tracker de l'analyse en cours, propagé aux sous-runs des agents-tools
+_current_tracker: contextvars.ContextVar[Optional["UsageTracker"]] = contextvars.ContextVar(
+    "current_usage_tracker", default=None
+)
+
+
+class BudgetExceededError(AgentsException):
+    """Levée quand une analyse dépasse son budget de tokens ou de tours"""
+
+    def __init__(self, message: str, usage: Dict[str, Any]):
+        super().__init__(message)
+        self.message = message
+        self.usage = usage
+
+
+def estimate_cost(input_tokens: int, output_tokens: int) -> float:
+    """
+    Estime le coût en dollars d'un volume de tokens
+
+    Args:
+        input_tokens: Tokens envoyés au modèle
+        output_tokens: Tokens générés par le modèle
+
+    Returns:
+        Coût estimé en dollars
+    """
+    cost = (input_tokens * INPUT_COST_PER_1M + output_tokens * OUTPUT_COST_PER_1M) / 1_000_000
+    return round(cost, 6)
+
+
+def _usage_to_dict(usage: Usage) -> Dict[str, Any]:
+    return {
+        "requests": usage.requests,
+        "input_tokens": usage.input_tokens,
+        "output_tokens": usage.output_tokens,
+        "total_tokens": usage.total_tokens,
+        "cost_usd": estimate_cost(usage.input_tokens, usage.output_tokens),
+    }
+
+
+class UsageTracker:
+    """
+    Agrège l'usage de tous les Runner.run d'une analyse (run principal et sous-runs des tools)
+    et fait respecter les budgets.
+    """
+
+    def __init__(
+        self,
+        session_id: str,
+        max_tokens: int = MAX_TOKENS_PER_ANALYSIS,
+        max_turns: int = MAX_TURNS_PER_ANALYSIS,
+    ):
+        self.session_id = session_id
+        self.analysis_id = uuid.uuid4().hex
+        self.max_tokens = max_tokens
+        self.max_turns = max_turns
+        self.started_at = datetime.now()
+        self.by_agent: Dict[str, Usage] = {}
+        # Dernière sortie de chaque tool terminé (résultats partiels si l'analyse est interrompue)
+        self.tool_outputs: Dict[str, str] = {}
+        # Usage des runs terminés + usage vivant des runs en cours (mis à jour par le SDK)
+        self._finished = Usage()
+        self._active: Dict[int, Usage] = {}
+
+    # ----- Suivi des runs -----
+
+    def attach(self, context: RunContextWrapper) -> None:
+        """Enregistre le compteur d'usage vivant d'un run en cours"""
+        self._active.setdefault(id(context), context.usage)
+
+    def detach(self, context: RunContextWrapper) -> None:
+        """Transfère l'usage d'un run terminé (ou interrompu) dans les totaux"""
+        usage = self._active.pop(id(context), None)
+        if usage is not None:
+            self._finished.add(usage)
+
+    def attribute(self, agent_name: str, usage: Usage) -> None:
+        """Impute une portion d'usage à un agent"""
+        self.by_agent.setdefault(agent_name, Usage()).add(usage)
+
+    @property
+    def total(self) -> Usage:
+        total = Usage()
+        total.add(self._finished)
+        for usage in self._active.values():
+            total.add(usage)
+        return total
+
+    # ----- Budgets -----
+
+    def remaining_turns(self) -> Optional[int]:
+        """Nombre de tours LLM encore autorisés (None si illimité)"""
+        if not self.max_turns:
+            return None
+        return max(self.max_turns - self.total.requests, 0)
+
+    def extend_budget(self, tokens: int, turns: int) -> None:
+        """Augmente les budgets de l'analyse (un budget illimité le reste)"""
+        if self.max_tokens:
+            self.max_tokens += tokens
+        if self.max_turns:
+            self.max_turns += turns
+
+    async def check_budget(self) -> None:
+        """
+        Vérifie les budgets de l'analyse et de la session
+
+        Raises:
+            BudgetExceededError: si un budget est dépassé
+        """
+        total = self.total
+        if self.max_tokens and total.total_tokens > self.max_tokens:
+            raise BudgetExceededError(
+                f"Budget de tokens dépassé ({total.total_tokens}/{self.max_tokens})", self.to_dict()
+            )
+        if self.max_turns and total.requests > self.max_turns:
+            raise BudgetExceededError(
+                f"Budget de tours dépassé ({total.requests}/{self.max_turns})", self.to_dict()
+            )
+        if MAX_TOKENS_PER_SESSION:
+            session_usage = await asyncio.to_thread(get_session_usage, self.session_id)
+            session_tokens = session_usage["total_tokens"] + total.total_tokens
+            if session_tokens > MAX_TOKENS_PER_SESSION:
+                raise BudgetExceededError(
+                    f"Budget de tokens de la session dépassé ({session_tokens}/{MAX_TOKENS_PER_SESSION})",
+                    self.to_dict(),
+                )
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Résumé sérialisable de l'usage de l'analyse"""
+        return {
+            "analysis_id": self.analysis_id,
+            "session_id": self.session_id,
+            **_usage_to_dict(self.total),
+            "limits": {"max_tokens": self.max_tokens, "max_turns": self.max_turns},
+            "by_agent": {name: _usage_to_dict(usage) for name, usage in self.by_agent.items()},
+        }
+
+
+def _delta(current: Usage, mark: Usage) -> Usage:
+    return Usage(
+        requests=current.requests - mark.requests,
+        input_tokens=current.input_tokens - mark.input_tokens,
+        output_tokens=current.output_tokens - mark.output_tokens,
+        total_tokens=current.total_tokens - mark.total_tokens,
+    )
+
+
+class BudgetHooks(RunHooks):
+    """
+    Hooks d'un Runner.run : rattachent le run au tracker, imputent l'usage à chaque agent
+    (handoffs compris) et contrôlent le budget à chaque étape.
+    """
+
+    def __init__(self, tracker: UsageTracker):
+        self.tracker = tracker
+        self.context: Optional[RunContextWrapper] = None
+        self._agent_name: Optional[str] = None
+        self._mark = Usage()
+
+    def _switch_agent(self, agent_name: Optional[str]) -> None:
+        if self.context is not None and self._agent_name is not None:
+            self.tracker.attribute(self._agent_name, _delta(self.context.usage, self._mark))
+            self._mark = Usage()
+            self._mark.add(self.context.usage)
+        self._agent_name = agent_name
+
+    def finish(self) -> None:
+        """Clôt le run : impute le reliquat et transfère l'usage dans les totaux"""
+        self._switch_agent(None)
+        if self.context is not None:
+            self.tracker.detach(self.context)
+
+    async def on_agent_start(self, context: RunContextWrapper, agent: Agent) -> None:
+        if self.context is None:
+            self.context = context
+            self.tracker.attach(context)
+        self._switch_agent(agent.name)
+        await self.tracker.check_budget()
+
+    async def on_handoff(self, context: RunContextWrapper, from_agent: Agent, to_agent: Agent) -> None:
+        await self.tracker.check_budget()
+
+    async def on_tool_start(self, context: RunContextWrapper, agent: Agent, tool: Any) -> None:
+        await self.tracker.check_budget()
+
+    async def on_tool_end(self, context: RunContextWrapper, agent: Agent, tool: Any, result: str) -> None:
+        self.tracker.tool_outputs[tool.name] = str(result)
+        await self.tracker.check_budget()
+
+
+def get_current_tracker() -> Optional[UsageTracker]:
+    """Retourne le tracker de l'analyse en cours, s'il existe"""
+    return _current_tracker.get()
+
+
+def start_tracking(tracker: UsageTracker) -> contextvars.Token:
+    """Active un tracker pour la tâche courante (et ses sous-tâches)"""
+    return _current_tracker.set(tracker)
+
+
+def stop_tracking(token: contextvars.Token) -> None:
+    """Désactive le tracker activé par start_tracking"""
+    _current_tracker.reset(token)
+
+
+class _BreakerModel(Model):
+    """
+    Modèle dont chaque appel passe par le disjoncteur OpenAI
+
+    Le disjoncteur protège chaque appel modèle, pas le run entier : un appel test dure
+    le temps d'une réponse du modèle, et les sous-runs des agents-tools ne sont pas
+    refusés pendant que le run parent tient la place d'appel test.
+    """
+
+    def __init__(self, model: Model, name: str):
+        self._model = model
+        self._name = name
+
+    async def get_response(self, *args: Any, **kwargs: Any) -> Any:
+        # Pas de nouvelle tentative ici : le client openai retente déjà les erreurs transitoires
+        return await acall_with_retry(
+            openai_breaker, lambda: self._model.get_response(*args, **kwargs), retry=False, label=self._name
+        )
+
+    async def stream_response(self, *args: Any, **kwargs: Any) -> AsyncIterator[Any]:
+        openai_breaker.before_call()
+        try:
+            async for event in self._model.stream_response(*args, **kwargs):
+                yield event
+        except BaseException as error:
+            if isinstance(error, Exception) and is_retryable(error):
+                openai_breaker.record_failure()
+            else:
+                openai_breaker.abandon_call()
+            raise
+        openai_breaker.record_success()
+
+
+class _BreakerModelProvider(ModelProvider):
+    """Fournisseur de modèles par défaut du SDK, avec disjoncteur sur chaque appel"""
+
+    def __init__(self):
+        self._provider = MultiProvider()
+
+    def get_model(self, model_name: Optional[str]) -> Model:
+        return _BreakerModel(self._provider.get_model(model_name), model_name or "model")
+
+
+_model_provider = _BreakerModelProvider()
+
+
+async def _run_agent(agent: Agent, input: Any, **kwargs: Any) -> RunResult:
+    # Pas de nouvelle tentative sur le run : il n'est pas idempotent (outils d'écriture)
+    with span(f"agent:{agent.name}"):
+        return await Runner.run(agent, input, run_config=RunConfig(model_provider=_model_provider), **kwargs)
+
+
+async def run_tracked(agent: Agent, input: Any, context: Any = None) -> RunResult:
+    """
+    Runner.run avec comptabilité et budgets de l'analyse en cours
+
+    Args:
+        agent: Agent de départ
+        input: Entrée du run
+        context: Contexte utilisateur transmis au SDK
+
+    Returns:
+        Le RunResult du SDK
+
+    Raises:
+        BudgetExceededError: si le budget de l'analyse est dépassé
+        DependencyUnavailable: si le disjoncteur OpenAI est ouvert
+    """
+    tracker = get_current_tracker()
+    if tracker is None:
+        return await _run_agent(agent, input, context=context)
+
+    await tracker.check_budget()
+    hooks = BudgetHooks(tracker)
+    kwargs: Dict[str, Any] = {"context": context, "hooks": hooks}
+    remaining_turns = tracker.remaining_turns()
+    if remaining_turns is not None:
+        kwargs["max_turns"] = max(remaining_turns, 1)
+
+    try:
+        return await _run_agent(agent, input, **kwargs)
+    finally:
+        # Exécuté aussi quand le run est interrompu (budget, erreur, annulation)
+        hooks.finish()
+
+
+def _session_summary(counters: Dict[str, float]) -> Dict[str, Any]:
+    totals = {name: int(counters.get(name, 0)) for name in _SESSION_COUNTERS}
+    totals["cost_usd"] = estimate_cost(totals["input_tokens"], totals["output_tokens"])
+    return totals
+
+
+def record_session_usage(tracker: UsageTracker) -> Dict[str, Any]:
+    """
+    Ajoute l'usage d'une analyse terminée aux totaux de sa session
+
+    Returns:
+        Totaux cumulés de la session
+    """
+    usage = tracker.total
+    counters = get_state_backend().incr_fields(
+        f"usage:{tracker.session_id}",
+        {
+            "analyses": 1,
+            "requests": usage.requests,
+            "input_tokens": usage.input_tokens,
+            "output_tokens": usage.output_tokens,
+            "total_tokens": usage.total_tokens,
+        },
+        ttl=SESSION_USAGE_TTL,
+    )
+    return _session_summary(counters)
+
+
+def get_session_usage(session_id: str) -> Dict[str, Any]:
+    """Totaux cumulés d'une session (zéros si inconnue)"""
+    return _session_summary(get_state_backend().get_fields(f"usage:{session_id}"))
+
+
+async def persist_usage(tracker: UsageTracker, status: str) -> None:
+    """
+    Sauvegarde l'usage d'une analyse dans la table Supabase usage_records
+    """
+    usage = tracker.to_dict()
+    try:
+        db = await get_db()
+        await execute(db.table("usage_records").insert({
+            "analysis_id": usage["analysis_id"],
+            "session_id": usage["session_id"],
+            "status": status,
+            "requests": usage["requests"],
+            "input_tokens": usage["input_tokens"],
+            "output_tokens": usage["output_tokens"],
+            "total_tokens": usage["total_tokens"],
+            "cost_usd": usage["cost_usd"],
+            "by_agent": usage["by_agent"],
+            "started_at": tracker.started_at.isoformat(),
+        }), write=True)
+    except Exception as e:
+        print(f"Erreur sauvegarde usage: {e}")
+
+
+@asynccontextmanager
+async def tracked_analysis(
+    session_id: str,
+    max_tokens: int = MAX_TOKENS_PER_ANALYSIS,
+    max_turns: int = MAX_TURNS_PER_ANALYSIS,
+) -> AsyncIterator[UsageTracker]:
+    """
+    Suit une analyse hors run_chat (comparaison, planification...) : active le tracker,
+    puis cumule et persiste l'usage à la sortie, avec le statut de fin.
+
+    Usage:
+        async with tracked_analysis(session_id) as tracker:
+            await analyze_pains(scrape_data)
+    """
+    tracker = UsageTracker(session_id, max_tokens=max_tokens, max_turns=max_turns)
+    token = start_tracking(tracker)
+    status = "success"
+    try:
+        yield tracker
+    except (BudgetExceededError, MaxTurnsExceeded):
+        status = "budget_exceeded"
+        raise
+    except DeadlineExceeded:
+        status = "timeout"
+        raise
+    except asyncio.CancelledError:
+        status = "cancelled"
+        raise
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        stop_tracking(token)
+        await asyncio.to_thread(record_session_usage, tracker)
+        await persist_usage(tracker, status)
@@ -0,0 +1,144 @@
+"""
+Ressources propres à chaque worker du serveur de production.
+
+- Clients externes (Reddit, OpenAI, Supabase) construits paresseusement, une fois par
+  processus : rien n'est partagé à travers un fork et un worker n'ouvre ses pools
+  de connexions qu'au premier appel.
+- Recyclage d'un worker dont la mémoire dépasse WORKER_MAX_MEMORY_MB (le recyclage
+  après N requêtes est géré par gunicorn, cf. gunicorn.conf.py).
+- Tâches de fond (planificateur, profils, index de recherche) dans un seul worker.
+"""
+import os
+import signal
+import threading
+from typing import Any, Callable, Dict, Optional
+
+import psutil
+
+from core.state import shared_state_configured
+
+WORKER_MAX_MEMORY_MB = int(os.getenv("WORKER_MAX_MEMORY_MB", "0"))  # 0 = pas de limite
+WORKER_MEMORY_CHECK_EVERY = int(os.getenv("WORKER_MEMORY_CHECK_EVERY", "25"))
+
+
+def default_worker_count() -> int:
+    """
+    Nombre de workers : WEB_CONCURRENCY, sinon un par cœur disponible
+
+    Sans STATE_BACKEND_URL, un seul worker par défaut : chaque processus aurait sinon ses
+    propres confirmations en attente, préchargements, totaux et limites de session,
+    verrous de scraping et quota Reddit.
+    """
+    configured = os.getenv("WEB_CONCURRENCY")
+    if configured:
+        return max(1, int(configured))
+    if not shared_state_configured():
+        return 1
+    try:
+        # Cœurs réellement attribués au conteneur (affinité), pas ceux de l'hôte
+        return max(1, len(os.sched_getaffinity(0)))
+    except AttributeError:
+        return max(1, os.cpu_count() or 1)
+
+
+def unshared_state_warning(workers: int) -> Optional[str]:
+    """Avertissement à afficher si plusieurs workers tournent sans état partagé"""
+    if workers <= 1 or shared_state_configured():
+        return None
+    return (
+        f"⚠️⚠️ {workers} workers SANS état partagé (STATE_BACKEND_URL vide) : confirmations "
+        "en attente, préchargements, totaux et limites de session, verrous de scraping et "
+        f"quota Reddit sont propres à chaque worker (quota réel : {workers} × "
+        "REDDIT_REQUESTS_PER_MINUTE). Configurez STATE_BACKEND_URL=redis://... ou WEB_CONCURRENCY=1."
+    )
+
+
+def runs_background_tasks() -> bool:
+    """
+    True si ce processus exécute les tâches de fond (planificateur de watchlist,
+    rafraîchissement des profils, synchronisation de l'index de recherche)
+
+    Sous gunicorn, un seul worker reçoit le rôle (BACKGROUND_WORKER, cf. gunicorn.conf.py) ;
+    hors gunicorn, le processus unique les exécute.
+    """
+    return os.getenv("MANAGED_WORKER") != "1" or os.getenv("BACKGROUND_WORKER") == "1"
+
+
+class LazyClient:
+    """
+    Client construit au premier accès, une fois par processus
+
+    S'utilise comme le client lui-même (les attributs sont délégués).
+    Après un fork, le processus enfant reconstruit sa propre instance.
+
+    Args:
+        name: Nom du client (logs)
+        factory: Fonction qui construit le client
+    """
+
+    def __init__(self, name: str, factory: Callable[[], Any]):
+        self._name = name
+        self._factory = factory
+        self._instance: Any = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def get(self) -> Any:
+        pid = os.getpid()
+        if self._instance is None or self._pid != pid:
+            with self._lock:
+                if self._instance is None or self._pid != pid:
+                    self._instance = self._factory()
+                    self._pid = pid
+                    print(f"🔌 Client {self._name} initialisé (worker {pid})")
+        return self._instance
+
+    def __getattr__(self, attribute: str) -> Any:
+        return getattr(self.get(), attribute)
+
+
+# ===== RECYCLAGE =====
+
+_requests_served = 0
+_recycle_requested = False
+_recycle_lock = threading.Lock()
+
+
+def worker_status() -> Dict[str, Any]:
+    """État du worker courant (exposé par /health)"""
+    return {
+        "pid": os.getpid(),
+        "requests_served": _requests_served,
+        "memory_mb": round(psutil.Process().memory_info().rss / 1024 / 1024, 1),
+        "draining": _recycle_requested,
+    }
+
+
+def request_recycle(reason: str) -> None:
+    """
+    Demande l'arrêt en douceur du worker courant
+
+    SIGTERM : le worker n'accepte plus de connexions, termine les requêtes en cours
+    (graceful_timeout) puis s'arrête ; le master gunicorn en démarre un nouveau.
+    """
+    global _recycle_requested
+    # MANAGED_WORKER est positionné par gunicorn.conf.py : un worker arrêté est remplacé par le master
+    if os.getenv("MANAGED_WORKER") != "1":
+        return
+    with _recycle_lock:
+        if _recycle_requested:
+            return
+        _recycle_requested = True
+    print(f"♻️ Recyclage du worker {os.getpid()}: {reason}")
+    os.kill(os.getpid(), signal.SIGTERM)
+
+
+def after_request() -> None:
+    """À appeler après chaque requête : vérifie périodiquement la mémoire du worker"""
+    global _requests_served
+    _requests_served += 1
+    if not WORKER_MAX_MEMORY_MB or _requests_served % WORKER_MEMORY_CHECK_EVERY:
+        return
+    memory_mb = psutil.Process().memory_info().rss / 1024 / 1024
+    if memory_mb > WORKER_MAX_MEMORY_MB:
+        request_recycle(f"mémoire {memory_mb:.0f} Mo > {WORKER_MAX_MEMORY_MB} Mo")
@@ -0,0 +1,52 @@
+"""
+Configuration gunicorn de production : N workers uvicorn (asyncio) sur le même port.
+
+Variables d'environnement :
+- WEB_CONCURRENCY : nombre de workers (défaut : un par cœur disponible si STATE_BACKEND_URL
+  est configuré, sinon un seul)
+- WORKER_MAX_REQUESTS / WORKER_MAX_REQUESTS_JITTER : recyclage après N requêtes
+- WORKER_GRACEFUL_TIMEOUT : temps laissé aux requêtes en cours à l'arrêt (analyses longues)
+- WORKER_MAX_MEMORY_MB : recyclage au-delà d'un seuil mémoire (cf. core/workers.py)
+"""
+import os
+
+from core.workers import default_worker_count, unshared_state_warning
+
+# Les workers héritent de l'environnement du master : ils savent qu'ils seront remplacés
+os.environ["MANAGED_WORKER"] = "1"
+
+bind = f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', '8000')}"
+workers = default_worker_count()
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Pas de preload : chaque worker importe l'application et construit ses propres clients
+preload_app = False
+
+max_requests = int(os.getenv("WORKER_MAX_REQUESTS", "1000"))
+max_requests_jitter = int(os.getenv("WORKER_MAX_REQUESTS_JITTER", "100"))
+graceful_timeout = int(os.getenv("WORKER_GRACEFUL_TIMEOUT", "120"))
+timeout = int(os.getenv("WORKER_TIMEOUT", "300"))
+keepalive = 5
+
+accesslog = "-"
+loglevel = os.getenv("LOG_LEVEL", "info")
+
+
+def when_ready(server):
+    print(f"🚀 {server.cfg.workers} workers prêts sur {bind}")
+    if warning := unshared_state_warning(server.cfg.workers):
+        print(warning)
+
+
+def pre_fork(server, worker):
+    # Un seul worker exécute les tâches de fond ; le remplaçant d'un worker recyclé hérite du rôle
+    worker.background = not any(getattr(w, "background", False) for w in server.WORKERS.values())
+
+
+def post_fork(server, worker):
+    if worker.background:
+        os.environ["BACKGROUND_WORKER"] = "1"
+
+
+def worker_exit(server, worker):
+    print(f"👋 Worker {worker.pid} arrêté")
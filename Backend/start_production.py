@@ -1,24 +1,43 @@
 #!/usr/bin/env python3
 """
 Script de démarrage pour la production (Railway)
+
+Lance gunicorn avec N workers uvicorn (cf. gunicorn.conf.py). Sans gunicorn
+(Windows), repli sur un seul processus uvicorn.
 """
 import os
-import uvicorn
-from core.api import app
+import sys
+
+from core.workers import default_worker_count, unshared_state_warning
 
 if __name__ == "__main__":
     # Configuration pour la production
     host = os.getenv("HOST", "0.0.0.0")
     port = int(os.getenv("PORT", 8000))
-    
+    workers = default_worker_count()
+
     print("🚀 Démarrage du serveur API en production...")
     print(f"📡 Host: {host}")
     print(f"📡 Port: {port}")
+    print(f"👷 Workers: {workers}")
+    if warning := unshared_state_warning(workers):
+        print(warning)
     print("=" * 50)
-    
-    uvicorn.run(
-        app,
-        host=host,
-        port=port,
-        log_level="info"
-    ) 
\ No newline at end of file
+
+    try:
+        from gunicorn.app.wsgiapp import run
+    except ImportError:
+        import uvicorn
+
+        print("⚠️ gunicorn indisponible : un seul worker uvicorn")
+        uvicorn.run(
+            "core.api:app",
+            host=host,
+            port=port,
+            log_level="info",
+            timeout_graceful_shutdown=int(os.getenv("WORKER_GRACEFUL_TIMEOUT", "120"))
+        )
+    else:
+        config = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gunicorn.conf.py")
+        sys.argv = ["gunicorn", "--config", config, "core.api:app"]
+        run()
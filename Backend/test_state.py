@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Test rapide des backends d'état partagé (core.state)
+
+Vérifie get / set / lock / push / pop sur MemoryBackend et sur RedisBackend :
+contre un serveur local si TEST_REDIS_URL est défini (ex: redis://localhost:6379/15),
+sinon contre fakeredis (en mémoire), s'il est installé.
+"""
+
+import os
+import threading
+import time
+
+from core.state import MemoryBackend, RedisBackend
+
+
+def redis_backend():
+    """RedisBackend de test, ou None si ni serveur ni fakeredis ne sont disponibles"""
+    url = os.getenv("TEST_REDIS_URL")
+    if url:
+        return RedisBackend(url, prefix="ras_test:")
+    try:
+        import fakeredis
+    except ImportError:
+        return None
+    return RedisBackend(client=fakeredis.FakeRedis(decode_responses=True), prefix="ras_test:")
+
+
+def check_backend(backend):
+    """Opérations de base d'un backend (lève AssertionError en cas d'écart)"""
+    backend.delete_prefix("")
+
+    # get / set / expiration
+    assert backend.get("absent") is None
+    backend.set("clé", {"posts": [1, 2], "ok": True})
+    assert backend.get("clé") == {"posts": [1, 2], "ok": True}
+    backend.set("éphémère", "x", ttl=0.1)
+    time.sleep(0.2)
+    assert backend.get("éphémère") is None
+    backend.delete("clé")
+    assert backend.get("clé") is None
+
+    # compteurs
+    backend.incr_fields("usage", {"tokens": 10, "requests": 1})
+    assert backend.incr_fields("usage", {"tokens": 5}) == {"tokens": 15, "requests": 1}
+
+    # verrou exclusif, libéré à la sortie
+    with backend.lock("scrape", ttl=5, wait=0) as acquired:
+        assert acquired
+        with backend.lock("scrape", ttl=5, wait=0.1) as again:
+            assert not again
+    with backend.lock("scrape", ttl=5, wait=0) as acquired:
+        assert acquired
+
+    # file FIFO, pop bloquant réveillé par un push
+    backend.push("jobs", {"id": 1})
+    backend.push("jobs", {"id": 2})
+    assert backend.queue_length("jobs") == 2
+    assert backend.pop("jobs") == {"id": 1}
+    assert backend.pop("jobs") == {"id": 2}
+    assert backend.pop("jobs") is None
+    threading.Timer(0.1, backend.push, ("jobs", {"id": 3})).start()
+    assert backend.pop("jobs", timeout=2) == {"id": 3}
+
+    backend.delete_prefix("")
+
+
+def test_memory_backend():
+    check_backend(MemoryBackend())
+
+
+def test_redis_backend():
+    backend = redis_backend()
+    if backend is None:
+        import pytest
+        pytest.skip("ni TEST_REDIS_URL ni fakeredis")
+    check_backend(backend)
+
+
+if __name__ == "__main__":
+    print("🧪 Test des backends d'état partagé")
+    print("=" * 50)
+    check_backend(MemoryBackend())
+    print("✅ MemoryBackend")
+    backend = redis_backend()
+    if backend is None:
+        print("⚠️ RedisBackend non testé (ni TEST_REDIS_URL ni fakeredis)")
+    else:
+        check_backend(backend)
+        print("✅ RedisBackend")